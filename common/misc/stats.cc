@@ -3,6 +3,7 @@
 #include "hooks_manager.h"
 #include "utils.h"
 #include "itostr.h"
+#include "config.hpp"
 
 #include <math.h>
 #include <stdio.h>
@@ -27,10 +28,20 @@ const char* db_create_stmts[] = {
    // Other users
    "CREATE TABLE `topology` (componentname TEXT, coreid INTEGER, masterid INTEGER);",
    "CREATE TABLE `event` (event INTEGER, time INTEGER, core INTEGER, thread INTEGER, value0 INTEGER, value1 INTEGER, description TEXT);",
+   "CREATE INDEX `idx_event_time` ON `event`(`time`);",
+   // Multi-resolution time series (periodic-stats): each level is a ring of snapshots, slots are overwritten in place
+   "CREATE TABLE `timeseries_levels` (level INTEGER, interval INTEGER, capacity INTEGER);",
+   "CREATE TABLE `timeseries` (level INTEGER, slot INTEGER, time INTEGER);",
+   "CREATE TABLE `timeseries_values` (level INTEGER, slot INTEGER, nameid INTEGER, core INTEGER, value INTEGER);",
+   "CREATE INDEX `idx_timeseries_values_slot` ON `timeseries_values`(`level`, `slot`);",
 };
 const char db_insert_stmt_name[] = "INSERT INTO `names` (nameid, objectname, metricname) VALUES (?, ?, ?);";
 const char db_insert_stmt_prefix[] = "INSERT INTO `prefixes` (prefixid, prefixname) VALUES (?, ?);";
 const char db_insert_stmt_value[] = "INSERT INTO `values` (prefixid, nameid, core, value) VALUES (?, ?, ?, ?);";
+const char db_delete_stmt_timeseries[] = "DELETE FROM `timeseries` WHERE level = ? AND slot = ?;";
+const char db_delete_stmt_timeseries_values[] = "DELETE FROM `timeseries_values` WHERE level = ? AND slot = ?;";
+const char db_insert_stmt_timeseries[] = "INSERT INTO `timeseries` (level, slot, time) VALUES (?, ?, ?);";
+const char db_insert_stmt_timeseries_value[] = "INSERT INTO `timeseries_values` (level, slot, nameid, core, value) VALUES (?, ?, ?, ?, ?);";
 
 UInt64 getWallclockTimeCallback(String objectName, UInt32 index, String metricName, UInt64 arg)
 {
@@ -43,6 +54,12 @@ UInt64 getWallclockTimeCallback(String objectName, UInt32 index, String metricNa
 StatsManager::StatsManager()
    : m_keyid(0)
    , m_prefixnum(0)
+   , m_async(false)
+   , m_async_backlog(0)
+   , m_writing(0)
+   , m_thread(NULL)
+   , m_thread_stop(false)
+   , m_thread_done(false)
    , m_db(NULL)
 {
    init();
@@ -52,6 +69,18 @@ StatsManager::StatsManager()
 
 StatsManager::~StatsManager()
 {
+   if (m_thread)
+   {
+      flush();
+
+      ScopedLock sl(m_queue_lock);
+      m_thread_stop = true;
+      m_queue_cond.broadcast();
+      while (!m_thread_done)
+         m_queue_cond.wait(m_queue_lock);
+      delete m_thread;
+   }
+
    for(StatsObjectList::iterator it1 = m_objects.begin(); it1 != m_objects.end(); ++it1)
       for (StatsMetricList::iterator it2 = it1->second.begin(); it2 != it1->second.end(); ++it2)
          for(StatsIndexList::iterator it3 = it2->second.second.begin(); it3 != it2->second.second.end(); ++it3)
@@ -62,6 +91,10 @@ StatsManager::~StatsManager()
       sqlite3_finalize(m_stmt_insert_name);
       sqlite3_finalize(m_stmt_insert_prefix);
       sqlite3_finalize(m_stmt_insert_value);
+      sqlite3_finalize(m_stmt_delete_timeseries);
+      sqlite3_finalize(m_stmt_delete_timeseries_values);
+      sqlite3_finalize(m_stmt_insert_timeseries);
+      sqlite3_finalize(m_stmt_insert_timeseries_value);
       sqlite3_close(m_db);
    }
 }
@@ -75,8 +108,10 @@ StatsManager::init()
    unlink(filename.c_str());
    ret = sqlite3_open(filename.c_str(), &m_db);
    LOG_ASSERT_ERROR(ret == SQLITE_OK, "Cannot create DB");
+   m_async = Sim()->getCfg()->getBoolDefault("stats/async_write", false);
    sqlite3_exec(m_db, "PRAGMA synchronous = OFF", NULL, NULL, NULL);
-   sqlite3_exec(m_db, "PRAGMA journal_mode = MEMORY", NULL, NULL, NULL);
+   // With asynchronous writes, use a write-ahead log so Python scripts can read the database while the writer thread is busy
+   sqlite3_exec(m_db, m_async ? "PRAGMA journal_mode = WAL" : "PRAGMA journal_mode = MEMORY", NULL, NULL, NULL);
    sqlite3_busy_handler(m_db, __busy_handler, this);
 
    for(unsigned int i = 0; i < sizeof(db_create_stmts)/sizeof(db_create_stmts[0]); ++i)
@@ -89,6 +124,10 @@ StatsManager::init()
    sqlite3_prepare(m_db, db_insert_stmt_name, -1, &m_stmt_insert_name, NULL);
    sqlite3_prepare(m_db, db_insert_stmt_prefix, -1, &m_stmt_insert_prefix, NULL);
    sqlite3_prepare(m_db, db_insert_stmt_value, -1, &m_stmt_insert_value, NULL);
+   sqlite3_prepare(m_db, db_delete_stmt_timeseries, -1, &m_stmt_delete_timeseries, NULL);
+   sqlite3_prepare(m_db, db_delete_stmt_timeseries_values, -1, &m_stmt_delete_timeseries_values, NULL);
+   sqlite3_prepare(m_db, db_insert_stmt_timeseries, -1, &m_stmt_insert_timeseries, NULL);
+   sqlite3_prepare(m_db, db_insert_stmt_timeseries_value, -1, &m_stmt_insert_timeseries_value, NULL);
 
    sqlite3_exec(m_db, "BEGIN TRANSACTION", NULL, NULL, NULL);
    for(StatsObjectList::iterator it1 = m_objects.begin(); it1 != m_objects.end(); ++it1)
@@ -99,6 +138,14 @@ StatsManager::init()
       }
    }
    sqlite3_exec(m_db, "END TRANSACTION", NULL, NULL, NULL);
+
+   if (m_async)
+   {
+      m_async_backlog = Sim()->getCfg()->getInt("stats/async_backlog");
+      LOG_ASSERT_ERROR(m_async_backlog > 0, "stats/async_backlog must be at least 1");
+      m_thread = _Thread::create(this);
+      m_thread->run();
+   }
 }
 
 int
@@ -130,20 +177,36 @@ StatsManager::recordStats(String prefix)
 {
    LOG_ASSERT_ERROR(m_db, "m_db not yet set up !?");
 
-   // Allow lazily-maintained statistics to be updated
-   Sim()->getHooksManager()->callHooks(HookType::HOOK_PRE_STAT_WRITE, (UInt64)prefix.c_str());
+   StatsSnapshot *snapshot = captureSnapshot(prefix);
+   snapshot->prefixid = ++m_prefixnum;
+   snapshot->prefix = prefix;
 
-   int res;
-   int prefixid = ++m_prefixnum;
+   writeSnapshot(snapshot);
+}
 
-   res = sqlite3_exec(m_db, "BEGIN TRANSACTION", NULL, NULL, NULL);
-   LOG_ASSERT_ERROR(res == SQLITE_OK, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
+void
+StatsManager::recordTimeSeries(UInt64 time, const std::vector<std::pair<UInt32, UInt32> > &slots)
+{
+   LOG_ASSERT_ERROR(m_db, "m_db not yet set up !?");
 
-   sqlite3_reset(m_stmt_insert_prefix);
-   sqlite3_bind_int(m_stmt_insert_prefix, 1, prefixid);
-   sqlite3_bind_text(m_stmt_insert_prefix, 2, prefix.c_str(), -1, SQLITE_TRANSIENT);
-   res = sqlite3_step(m_stmt_insert_prefix);
-   LOG_ASSERT_ERROR(res == SQLITE_DONE, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
+   // Overwrite each of the (level, slot) entries with the current values
+   StatsSnapshot *snapshot = captureSnapshot("timeseries");
+   snapshot->time = time;
+   snapshot->slots = slots;
+
+   writeSnapshot(snapshot);
+}
+
+StatsManager::StatsSnapshot *
+StatsManager::captureSnapshot(String prefix)
+{
+   // Allow lazily-maintained statistics to be updated
+   Sim()->getHooksManager()->callHooks(HookType::HOOK_PRE_STAT_WRITE, (UInt64)prefix.c_str());
+
+   // Capture all values now, writing them to the database can be done later
+   StatsSnapshot *snapshot = new StatsSnapshot();
+   snapshot->prefixid = 0;
+   snapshot->time = 0;
 
    for(StatsObjectList::iterator it1 = m_objects.begin(); it1 != m_objects.end(); ++it1)
    {
@@ -153,21 +216,152 @@ StatsManager::recordStats(String prefix)
          {
             if (!it3->second->isDefault())
             {
-               sqlite3_reset(m_stmt_insert_value);
-               sqlite3_bind_int(m_stmt_insert_value, 1, prefixid);
-               sqlite3_bind_int(m_stmt_insert_value, 2, it2->second.first);   // Metric ID
-               sqlite3_bind_int(m_stmt_insert_value, 3, it3->second->index);  // Core ID
-               sqlite3_bind_int64(m_stmt_insert_value, 4, it3->second->recordMetric());
-               res = sqlite3_step(m_stmt_insert_value);
-               LOG_ASSERT_ERROR(res == SQLITE_DONE, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
+               StatsValue value = { it2->second.first, it3->second->index, it3->second->recordMetric() };
+               snapshot->values.push_back(value);
             }
          }
       }
    }
+
+   return snapshot;
+}
+
+void
+StatsManager::writeSnapshot(StatsSnapshot *snapshot)
+{
+   if (m_async)
+   {
+      ScopedLock sl(m_queue_lock);
+      // Bounded backlog: block the simulation if the writer thread can't keep up
+      while (m_queue.size() >= m_async_backlog)
+         m_queue_cond.wait(m_queue_lock);
+      m_queue.push_back(snapshot);
+      m_queue_cond.broadcast();
+   }
+   else
+   {
+      std::vector<StatsSnapshot*> snapshots(1, snapshot);
+      writeSnapshots(snapshots);
+      delete snapshot;
+   }
+}
+
+void
+StatsManager::writeSnapshots(const std::vector<StatsSnapshot*> &snapshots)
+{
+   ScopedLock sl(m_db_lock);
+   int res;
+
+   // Write all snapshots in a single transaction
+   res = sqlite3_exec(m_db, "BEGIN TRANSACTION", NULL, NULL, NULL);
+   LOG_ASSERT_ERROR(res == SQLITE_OK, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
+
+   for(std::vector<StatsSnapshot*>::const_iterator it = snapshots.begin(); it != snapshots.end(); ++it)
+   {
+      if (!(*it)->slots.empty())
+      {
+         writeTimeSeries(*it);
+         continue;
+      }
+
+      sqlite3_reset(m_stmt_insert_prefix);
+      sqlite3_bind_int(m_stmt_insert_prefix, 1, (*it)->prefixid);
+      sqlite3_bind_text(m_stmt_insert_prefix, 2, (*it)->prefix.c_str(), -1, SQLITE_TRANSIENT);
+      res = sqlite3_step(m_stmt_insert_prefix);
+      LOG_ASSERT_ERROR(res == SQLITE_DONE, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
+
+      for(std::vector<StatsValue>::const_iterator it2 = (*it)->values.begin(); it2 != (*it)->values.end(); ++it2)
+      {
+         sqlite3_reset(m_stmt_insert_value);
+         sqlite3_bind_int(m_stmt_insert_value, 1, (*it)->prefixid);
+         sqlite3_bind_int(m_stmt_insert_value, 2, it2->nameid);  // Metric ID
+         sqlite3_bind_int(m_stmt_insert_value, 3, it2->index);   // Core ID
+         sqlite3_bind_int64(m_stmt_insert_value, 4, it2->value);
+         res = sqlite3_step(m_stmt_insert_value);
+         LOG_ASSERT_ERROR(res == SQLITE_DONE, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
+      }
+   }
+
    res = sqlite3_exec(m_db, "END TRANSACTION", NULL, NULL, NULL);
    LOG_ASSERT_ERROR(res == SQLITE_OK, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
 }
 
+void
+StatsManager::writeTimeSeries(const StatsSnapshot *snapshot)
+{
+   // Called from writeSnapshots(), with m_db_lock held and inside a transaction
+   int res;
+
+   for(std::vector<std::pair<UInt32, UInt32> >::const_iterator it = snapshot->slots.begin(); it != snapshot->slots.end(); ++it)
+   {
+      sqlite3_stmt *stmts[] = { m_stmt_delete_timeseries, m_stmt_delete_timeseries_values, m_stmt_insert_timeseries };
+      for(unsigned int i = 0; i < sizeof(stmts)/sizeof(stmts[0]); ++i)
+      {
+         sqlite3_reset(stmts[i]);
+         sqlite3_bind_int(stmts[i], 1, it->first);   // Level
+         sqlite3_bind_int(stmts[i], 2, it->second);  // Slot
+         if (stmts[i] == m_stmt_insert_timeseries)
+            sqlite3_bind_int64(stmts[i], 3, snapshot->time);
+         res = sqlite3_step(stmts[i]);
+         LOG_ASSERT_ERROR(res == SQLITE_DONE, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
+      }
+
+      for(std::vector<StatsValue>::const_iterator it2 = snapshot->values.begin(); it2 != snapshot->values.end(); ++it2)
+      {
+         sqlite3_reset(m_stmt_insert_timeseries_value);
+         sqlite3_bind_int(m_stmt_insert_timeseries_value, 1, it->first);
+         sqlite3_bind_int(m_stmt_insert_timeseries_value, 2, it->second);
+         sqlite3_bind_int(m_stmt_insert_timeseries_value, 3, it2->nameid);
+         sqlite3_bind_int(m_stmt_insert_timeseries_value, 4, it2->index);
+         sqlite3_bind_int64(m_stmt_insert_timeseries_value, 5, it2->value);
+         res = sqlite3_step(m_stmt_insert_timeseries_value);
+         LOG_ASSERT_ERROR(res == SQLITE_DONE, "Error executing SQL statement: %s", sqlite3_errmsg(m_db));
+      }
+   }
+}
+
+void
+StatsManager::run()
+{
+   // Writer thread: take everything that was queued since the last batch, and write it out in one transaction
+   ScopedLock sl(m_queue_lock);
+   while (true)
+   {
+      while (m_queue.empty() && !m_thread_stop)
+         m_queue_cond.wait(m_queue_lock);
+      if (m_queue.empty())
+         break;
+
+      std::vector<StatsSnapshot*> snapshots(m_queue.begin(), m_queue.end());
+      m_queue.clear();
+      m_writing = snapshots.size();
+      m_queue_cond.broadcast();
+
+      m_queue_lock.release();
+      writeSnapshots(snapshots);
+      for(std::vector<StatsSnapshot*>::iterator it = snapshots.begin(); it != snapshots.end(); ++it)
+         delete *it;
+      m_queue_lock.acquire();
+
+      m_writing = 0;
+      m_queue_cond.broadcast();
+   }
+   m_thread_done = true;
+   m_queue_cond.broadcast();
+}
+
+void
+StatsManager::flush()
+{
+   // Wait until all snapshots recorded so far are in the database
+   if (!m_async)
+      return;
+
+   ScopedLock sl(m_queue_lock);
+   while (!m_queue.empty() || m_writing)
+      m_queue_cond.wait(m_queue_lock);
+}
+
 void
 StatsManager::registerMetric(StatsMetricBase *metric)
 {
@@ -183,6 +377,7 @@ StatsManager::registerMetric(StatsMetricBase *metric)
       if (m_db)
       {
          // Metrics name record was already written, but a new metric was registered afterwards: write a new record
+         ScopedLock sl(m_db_lock);
          recordMetricName(m_keyid, _objectName, _metricName);
       }
    }
@@ -204,6 +399,7 @@ StatsManager::getMetricObject(String objectName, UInt32 index, String metricName
 void
 StatsManager::logTopology(String component, core_id_t core_id, core_id_t master_id)
 {
+   ScopedLock sl(m_db_lock);
    sqlite3_stmt *stmt;
    sqlite3_prepare(m_db, "INSERT INTO topology (componentname, coreid, masterid) VALUES (?, ?, ?);", -1, &stmt, NULL);
    sqlite3_bind_text(stmt, 1, component.c_str(), -1, SQLITE_TRANSIENT);
@@ -220,6 +416,7 @@ StatsManager::logEvent(event_type_t event, SubsecondTime time, core_id_t core_id
    if (time == SubsecondTime::MaxTime())
       time = Sim()->getClockSkewMinimizationServer()->getGlobalTime();
 
+   ScopedLock sl(m_db_lock);
    sqlite3_stmt *stmt;
    sqlite3_prepare(m_db, "INSERT INTO event (event, time, core, thread, value0, value1, description) VALUES (?, ?, ?, ?, ?, ?, ?);", -1, &stmt, NULL);
    sqlite3_bind_int(stmt, 1, event);
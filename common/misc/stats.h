@@ -2,9 +2,14 @@
 
 #include "simulator.h"
 #include "itostr.h"
+#include "_thread.h"
+#include "lock.h"
+#include "cond.h"
 
 #include <strings.h>
 #include <sqlite3.h>
+#include <deque>
+#include <vector>
 
 class StatsMetricBase
 {
@@ -55,7 +60,7 @@ class StatsMetricCallback : public StatsMetricBase
 };
 
 
-class StatsManager
+class StatsManager : public Runnable
 {
    public:
       // Event type                 core              thread            arg0           arg1              description
@@ -66,12 +71,21 @@ class StatsManager
          EVENT_APP_EXIT,         // -1                -1                app id         0                 ""
          EVENT_THREAD_CREATE,    // initial core      created thread    app id         creator thread    ""
          EVENT_THREAD_EXIT,      // current core      exiting thread    0              0                 ""
+         // Logged from Python by sim.util.EventLog (syscalls.py, synctrace.py)
+         EVENT_THREAD_START,     // -1                thread            0              0                 ""
+         EVENT_THREAD_STALL,     // -1                thread            0              0                 stall reason
+         EVENT_THREAD_RESUME,    // -1                thread            woken by       0                 ""
+         EVENT_THREAD_MIGRATE,   // new core          thread            0              0                 ""
+         EVENT_SYSCALL_ENTER,    // current core      thread            syscall nr     0                 arguments (blob, 6x int64)
+         EVENT_SYSCALL_EXIT,     // current core      thread            return value   syscall nr        "emulated" or ""
       } event_type_t;
 
       StatsManager();
       ~StatsManager();
       void init();
       void recordStats(String prefix);
+      void recordTimeSeries(UInt64 time, const std::vector<std::pair<UInt32, UInt32> > &slots);
+      void flush();
       void registerMetric(StatsMetricBase *metric);
       StatsMetricBase *getMetricObject(String objectName, UInt32 index, String metricName);
       void logTopology(String component, core_id_t core_id, core_id_t master_id);
@@ -80,13 +94,46 @@ class StatsManager
       void logEvent(event_type_t event, SubsecondTime time, core_id_t core_id, thread_id_t thread_id, UInt64 value0, UInt64 value1, const char * description);
 
    private:
+      // Values of all non-default metrics at the time of a recordStats() call
+      struct StatsValue
+      {
+         UInt64 nameid;
+         UInt32 index;
+         UInt64 value;
+      };
+      struct StatsSnapshot
+      {
+         UInt64 prefixid;
+         String prefix;
+         // For time series snapshots: time and the (level, slot) entries to overwrite
+         UInt64 time;
+         std::vector<std::pair<UInt32, UInt32> > slots;
+         std::vector<StatsValue> values;
+      };
+
       UInt64 m_keyid;
       UInt64 m_prefixnum;
 
+      // With stats/async_write, snapshots are queued here and written out by a background thread
+      bool m_async;
+      UInt64 m_async_backlog;
+      std::deque<StatsSnapshot*> m_queue;
+      UInt64 m_writing;
+      Lock m_queue_lock;
+      ConditionVariable m_queue_cond;
+      _Thread *m_thread;
+      bool m_thread_stop;
+      bool m_thread_done;
+
+      Lock m_db_lock; // Serializes access to m_db between the simulation and writer threads
       sqlite3 *m_db;
       sqlite3_stmt *m_stmt_insert_name;
       sqlite3_stmt *m_stmt_insert_prefix;
       sqlite3_stmt *m_stmt_insert_value;
+      sqlite3_stmt *m_stmt_delete_timeseries;
+      sqlite3_stmt *m_stmt_delete_timeseries_values;
+      sqlite3_stmt *m_stmt_insert_timeseries;
+      sqlite3_stmt *m_stmt_insert_timeseries_value;
 
       // Use std::string here because String (__versa_string) does not provide a hash function for STL containers with gcc < 4.6
       typedef std::unordered_map<UInt64, StatsMetricBase *> StatsIndexList;
@@ -99,6 +146,11 @@ class StatsManager
       int busy_handler(int count);
 
       void recordMetricName(UInt64 keyId, std::string objectName, std::string metricName);
+      StatsSnapshot *captureSnapshot(String prefix);
+      void writeSnapshot(StatsSnapshot *snapshot);
+      void writeSnapshots(const std::vector<StatsSnapshot*> &snapshots);
+      void writeTimeSeries(const StatsSnapshot *snapshot);
+      void run();
 };
 
 template <class T> void registerStatsMetric(String objectName, UInt32 index, String metricName, T *metric)
@@ -48,6 +48,57 @@ getBbv(PyObject *self, PyObject *args)
    return pRet;
 }
 
+//////////
+// get_buffer(): retrieve a core's BBV as packed 64-bit integers, into buffer when given
+//   Returns the instruction count when filling a buffer, (instruction count, string) otherwise
+//////////
+
+static PyObject *
+getBbvBuffer(PyObject *self, PyObject *args)
+{
+   core_id_t core_id = -1;
+   PyObject *pBuffer = NULL, *pData = NULL;
+   UInt64 *values = NULL;
+
+   if (!PyArg_ParseTuple(args, "l|O", &core_id, &pBuffer))
+      return NULL;
+
+   if (core_id >= (core_id_t)Sim()->getConfig()->getApplicationCores()) {
+      PyErr_SetString(PyExc_ValueError, "Core does not exist");
+      return NULL;
+   }
+
+   if (pBuffer) {
+      void *buffer = NULL;
+      Py_ssize_t length = 0;
+      if (PyObject_AsWriteBuffer(pBuffer, &buffer, &length) < 0)
+         return NULL;
+      if (length < BbvCount::NUM_BBV * (Py_ssize_t)sizeof(UInt64)) {
+         PyErr_SetString(PyExc_ValueError, "Buffer too small");
+         return NULL;
+      }
+      values = (UInt64 *)buffer;
+   } else {
+      pData = PyString_FromStringAndSize(NULL, BbvCount::NUM_BBV * sizeof(UInt64));
+      if (!pData)
+         return NULL;
+      values = (UInt64 *)PyString_AS_STRING(pData);
+   }
+
+   BbvCount *bbv = Sim()->getCoreManager()->getCoreFromID(core_id)->getBbvCount();
+   for(int i = 0; i < BbvCount::NUM_BBV; ++i)
+      values[i] = bbv->getDimension(i);
+
+   PyObject *pInstrs = PyLong_FromUnsignedLong(bbv->getInstructionCount());
+   if (pBuffer)
+      return pInstrs;
+
+   PyObject *pRet = PyTuple_New(2);
+   PyTuple_SET_ITEM(pRet, 0, pInstrs);
+   PyTuple_SET_ITEM(pRet, 1, pData);
+   return pRet;
+}
+
 
 //////////
 // module definition
@@ -57,6 +108,7 @@ static PyMethodDef PyBbvMethods[] = {
    {"enable", enableBbv, METH_VARARGS, "Enable BBV collection."},
    {"disable", disableBbv, METH_VARARGS, "Enable BBV collection."},
    {"get",  getBbv, METH_VARARGS, "Retrieve cummulative BBV for core."},
+   {"get_buffer",  getBbvBuffer, METH_VARARGS, "Retrieve cummulative BBV for core as packed 64-bit integers, optionally into a writable buffer."},
    {NULL, NULL, 0, NULL} /* Sentinel */
 };
 
@@ -121,6 +121,141 @@ getStatsGetter(PyObject *self, PyObject *args)
 }
 
 
+//////////
+// getter_group(): return a statsGetterGroup Python object which, when called, reads a list of stats values at once
+//   Calling it without arguments returns the values as a string of packed 64-bit unsigned integers,
+//   calling it with a writable buffer (e.g. array.array('L')) fills in the buffer instead
+//////////
+
+typedef struct {
+   PyObject_HEAD
+   StatsMetricBase **metrics;
+   Py_ssize_t size;
+} statsGetterGroupObject;
+
+static void
+statsGetterGroupDealloc(PyObject *self)
+{
+   delete [] ((statsGetterGroupObject *)self)->metrics;
+   PyObject_Del(self);
+}
+
+static PyObject *
+statsGetterGroupGet(PyObject *self, PyObject *args, PyObject *kw)
+{
+   statsGetterGroupObject *group = (statsGetterGroupObject *)self;
+   PyObject *pBuffer = NULL, *pResult = NULL;
+   UInt64 *values = NULL;
+
+   if (!PyArg_ParseTuple(args, "|O", &pBuffer))
+      return NULL;
+
+   if (pBuffer) {
+      void *buffer = NULL;
+      Py_ssize_t length = 0;
+      if (PyObject_AsWriteBuffer(pBuffer, &buffer, &length) < 0)
+         return NULL;
+      if (length < group->size * (Py_ssize_t)sizeof(UInt64)) {
+         PyErr_SetString(PyExc_ValueError, "Buffer too small");
+         return NULL;
+      }
+      values = (UInt64 *)buffer;
+      Py_INCREF(Py_None);
+      pResult = Py_None;
+   } else {
+      pResult = PyString_FromStringAndSize(NULL, group->size * sizeof(UInt64));
+      if (!pResult)
+         return NULL;
+      values = (UInt64 *)PyString_AS_STRING(pResult);
+   }
+
+   // Metrics that were not found (with allow_missing set) read as zero
+   for (Py_ssize_t i = 0; i < group->size; ++i)
+      values[i] = group->metrics[i] ? group->metrics[i]->recordMetric() : 0;
+
+   return pResult;
+}
+
+static Py_ssize_t
+statsGetterGroupLength(PyObject *self)
+{
+   return ((statsGetterGroupObject *)self)->size;
+}
+
+static PySequenceMethods statsGetterGroupSequence = {
+   statsGetterGroupLength,    /*sq_length*/
+};
+
+static PyTypeObject statsGetterGroupType = {
+   PyObject_HEAD_INIT(NULL)
+   0,                         /*ob_size*/
+   "statsGetterGroup",        /*tp_name*/
+   sizeof(statsGetterGroupObject), /*tp_basicsize*/
+   0,                         /*tp_itemsize*/
+   statsGetterGroupDealloc,   /*tp_dealloc*/
+   0,                         /*tp_print*/
+   0,                         /*tp_getattr*/
+   0,                         /*tp_setattr*/
+   0,                         /*tp_compare*/
+   0,                         /*tp_repr*/
+   0,                         /*tp_as_number*/
+   &statsGetterGroupSequence, /*tp_as_sequence*/
+   0,                         /*tp_as_mapping*/
+   0,                         /*tp_hash */
+   statsGetterGroupGet,       /*tp_call*/
+   0,                         /*tp_str*/
+   0,                         /*tp_getattro*/
+   0,                         /*tp_setattro*/
+   0,                         /*tp_as_buffer*/
+   Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+   "Stats getter group objects", /*tp_doc*/
+};
+
+static PyObject *
+getStatsGetterGroup(PyObject *self, PyObject *args)
+{
+   PyObject *pMetrics = NULL;
+   int allowMissing = 0;
+
+   if (!PyArg_ParseTuple(args, "O|i", &pMetrics, &allowMissing))
+      return NULL;
+
+   PyObject *pSeq = PySequence_Fast(pMetrics, "First argument must be a sequence of (objectName, index, metricName) tuples");
+   if (!pSeq)
+      return NULL;
+
+   Py_ssize_t size = PySequence_Fast_GET_SIZE(pSeq);
+   StatsMetricBase **metrics = new StatsMetricBase*[size];
+
+   for (Py_ssize_t i = 0; i < size; ++i) {
+      const char *objectName = NULL, *metricName = NULL;
+      long int index = -1;
+
+      if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(pSeq, i), "sls", &objectName, &index, &metricName)) {
+         delete [] metrics;
+         Py_DECREF(pSeq);
+         return NULL;
+      }
+
+      metrics[i] = Sim()->getStatsManager()->getMetricObject(objectName, index, metricName);
+
+      if (!metrics[i] && !allowMissing) {
+         PyErr_Format(PyExc_ValueError, "Stats metric not found: %s[%ld].%s", objectName, index, metricName);
+         delete [] metrics;
+         Py_DECREF(pSeq);
+         return NULL;
+      }
+   }
+   Py_DECREF(pSeq);
+
+   statsGetterGroupObject *pGroup = PyObject_New(statsGetterGroupObject, &statsGetterGroupType);
+   pGroup->metrics = metrics;
+   pGroup->size = size;
+
+   return (PyObject *)pGroup;
+}
+
+
 //////////
 // write(): write the current set of statistics out to sim.stats or our own file
 //////////
@@ -139,6 +274,54 @@ writeStats(PyObject *self, PyObject *args)
 }
 
 
+//////////
+// write_timeseries(): write the current set of statistics into the multi-resolution time series store
+//////////
+
+static PyObject *
+writeTimeSeries(PyObject *self, PyObject *args)
+{
+   unsigned long long time = 0;
+   PyObject *pSlots = NULL;
+
+   if (!PyArg_ParseTuple(args, "KO", &time, &pSlots))
+      return NULL;
+
+   PyObject *pSeq = PySequence_Fast(pSlots, "Second argument must be a sequence of (level, slot) tuples");
+   if (!pSeq)
+      return NULL;
+
+   std::vector<std::pair<UInt32, UInt32> > slots;
+   for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(pSeq); ++i) {
+      unsigned int level = 0, slot = 0;
+      if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(pSeq, i), "II", &level, &slot)) {
+         Py_DECREF(pSeq);
+         return NULL;
+      }
+      slots.push_back(std::pair<UInt32, UInt32>(level, slot));
+   }
+   Py_DECREF(pSeq);
+
+   if (!slots.empty())
+      Sim()->getStatsManager()->recordTimeSeries(time, slots);
+
+   Py_RETURN_NONE;
+}
+
+
+//////////
+// flush(): wait until all statistics written so far are in the database (stats/async_write)
+//////////
+
+static PyObject *
+flushStats(PyObject *self, PyObject *args)
+{
+   Sim()->getStatsManager()->flush();
+
+   Py_RETURN_NONE;
+}
+
+
 //////////
 // register(): register a callback function that returns a statistics value
 //////////
@@ -246,7 +429,10 @@ getIcount(PyObject *self, PyObject *args)
 static PyMethodDef PyStatsMethods[] = {
    {"get",  getStatsValue, METH_VARARGS, "Retrieve current value of statistic (objectName, index, metricName)."},
    {"getter", getStatsGetter, METH_VARARGS, "Return object to retrieve statistics value."},
+   {"getter_group", getStatsGetterGroup, METH_VARARGS, "Return object to retrieve a list of statistics values at once ([(objectName, index, metricName), ...], [allow_missing])."},
    {"write", writeStats, METH_VARARGS, "Write statistics (<prefix>, [<filename>])."},
+   {"write_timeseries", writeTimeSeries, METH_VARARGS, "Write statistics into the time series store (time, [(level, slot), ...])."},
+   {"flush", flushStats, METH_VARARGS, "Wait until all statistics written so far are in the database."},
    {"register", registerStats, METH_VARARGS, "Register callback that defines statistics value for (objectName, index, metricName)."},
    {"register_per_thread", registerPerThread, METH_VARARGS, "Add a per-thread statistic (perthreadName) based on a named statistic (objectName, metricName)."},
    {"marker", writeMarker, METH_VARARGS, "Record a marker (coreid, threadid, arg0, arg1, [description])."},
@@ -265,4 +451,11 @@ void HooksPy::PyStats::setup(void)
 
    Py_INCREF(&statsGetterType);
    PyModule_AddObject(pModule, "Getter", (PyObject *)&statsGetterType);
+
+   statsGetterGroupType.tp_new = PyType_GenericNew;
+   if (PyType_Ready(&statsGetterGroupType) < 0)
+      return;
+
+   Py_INCREF(&statsGetterGroupType);
+   PyModule_AddObject(pModule, "GetterGroup", (PyObject *)&statsGetterGroupType);
 }
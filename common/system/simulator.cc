@@ -163,6 +163,8 @@ Simulator::~Simulator()
    }
 
    m_stats_manager->recordStats("stop");
+   // Make sure all statistics are in sim.stats.sqlite3 before scripts get to look at it
+   m_stats_manager->flush();
    m_hooks_manager->callHooks(HookType::HOOK_SIM_END, 0);
 
    TotalTimer::reports();
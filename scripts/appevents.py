@@ -1,12 +1,24 @@
+"""
+appevents.py
+
+Write a marker at application start and exit (application start and exit events are also in the event table, see dumpstats.py -e)
+1st argument, if set to print, also prints a line for each
+"""
+
 import sim
 
 class AppEvents:
+  def setup(self, args):
+    self.do_print = (args or '') == 'print'
+
   def hook_application_start(self, appid):
-    print '[APP]', appid, 'start'
+    if self.do_print:
+      print '[APP]', appid, 'start'
     sim.stats.marker(-1, -1, appid, 0, "application start")
 
   def hook_application_exit(self, appid):
-    print '[APP]', appid, 'exit'
+    if self.do_print:
+      print '[APP]', appid, 'exit'
     sim.stats.marker(-1, -1, appid, 0, "application exit")
 
 sim.util.register(AppEvents())
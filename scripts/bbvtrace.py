@@ -3,58 +3,86 @@ bbvtrace.py
 
 Write a trace of BBV deltas for all cores.
 Argument is either a filename, or none to write to standard output.
+  (filenames ending in .bin, .bin.gz or .bin.zst give compact binary output, see tools/sniper_trace.py)
+Second argument is the interval size in nanoseconds (default is 100000)
+Third argument, if present, is a filename to write the raw per-interval BBVs to, for offline phase analysis:
+  for each core the instruction count followed by the BBV_SIZE BBV dimensions (use a .bin filename for binary output)
 """
 
 import sys, os, sim
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 class Bbv:
-  def __init__(self, init = None):
-    if init:
-      self.ninstrs = init[0]
-      self.bbv = list(init[1])
+  # Cumulative BBVs of all cores: instruction counts (ncores) and BBV dimensions (ncores x BBV_SIZE)
+  # Uses numpy arrays, filled directly by sim.bbv.get_buffer, when available
+  def __init__(self, ninstrs = None, bbv = None):
+    if ninstrs is not None:
+      self.ninstrs = ninstrs
+      self.bbv = bbv
+    elif numpy:
+      self.ninstrs = numpy.zeros(sim.config.ncores, dtype = numpy.int64)
+      self.bbv = numpy.zeros((sim.config.ncores, sim.bbv.BBV_SIZE), dtype = numpy.int64)
     else:
-      self.ninstrs = 0
-      self.bbv = [ 0 for i in range(sim.bbv.BBV_SIZE) ]
+      self.ninstrs = [ 0 for core in range(sim.config.ncores) ]
+      self.bbv = [ [ 0 for i in range(sim.bbv.BBV_SIZE) ] for core in range(sim.config.ncores) ]
+  @staticmethod
+  def get():
+    if numpy:
+      bbv = numpy.empty((sim.config.ncores, sim.bbv.BBV_SIZE), dtype = numpy.uint64)
+      ninstrs = numpy.array([ sim.bbv.get_buffer(core, bbv[core]) for core in range(sim.config.ncores) ], dtype = numpy.int64)
+      return Bbv(ninstrs, bbv.astype(numpy.int64))
+    else:
+      bbvs = [ sim.bbv.get(core) for core in range(sim.config.ncores) ]
+      return Bbv([ ninstrs for ninstrs, bbv in bbvs ], [ list(bbv) for ninstrs, bbv in bbvs ])
   def delta(self, bbv):
-    delta = Bbv()
-    delta.ninstrs = bbv.ninstrs - self.ninstrs;
-    for i in range(sim.bbv.BBV_SIZE):
-      delta.bbv[i] = bbv.bbv[i] - self.bbv[i]
-    return delta
+    if numpy:
+      return Bbv(bbv.ninstrs - self.ninstrs, bbv.bbv - self.bbv)
+    else:
+      return Bbv([ n1 - n0 for n0, n1 in zip(self.ninstrs, bbv.ninstrs) ],
+                 [ [ v1 - v0 for v0, v1 in zip(b0, b1) ] for b0, b1 in zip(self.bbv, bbv.bbv) ])
   def diff(self, bbv):
-    diff = 0
-    for i in range(sim.bbv.BBV_SIZE):
-      diff += abs(bbv.bbv[i]/(bbv.ninstrs or 1) - self.bbv[i]/(self.ninstrs or 1))
-    return diff
+    # Manhattan distance between the per-instruction BBVs, for each core
+    if numpy:
+      normalized = lambda b: b.bbv // numpy.maximum(b.ninstrs, 1)[:,numpy.newaxis]
+      return numpy.abs(normalized(bbv) - normalized(self)).sum(axis = 1)
+    else:
+      return [ sum([ abs(v1/(n1 or 1) - v0/(n0 or 1)) for v0, v1 in zip(b0, b1) ])
+               for n0, b0, n1, b1 in zip(self.ninstrs, self.bbv, bbv.ninstrs, bbv.bbv) ]
+  def raw(self):
+    # Instruction count, then all dimensions, for each core
+    if numpy:
+      return numpy.hstack((self.ninstrs[:,numpy.newaxis], self.bbv))
+    else:
+      return sum([ [ ninstrs ] + bbv for ninstrs, bbv in zip(self.ninstrs, self.bbv) ], [])
 
 class BbvTrace:
   def setup(self, args):
     sim.bbv.enable()
     args = dict(enumerate((args or '').split(':')))
     filename = args.get(0, None)
-    interval_ns = long(args.get(1, 100000))
-    if filename:
-      self.fd = file(os.path.join(sim.config.output_dir, filename), 'w')
-      self.isTerminal = False
+    interval_ns = long(args.get(1, '') or 100000)
+    filename_raw = args.get(2, None)
+    self.trace = sim.util.TraceWriter(filename, 'bbv-diff', 'BBV', interval_ns * sim.util.Time.NS, format = '%d', dtype = 'uint64')
+    if filename_raw:
+      self.trace_raw = sim.util.TraceWriter(filename_raw, 'bbv', 'BBV-RAW', interval_ns * sim.util.Time.NS, format = '%d', dtype = 'uint64', width = 1 + sim.bbv.BBV_SIZE)
     else:
-      self.fd = sys.stdout
-      self.isTerminal = True
-    self.bbvprev = [ Bbv() for i in range(sim.config.ncores) ]
-    self.deltaprev = [ Bbv() for i in range(sim.config.ncores) ]
+      self.trace_raw = None
+    self.bbvprev = Bbv()
+    self.deltaprev = Bbv()
     sim.util.Every(interval_ns * sim.util.Time.NS, self.periodic, roi_only = True)
 
   def periodic(self, time, time_delta):
-    if self.isTerminal:
-      self.fd.write('[BBV] ')
-    self.fd.write('%u' % (time / 1e6)) # Time in ns
-    for core in range(sim.config.ncores):
-      bbv = Bbv(sim.bbv.get(core))
-      delta = self.bbvprev[core].delta(bbv)
-      diff = self.deltaprev[core].diff(delta)
-      self.bbvprev[core] = bbv
-      self.deltaprev[core] = delta
-      self.fd.write(' %d' % diff)
-    self.fd.write('\n')
+    bbv = Bbv.get()
+    delta = self.bbvprev.delta(bbv)
+    diff = self.deltaprev.diff(delta)
+    self.bbvprev = bbv
+    self.deltaprev = delta
+    self.trace.write(time / 1e6, diff) # Time in ns
+    if self.trace_raw:
+      self.trace_raw.write(time / 1e6, delta.raw())
 
 
 sim.util.register(BbvTrace())
@@ -3,9 +3,15 @@ Make energy available as a statistic by running a partial McPAT on every statist
 
 Works by registering a PRE_STAT_WRITE hook, which, before a stats snapshot write is triggered:
 - Writes the current statistics to the database using the energystats-temp prefix
-- Calls McPAT on the partial period (last-snapshot, energystats-temp)
+- Calls McPAT on the partial period (last-snapshot, energystats-temp), through a long-running tools/mcpat.py --serve process
 - Processes the McPAT results, making them available through custom-callback statistics
 - Finally the actual snapshot is written, including updated values for all energy counters
+
+Arguments: <interval in ns (default 1 ms)>:<power model file>
+The optional power model is made by tools/mcpat.py --calibrate on an earlier run,
+it replaces McPAT when accurate enough, with core power scaled to the current DVFS frequencies and voltages.
+Scaling is only used at operating points passed to --calibrate-dvfs (e.g. --calibrate-dvfs=2.0:1.0,1.8:0.9 for the 22 nm table below),
+McPAT is run for all others
 """
 
 import sys, os, sim
@@ -36,6 +42,7 @@ class EnergyStats:
   def setup(self, args):
     args = dict(enumerate((args or '').split(':')))
     interval_ns = long(args.get(0, None) or 1000000) # Default power update every 1 ms
+    self.power_model = args.get(1, None)
     sim.util.Every(interval_ns * sim.util.Time.NS, self.periodic, roi_only = True)
     self.dvfs_table = build_dvfs_table(int(sim.config.get('power/technology_node')))
     #
@@ -45,6 +52,7 @@ class EnergyStats:
     self.in_stats_write = False
     self.power = {}
     self.energy = {}
+    self.service = None
     for metric in ('energy-static', 'energy-dynamic'):
       for core in range(sim.config.ncores):
         sim.stats.register('core', core, metric, self.get_stat)
@@ -68,6 +76,8 @@ class EnergyStats:
   def hook_sim_end(self):
     if self.name_last:
       sim.util.db_delete(self.name_last, True)
+    if self.service:
+      self.service.close()
 
   def update(self):
     if sim.stats.time() == self.time_last_power:
@@ -124,36 +134,20 @@ class EnergyStats:
         return _v
     assert ValueError('Could not find a Vdd for invalid frequency %f' % f)
 
-  def gen_config(self, outputbase):
+  def gen_config(self):
     freq = [ sim.dvfs.get_frequency(core) for core in range(sim.config.ncores) ]
     vdd = [ self.get_vdd_from_freq(f) for f in freq ]
-    configfile = outputbase+'.cfg'
-    cfg = open(configfile, 'w')
-    cfg.write('''
+    return '''
 [perf_model/core]
 frequency[] = %s
 [power]
 vdd[] = %s
-    ''' % (','.join(map(lambda f: '%f' % (f / 1000.), freq)), ','.join(map(str, vdd))))
-    cfg.close()
-    return configfile
+    ''' % (','.join(map(lambda f: '%f' % (f / 1000.), freq)), ','.join(map(str, vdd)))
 
   def run_power(self, name0, name1):
-    outputbase = os.path.join(sim.config.output_dir, 'energystats-temp')
-
-    configfile = self.gen_config(outputbase)
-
-    os.system('unset PYTHONHOME; %s -d %s -o %s -c %s --partial=%s:%s --no-graph --no-text' % (
-      os.path.join(os.getenv('SNIPER_ROOT'), 'tools/mcpat.py'),
-      sim.config.output_dir,
-      outputbase,
-      configfile,
-      name0, name1
-    ))
-
-    result = {}
-    execfile(outputbase + '.py', {}, result)
-    return result['power']
+    if not self.service:
+      self.service = sim.util.PowerService(os.path.join(sim.config.output_dir, 'energystats-temp'), power_model = self.power_model)
+    return self.service.get_power(name0, name1, config = self.gen_config())
 
 # All scripts execute in global scope, so other scripts will be able to call energystats.update()
 energystats = EnergyStats()
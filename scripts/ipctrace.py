@@ -3,6 +3,7 @@ ipctrace.py
 
 Write a trace of instantaneous IPC values for all cores.
 First argument is either a filename, or none to write to standard output.
+  (filenames ending in .bin, .bin.gz or .bin.zst give compact binary output, see tools/sniper_trace.py)
 Second argument is the interval size in nanoseconds (default is 10000)
 """
 
@@ -13,38 +14,31 @@ class IpcTrace:
     args = dict(enumerate((args or '').split(':')))
     filename = args.get(0, None)
     interval_ns = long(args.get(1, 10000))
-    if filename:
-      self.fd = file(os.path.join(sim.config.output_dir, filename), 'w')
-      self.isTerminal = False
-    else:
-      self.fd = sys.stdout
-      self.isTerminal = True
+    self.trace = sim.util.TraceWriter(filename, 'ipc', 'IPC', interval_ns * sim.util.Time.NS)
     self.sd = sim.util.StatsDelta()
     self.stats = {
-      'time': [ self.sd.getter('performance_model', core, 'elapsed_time') for core in range(sim.config.ncores) ],
-      'ffwd_time': [ self.sd.getter('fastforward_performance_model', core, 'fastforwarded_time') for core in range(sim.config.ncores) ],
-      'instrs': [ self.sd.getter('performance_model', core, 'instruction_count') for core in range(sim.config.ncores) ],
-      'coreinstrs': [ self.sd.getter('core', core, 'instructions') for core in range(sim.config.ncores) ],
+      'time': self.sd.getter_group('performance_model', 'elapsed_time'),
+      'ffwd_time': self.sd.getter_group('fastforward_performance_model', 'fastforwarded_time'),
+      'instrs': self.sd.getter_group('performance_model', 'instruction_count'),
+      'coreinstrs': self.sd.getter_group('core', 'instructions'),
     }
     sim.util.Every(interval_ns * sim.util.Time.NS, self.periodic, statsdelta = self.sd, roi_only = True)
 
   def periodic(self, time, time_delta):
-    if self.isTerminal:
-      self.fd.write('[IPC] ')
-    self.fd.write('%u' % (time / 1e6)) # Time in ns
+    ipcs = []
     for core in range(sim.config.ncores):
       # detailed-only IPC
-      cycles = (self.stats['time'][core].delta - self.stats['ffwd_time'][core].delta) * sim.dvfs.get_frequency(core) / 1e9 # convert fs to cycles
-      instrs = self.stats['instrs'][core].delta
+      cycles = (self.stats['time'].delta[core] - self.stats['ffwd_time'].delta[core]) * sim.dvfs.get_frequency(core) / 1e9 # convert fs to cycles
+      instrs = self.stats['instrs'].delta[core]
       ipc = instrs / (cycles or 1) # Avoid division by zero
       #self.fd.write(' %.3f' % ipc)
 
       # include fast-forward IPCs
-      cycles = self.stats['time'][core].delta * sim.dvfs.get_frequency(core) / 1e9 # convert fs to cycles
-      instrs = self.stats['coreinstrs'][core].delta
+      cycles = self.stats['time'].delta[core] * sim.dvfs.get_frequency(core) / 1e9 # convert fs to cycles
+      instrs = self.stats['coreinstrs'].delta[core]
       ipc = instrs / (cycles or 1)
-      self.fd.write(' %.3f' % ipc)
-    self.fd.write('\n')
+      ipcs.append(ipc)
+    self.trace.write(time / 1e6, ipcs) # Time in ns
 
 
 sim.util.register(IpcTrace())
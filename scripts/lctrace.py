@@ -3,6 +3,7 @@ lctrace.py
 
 Write a trace of LightCache miss rates (in misses per 1000 instructions) for all cores.
 First argument is either a filename, or none to write to standard output.
+  (filenames ending in .bin, .bin.gz or .bin.zst give compact binary output, see tools/sniper_trace.py)
 Second argument is an interval in nanoseconds (default = 10000)
 """
 
@@ -13,30 +14,23 @@ class LCTrace:
     args = dict(enumerate((args or '').split(':')))
     filename = args.get(0, None)
     interval_ns = long(args.get(1, 10000))
-    if filename:
-      self.fd = file(os.path.join(sim.config.output_dir, filename), 'w')
-      self.isTerminal = False
-    else:
-      self.fd = sys.stdout
-      self.isTerminal = True
+    self.trace = sim.util.TraceWriter(filename, 'lc-mpki', 'LC', interval_ns * sim.util.Time.NS, format = '%.1f')
     self.sd = sim.util.StatsDelta()
     self.stats = {
-      'time': [ self.sd.getter('performance_model', core, 'elapsed_time') for core in range(sim.config.ncores) ],
-      'instrs': [ self.sd.getter('core', core, 'instructions') for core in range(sim.config.ncores) ],
-      'misses': [ self.sd.getter('light_cache', core, 'misses') for core in range(sim.config.ncores) ],
+      'time': self.sd.getter_group('performance_model', 'elapsed_time'),
+      'instrs': self.sd.getter_group('core', 'instructions'),
+      'misses': self.sd.getter_group('light_cache', 'misses'),
     }
     sim.util.Every(interval_ns * sim.util.Time.NS, self.periodic, statsdelta = self.sd, roi_only = True)
 
   def periodic(self, time, time_delta):
-    if self.isTerminal:
-      self.fd.write('[LC] ')
-    self.fd.write('%u' % (time / 1e6)) # Time in ns
+    rates = []
     for core in range(sim.config.ncores):
-      instrs = self.stats['instrs'][core].delta
-      misses = self.stats['misses'][core].delta
+      instrs = self.stats['instrs'].delta[core]
+      misses = self.stats['misses'].delta[core]
       rate = 1000 * misses / (instrs or 1)
-      self.fd.write(' %.1f' % rate)
-    self.fd.write('\n')
+      rates.append(rate)
+    self.trace.write(time / 1e6, rates) # Time in ns
 
 
 sim.util.register(LCTrace())
@@ -4,6 +4,12 @@ periodic-stats.py
 Periodically write out all statistics
 1st argument is the interval size in nanoseconds (default is 1e9 = 1 second of simulated time)
 2rd argument, if present will limit the number of snapshots and dynamically remove itermediate data
+3rd argument, if present, is a number of levels: instead of removing data, use the multi-resolution time series store,
+  with each level holding up to <2nd argument> snapshots, where every next level keeps one in <4th argument> (default 4)
+  snapshots of the previous one. This keeps the recent history at full resolution and older history at coarser ones.
+  The last level covers the whole run: when it is full, every other snapshot is removed from it and its interval doubles
+  (as without levels), so only the finer levels drop their oldest snapshots.
+  Snapshots are read back as periodic-<time>, see SniperStatsBase.read_timeseries()
 """
 
 import sim
@@ -13,31 +19,75 @@ class PeriodicStats:
     args = dict(enumerate((args or '').split(':')))
     interval = long(args.get(0, '') or 1000000000)
     self.max_snapshots = long(args.get(1, 0))
+    self.levels = long(args.get(2, 0))
+    self.factor = long(args.get(3, 4))
     self.num_snapshots = 0
     self.interval = long(interval * sim.util.Time.NS)
     self.next_interval = float('inf')
     self.in_roi = False
+    if self.levels:
+      if self.max_snapshots < 2:
+        raise ValueError('periodic-stats: the time series store requires a maximum of at least two snapshots per level')
+      self.setup_timeseries()
     sim.util.Every(self.interval, self.periodic, roi_only = True)
 
+  def setup_timeseries(self):
+    c = sim.stats.db.cursor()
+    c.execute('DELETE FROM timeseries_levels')
+    for level in range(self.levels):
+      c.execute('INSERT INTO timeseries_levels (level, interval, capacity) VALUES (?, ?, ?)', (level, self.interval * self.factor**level, self.max_snapshots))
+    sim.stats.db.commit()
+    # Last level: snapshot numbers it holds, with their slot, and the number of snapshots between two of its entries
+    self.top = self.levels - 1
+    self.top_every = self.factor**self.top
+    self.top_slots = {}
+
+  def decimate_top(self):
+    # Keep every other snapshot of the last level, freeing half of its slots
+    self.top_every *= 2
+    drop = [ n for n in self.top_slots if n % self.top_every ]
+    # Snapshots may still be queued for writing (stats/async_write)
+    sim.stats.flush()
+    c = sim.stats.db.cursor()
+    for n in drop:
+      c.execute('DELETE FROM timeseries WHERE level = ? AND slot = ?', (self.top, self.top_slots[n]))
+      c.execute('DELETE FROM timeseries_values WHERE level = ? AND slot = ?', (self.top, self.top_slots[n]))
+      del self.top_slots[n]
+    c.execute('UPDATE timeseries_levels SET interval = ? WHERE level = ?', (self.interval * self.top_every, self.top))
+    sim.stats.db.commit()
+
+  def write(self):
+    if self.levels:
+      # Snapshot number n goes into each level it is a multiple of that level's interval, overwriting the oldest slot
+      n = self.num_snapshots
+      slots = [ (level, (n / self.factor**level) % self.max_snapshots) for level in range(self.top) if n % self.factor**level == 0 ]
+      if n % self.top_every == 0 and len(self.top_slots) >= self.max_snapshots:
+        self.decimate_top()
+      if n % self.top_every == 0:
+        self.top_slots[n] = min(set(range(self.max_snapshots)) - set(self.top_slots.values()))
+        slots.append((self.top, self.top_slots[n]))
+      sim.stats.write_timeseries(n * self.interval, slots)
+    else:
+      sim.stats.write('periodic-%d' % (self.num_snapshots * self.interval))
+
   def hook_roi_begin(self):
     self.in_roi = True
     self.next_interval = sim.stats.time() + self.interval
-    sim.stats.write('periodic-0')
+    self.write()
 
   def hook_roi_end(self):
     self.next_interval = float('inf')
     self.in_roi = False
 
   def periodic(self, time, time_delta):
-    if self.max_snapshots and self.num_snapshots > self.max_snapshots:
+    if not self.levels and self.max_snapshots and self.num_snapshots > self.max_snapshots:
       self.num_snapshots /= 2
-      for t in range(self.interval, time, self.interval * 2):
-        sim.util.db_delete('periodic-%d' % t)
+      sim.util.db_delete([ 'periodic-%d' % t for t in range(self.interval, time, self.interval * 2) ])
       self.interval *= 2
 
     if time >= self.next_interval:
       self.num_snapshots += 1
-      sim.stats.write('periodic-%d' % (self.num_snapshots * self.interval))
+      self.write()
       self.next_interval += self.interval
 
 sim.util.register(PeriodicStats())
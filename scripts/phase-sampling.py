@@ -0,0 +1,159 @@
+# Online phase detection and sampled simulation.
+#
+# Every interval of X instructions (over all cores), the BBVs of all cores are
+# combined into a signature and assigned to the nearest of at most Y phase centroids,
+# or to a new phase if it is more than a distance Z away from all of them.
+# The next interval is assumed to belong to the same phase: if that phase has fewer than
+# N detailed intervals it is simulated in detailed mode, otherwise in warmup
+# (default) or fast-forward mode.
+#
+# run-sniper -s phase-sampling:X:Y:Z:N:warmup|fastforward
+#
+# Defaults are X = 10M instructions, Y = 16 phases, Z = 0.1 and N = 2.
+# X should be a multiple of core/hook_periodic_ins/ins_global.
+# Z is the Manhattan distance between signatures, which are normalized to sum to one (so 0 <= Z <= 2).
+#
+# Detailed intervals are written to the statistics database as phasesample-<n>-begin/end snapshots,
+# phase weights and samples are written to sim.phases.json in the output directory.
+# Use sniper_lib.get_results(resultsdir = ..., phases = True) (or dumpstats.py --phases)
+# to extrapolate the detailed intervals to statistics for the complete ROI.
+
+import sys, os, sim
+try:
+  import json
+except ImportError:
+  json = None
+
+PHASES_FILENAME = 'sim.phases.json'
+
+
+class PhaseSampling:
+
+  def setup(self, args):
+    # Hooks do nothing unless setup completes
+    self.active = False
+    args = dict(enumerate((args or '').split(':')))
+    self.interval = long(args.get(0, '') or 10000000)
+    self.max_phases = int(args.get(1, '') or 16)
+    self.threshold = float(args.get(2, '') or 0.1)
+    self.detailed_intervals = int(args.get(3, '') or 2)
+    skip_mode = args.get(4, '') or 'warmup'
+
+    if skip_mode not in ('warmup', 'fastforward'):
+      print >> sys.stderr, '[PHASES] Invalid mode %s for skipped intervals, should be warmup or fastforward' % skip_mode
+      sim.control.abort()
+      return
+    if not json:
+      print >> sys.stderr, '[PHASES] Need the json module to write %s' % PHASES_FILENAME
+      sim.control.abort()
+      return
+    self.skip_mode = { 'warmup': sim.control.WARMUP, 'fastforward': sim.control.FASTFORWARD }[skip_mode]
+
+    min_interval = long(sim.config.get('core/hook_periodic_ins/ins_global'))
+    if self.interval < min_interval:
+      print '[PHASES] Interval shorter than the periodic instruction callback (%d), consider reducing core/hook_periodic_ins/ins_global' % min_interval
+
+    print '[PHASES] Intervals of %d instructions, at most %d phases with distance %.3f, %d detailed intervals per phase, %s otherwise' % \
+          (self.interval, self.max_phases, self.threshold, self.detailed_intervals, skip_mode)
+
+    sim.bbv.enable()
+    self.centroids = []   # Running mean signature of each phase
+    self.intervals = []   # Number of intervals assigned to each phase
+    self.instrs = []      # Number of instructions in each phase
+    self.samples = []     # Detailed intervals, as dictionaries (see write_phases)
+    self.sample = None    # Detailed interval currently being simulated, if any
+    self.bbv = None
+    self.in_roi = False
+    self.icount_next = 0
+    sim.util.EveryIns(min_interval, self.periodic_ins, roi_only = True)
+    self.active = True
+
+  def get_bbv(self):
+    # Cumulative instruction count and BBV dimensions of all cores
+    bbvs = [ sim.bbv.get(core) for core in range(sim.config.ncores) ]
+    return sum([ ninstrs for ninstrs, bbv in bbvs ]), sum([ list(bbv) for ninstrs, bbv in bbvs ], [])
+
+  def get_signature(self, bbv0, bbv1):
+    # BBV delta of all cores, normalized to sum to one
+    delta = [ v1 - v0 for v0, v1 in zip(bbv0, bbv1) ]
+    total = float(sum(delta)) or 1.
+    return [ v / total for v in delta ]
+
+  def classify(self, signature, ninstrs):
+    # Assign the interval to the nearest phase, creating a new one if it is too far off and we still can
+    distances = [ sum([ abs(v - c) for v, c in zip(signature, centroid) ]) for centroid in self.centroids ]
+    if distances:
+      phase = distances.index(min(distances))
+    if not distances or (distances[phase] > self.threshold and len(self.centroids) < self.max_phases):
+      phase = len(self.centroids)
+      self.centroids.append(signature)
+      self.intervals.append(0)
+      self.instrs.append(0)
+    self.intervals[phase] += 1
+    self.instrs[phase] += ninstrs
+    n = self.intervals[phase]
+    self.centroids[phase] = [ c + (v - c) / n for v, c in zip(signature, self.centroids[phase]) ]
+    return phase
+
+  def begin_interval(self, icount, phase):
+    # Predict that the next interval is in the same phase as the last one, simulate it in detail if we need more samples
+    if phase is not None and len([ s for s in self.samples if s['phase'] == phase ]) >= self.detailed_intervals:
+      if self.sample is not None:
+        sim.control.set_instrumentation_mode(self.skip_mode)
+        self.sample = None
+    else:
+      if self.sample is None:
+        sim.control.set_instrumentation_mode(sim.control.DETAILED)
+      name = 'phasesample-%d' % len(self.samples)
+      sim.stats.write(name + '-begin')
+      self.sample = { 'begin': name + '-begin', 'end': name + '-end', 'icount': icount }
+    self.icount_next = icount + self.interval
+
+  def end_interval(self):
+    ninstrs, bbv = self.get_bbv()
+    if ninstrs == self.bbv[0]:
+      # Empty interval (ROI ended right at an interval boundary), nothing to classify
+      return None
+    phase = self.classify(self.get_signature(self.bbv[1], bbv), ninstrs - self.bbv[0])
+    if self.sample is not None:
+      # Samples are assigned to the phase they turned out to be in, not the one we predicted
+      sim.stats.write(self.sample['end'])
+      self.sample.update({ 'phase': phase, 'instrs': ninstrs - self.bbv[0] })
+      self.samples.append(self.sample)
+    self.bbv = (ninstrs, bbv)
+    return phase
+
+  def hook_roi_begin(self):
+    if not self.active:
+      return
+    self.in_roi = True
+    self.bbv = self.get_bbv()
+    self.begin_interval(sim.stats.icount(), None)
+
+  def hook_roi_end(self):
+    if self.active and self.in_roi:
+      self.end_interval()
+      self.sample = None
+      self.in_roi = False
+      print '[PHASES] %d phases, %d of %d intervals simulated in detail' % (len(self.centroids), len(self.samples), sum(self.intervals))
+
+  def hook_sim_end(self):
+    if self.active:
+      self.write_phases()
+
+  def periodic_ins(self, icount, icount_delta):
+    if self.in_roi and icount >= self.icount_next:
+      phase = self.end_interval()
+      self.begin_interval(icount, phase)
+
+  def write_phases(self):
+    data = {
+      'interval': self.interval,
+      'phases': [ { 'intervals': intervals, 'instrs': instrs, 'centroid': centroid }
+                  for intervals, instrs, centroid in zip(self.intervals, self.instrs, self.centroids) ],
+      'samples': self.samples,
+    }
+    json.dump(data, open(os.path.join(sim.config.output_dir, PHASES_FILENAME), 'w'), indent = 2)
+
+
+sim.util.register(PhaseSampling())
@@ -1,5 +1,6 @@
 """
 Write out all statistics every 1M cycles and run a partial McPAT
+Arguments: <interval in ns (default 1 ms)>:<power model file (made by tools/mcpat.py --calibrate, used instead of McPAT when accurate)>
 """
 
 import sys, os, sim
@@ -8,8 +9,10 @@ class PowerTrace:
   def setup(self, args):
     args = dict(enumerate((args or '').split(':')))
     interval_ns = long(args.get(0, '') or 1000000)
+    self.power_model = args.get(1, None)
     sim.util.Every(interval_ns * sim.util.Time.NS, self.periodic, roi_only = True)
     self.t_last = 0
+    self.service = None
 
   def periodic(self, time, time_delta):
     time = long(time/1e6) # fs to ns
@@ -25,16 +28,14 @@ class PowerTrace:
 
   def hook_sim_end(self):
     self.do_power(self.t_last, None)
+    self.service.close()
 
   def do_power(self, t0, t1):
     _t0 = t0 or 'roi-begin'
     _t1 = t1 or 'roi-end'
     if not t1: t1 = self.t_roi_end
-    os.system('unset PYTHONHOME; %s -d %s -o %s --partial=%s:%s --no-graph' % (
-      os.path.join(os.getenv('SNIPER_ROOT'), 'tools/mcpat.py'),
-      sim.config.output_dir,
-      os.path.join(sim.config.output_dir, 'power-%s-%s-%s' % (t0, t1, t1 - t0)),
-      _t0, _t1
-    ))
+    if not self.service:
+      self.service = sim.util.PowerService(os.path.join(sim.config.output_dir, 'power'), power_model = self.power_model)
+    self.service.get_power(_t0, _t1, outputfile = os.path.join(sim.config.output_dir, 'power-%s-%s-%s' % (t0, t1, t1 - t0)))
 
 sim.util.register(PowerTrace())
@@ -1,4 +1,16 @@
-import sys, sim
+import sys, os, array, heapq, struct, subprocess, timeit, zlib, gzip, sim
+try:
+  import json
+except ImportError:
+  json = None
+try:
+  import numpy
+except ImportError:
+  numpy = None
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
 
 """
 Conversion factors for subsecondtime (femtoseconds) to other units
@@ -52,7 +64,9 @@ def register_command(mycmd, func):
 """
 Delta manager for statistics.
   StatsDeltaMetric keeps the current, last, and delta value for a given statistic
-  StatsDelta keeps a list of StatsDeltaMetric metrics and updates them all at once
+  StatsDeltaGroup does the same for one statistic across a list of indices (by default, all cores)
+  StatsDelta keeps a list of StatsDeltaMetric metrics and updates them all at once,
+    all StatsDeltaGroup metrics are read using a single sim.stats.getter_group() call
 
 Example usage:
 
@@ -70,6 +84,13 @@ Example usage:
         print self.instrs.delta / (cycles or 1)
 
   simutil.register(PrintIpc())
+
+For per-core statistics, use groups. last and delta are then indexed by core
+(NumPy arrays if NumPy is available, lists otherwise):
+
+      self.instrs = self.sd.getter_group("performance_model", "instruction_count")
+      ...
+      print [ self.instrs.delta[core] for core in range(sim.config.ncores) ]
 """
 
 class StatsDelta:
@@ -105,9 +126,20 @@ class StatsDelta:
         self.delta = now - self.last
       self.last = now
 
+  class StatsDeltaGroup:
+    """Internal object to store current, last and delta stats values for a list of indices.
+
+    Do not instantiate directly, use StatsDelta.getter_group() instead."""
+    def __init__(self, objectName, metricName, indices):
+      self.metrics = [ (objectName, index, metricName) for index in indices ]
+      self.last = None
+      self.delta = None
+
   def __init__(self):
     self.isFirst = True
     self.members = []
+    self.groups = []
+    self.groupGetter = None
 
   def getter(self, objectName, index, metricName):
     getter = self.StatsDeltaMetric(objectName, index, metricName)
@@ -120,7 +152,44 @@ class StatsDelta:
     self.members.append(get)
     return get
 
+  # Batched version of getter() for objectName[index].metricName across indices (default: all cores).
+  # Unless allow_missing is set, raises ValueError if any of the statistics does not exist; with allow_missing they read as zero.
+  def getter_group(self, objectName, metricName, indices = None, allow_missing = False):
+    if indices is None:
+      indices = range(sim.config.ncores)
+    group = self.StatsDeltaGroup(objectName, metricName, indices)
+    if not allow_missing:
+      sim.stats.getter_group(group.metrics)
+    self.groups.append(group)
+    # Rebuild the combined getter, deltas for all groups become available again after the next update
+    self.groupGetter = None
+    return group
+
+  def update_groups(self):
+    if self.groupGetter is None:
+      metrics = sum([ group.metrics for group in self.groups ], [])
+      self.groupGetter = sim.stats.getter_group(metrics, True)
+      self.groupValues = array.array('L', [ 0 ]) * len(metrics)
+      self.groupLast = None
+    self.groupGetter(self.groupValues)
+    if numpy:
+      now = numpy.frombuffer(self.groupValues, dtype = numpy.uint64).astype(numpy.float64)
+      delta = now - self.groupLast if self.groupLast is not None else None
+    else:
+      now = map(float, self.groupValues)
+      delta = [ v - l for v, l in zip(now, self.groupLast) ] if self.groupLast is not None else None
+    start = 0
+    for group in self.groups:
+      end = start + len(group.metrics)
+      group.last = now[start:end]
+      if delta is not None:
+        group.delta = delta[start:end]
+      start = end
+    self.groupLast = now
+
   def update(self):
+    if self.groups:
+      self.update_groups()
     for member in self.members:
       member.update()
     if self.isFirst:
@@ -130,19 +199,47 @@ class StatsDelta:
       return True
 
 
-class Every:
-  def __init__(self, interval, callback, statsdelta = None, roi_only = True):
-    min_interval = long(sim.config.get('clock_skew_minimization/barrier/quantum')) * 1e6
-    if interval < min_interval:
-      print >> sys.stderr, 'sim.util.Every(): interval(%dns) < periodic callback(%dns), consider reducing clock_skew_minimization/barrier/quantum' % (interval/1e6, min_interval/1e6)
-    self.interval = interval
-    self.callback = callback
-    self.statsdelta = statsdelta
-    self.roi_only = roi_only
-    self.time_next = 0
-    self.time_last = 0
+"""
+Shared dispatcher for periodic consumers (Every and EveryIns).
+  Registers a single HOOK_PERIODIC and/or HOOK_PERIODIC_INS callback, and keeps all consumers in heaps
+  keyed by their next deadline, so a barrier quantum where nothing is due costs a single comparison.
+  Consumers with roi_only set live in a separate heap which is only looked at inside the ROI.
+  When several consumers share a StatsDelta object, it is updated only once per tick.
+"""
+
+class PeriodicDispatcher:
+  def __init__(self):
     self.in_roi = False
-    register(self)
+    self.seq = 0
+    self.timers = [], [] # (time_next, seq, Every) heaps: always, roi_only
+    self.counters = [], [] # (icount_next, seq, EveryIns) heaps: always, roi_only
+    self.hooked_time = False
+    self.hooked_ins = False
+    sim.hooks.register(sim.hooks.HOOK_ROI_BEGIN, self.hook_roi_begin)
+    sim.hooks.register(sim.hooks.HOOK_ROI_END, self.hook_roi_end)
+
+  def add_timer(self, every):
+    if not self.hooked_time:
+      sim.hooks.register(sim.hooks.HOOK_PERIODIC, self.hook_periodic)
+      self.hooked_time = True
+    self.seq += 1
+    heapq.heappush(self.timers[bool(every.roi_only)], (every.time_next, self.seq, every))
+
+  def add_counter(self, everyins):
+    if not self.hooked_ins:
+      sim.hooks.register(sim.hooks.HOOK_PERIODIC_INS, self.hook_periodic_ins)
+      self.hooked_ins = True
+    self.seq += 1
+    heapq.heappush(self.counters[bool(everyins.roi_only)], (everyins.icount_next, self.seq, everyins))
+
+  def pop_due(self, heaps, now):
+    # Remove and return all entries with a deadline <= now, in registration order
+    due = []
+    for heap in heaps if self.in_roi else heaps[:1]:
+      while heap and heap[0][0] <= now:
+        due.append(heapq.heappop(heap) + (heap,))
+    due.sort(key = lambda (deadline, seq, consumer, heap): seq)
+    return due
 
   def hook_roi_begin(self):
     self.in_roi = True
@@ -153,18 +250,63 @@ class Every:
     self.in_roi = False
 
   def hook_periodic(self, time):
-    if (not self.roi_only or self.in_roi) and time >= self.time_next:
-      time_delta = time - self.time_last
-      self.time_next = time + self.interval
-      self.time_last = time
+    due = self.pop_due(self.timers, time)
+    if due:
+      updated = {}
+      try:
+        for deadline, seq, every, heap in due:
+          every.fire(time, updated)
+      finally:
+        # Re-insert only after all callbacks are done, so a zero interval can't make us loop,
+        # but also when one of them raised: consumers that did not fire yet are still due next time
+        for deadline, seq, every, heap in due:
+          heapq.heappush(heap, (every.time_next, seq, every))
 
-      if self.statsdelta:
-        doCall = self.statsdelta.update()
-      else:
-        doCall = True
+  def hook_periodic_ins(self, icount):
+    due = self.pop_due(self.counters, icount)
+    try:
+      for deadline, seq, everyins, heap in due:
+        everyins.fire(icount)
+    finally:
+      for deadline, seq, everyins, heap in due:
+        heapq.heappush(heap, (everyins.icount_next, seq, everyins))
+
+dispatcher = None
+def get_dispatcher():
+  global dispatcher
+  if dispatcher is None:
+    dispatcher = PeriodicDispatcher()
+  return dispatcher
+
+
+class Every:
+  def __init__(self, interval, callback, statsdelta = None, roi_only = True):
+    min_interval = long(sim.config.get('clock_skew_minimization/barrier/quantum')) * 1e6
+    if interval < min_interval:
+      print >> sys.stderr, 'sim.util.Every(): interval(%dns) < periodic callback(%dns), consider reducing clock_skew_minimization/barrier/quantum' % (interval/1e6, min_interval/1e6)
+    self.interval = interval
+    self.callback = callback
+    self.statsdelta = statsdelta
+    self.roi_only = roi_only
+    self.time_next = 0
+    self.time_last = 0
+    get_dispatcher().add_timer(self)
+
+  def fire(self, time, updated):
+    # updated: StatsDelta objects already updated during this tick, with the result of their update()
+    time_delta = time - self.time_last
+    self.time_next = time + self.interval
+    self.time_last = time
+
+    if self.statsdelta:
+      if id(self.statsdelta) not in updated:
+        updated[id(self.statsdelta)] = self.statsdelta.update()
+      doCall = updated[id(self.statsdelta)]
+    else:
+      doCall = True
 
-      if doCall:
-        self.callback(time, time_delta)
+    if doCall:
+      self.callback(time, time_delta)
 
 
 class EveryIns:
@@ -177,32 +319,30 @@ class EveryIns:
     self.roi_only = roi_only
     self.icount_next = interval
     self.icount_last = 0
-    self.in_roi = False
-    register(self)
-
-  def hook_roi_begin(self):
-    self.in_roi = True
-
-  def hook_roi_end(self):
-    self.in_roi = False
+    get_dispatcher().add_counter(self)
 
-  def hook_periodic_ins(self, icount):
-    if (not self.roi_only or self.in_roi) and icount >= self.icount_next:
-      icount_delta = icount - self.icount_last
-      self.icount_next += self.interval
-      self.icount_last = icount
+  def fire(self, icount):
+    icount_delta = icount - self.icount_last
+    self.icount_next += self.interval
+    self.icount_last = icount
 
-      self.callback(icount, icount_delta)
+    self.callback(icount, icount_delta)
 
 
 have_deleted_stats = False
-def db_delete(prefix, in_sim_end = False):
+def db_delete(prefixes, in_sim_end = False):
+  # Delete one or more (list of) snapshots from sim.stats.sqlite3, in a single transaction
   global have_deleted_stats
+  if isinstance(prefixes, basestring):
+    prefixes = [ prefixes ]
+  # Snapshots may still be queued for writing (stats/async_write)
+  sim.stats.flush()
   cursor = sim.stats.db.cursor()
-  prefixid = sim.stats.db.execute('SELECT prefixid FROM prefixes WHERE prefixname = ?', (prefix,)).fetchall()
-  if prefixid:
-    cursor.execute('DELETE FROM prefixes WHERE prefixid = ?', (prefixid[0][0],))
-    cursor.execute('DELETE FROM `values` WHERE prefixid = ?', (prefixid[0][0],))
+  for prefix in prefixes:
+    prefixid = cursor.execute('SELECT prefixid FROM prefixes WHERE prefixname = ?', (prefix,)).fetchall()
+    if prefixid:
+      cursor.execute('DELETE FROM prefixes WHERE prefixid = ?', (prefixid[0][0],))
+      cursor.execute('DELETE FROM `values` WHERE prefixid = ?', (prefixid[0][0],))
   sim.stats.db.commit()
   if not have_deleted_stats:
     if in_sim_end:
@@ -217,3 +357,446 @@ def db_delete_sim_end_vacuum():
   # We have deleted entries from the database, reclaim free space now
   sim.stats.db.cursor().execute('VACUUM')
   sim.stats.db.commit()
+
+
+
+"""
+Buffered event log, appends records to the event table of sim.stats.sqlite3 in batches instead of printing them
+  Records have the fixed layout of the event table: (event, time, core, thread, value0, value1, description),
+  event types beyond those logged by Sniper itself are listed below (see also StatsManager::event_type_t),
+  syscall arguments are stored as a binary blob of 6 int64 values.
+  Optionally only records syscalls with given numbers, and/or events of given threads.
+  Read back using sniper_stats.get_events(), or dumpstats.py -e [--time-range=<begin>:<end>]
+"""
+
+EVENT_THREAD_START, EVENT_THREAD_STALL, EVENT_THREAD_RESUME, EVENT_THREAD_MIGRATE, EVENT_SYSCALL_ENTER, EVENT_SYSCALL_EXIT = range(7, 13)
+
+class EventLog:
+  def __init__(self, syscalls = None, threads = None, batch_size = 4096):
+    self.syscalls = set(syscalls) if syscalls else None
+    self.threads = set(threads) if threads else None
+    self.batch_size = batch_size
+    self.rows = []
+    self.syscall_current = {} # thread -> syscall number, to filter syscall exits
+    sim.hooks.register(sim.hooks.HOOK_SIM_END, self.flush)
+
+  def log(self, event, time, core, thread, value0 = 0, value1 = 0, description = ''):
+    if self.threads and thread not in self.threads:
+      return
+    self.rows.append((event, time, core, thread, value0, value1, description))
+    if len(self.rows) >= self.batch_size:
+      self.flush()
+
+  def log_syscall_enter(self, thread, core, time, syscall_number, args):
+    self.syscall_current[thread] = syscall_number
+    if self.syscalls and syscall_number not in self.syscalls:
+      return
+    self.log(EVENT_SYSCALL_ENTER, time, core, thread, syscall_number, 0, buffer(struct.pack('<6q', *args)))
+
+  def log_syscall_exit(self, thread, core, time, ret_val, emulated):
+    syscall_number = self.syscall_current.pop(thread, -1)
+    if self.syscalls and syscall_number not in self.syscalls:
+      return
+    self.log(EVENT_SYSCALL_EXIT, time, core, thread, ret_val, syscall_number, 'emulated' if emulated else '')
+
+  def flush(self):
+    if not self.rows:
+      return
+    # Make sure we don't interleave with statistics still queued for writing (stats/async_write)
+    sim.stats.flush()
+    sim.stats.db.executemany('INSERT INTO event (event, time, core, thread, value0, value1, description) VALUES (?, ?, ?, ?, ?, ?, ?)', self.rows)
+    sim.stats.db.commit()
+    self.rows = []
+
+
+class PowerService:
+  # Runs tools/mcpat.py --serve once for the whole simulation, instead of starting tools/mcpat.py for every power update
+  # The service keeps the configuration, statistics database and McPAT templates loaded between requests
+  # power_model: surrogate power model made by tools/mcpat.py --calibrate, used instead of McPAT when accurate enough
+  def __init__(self, outputfile, power_model = None):
+    env = dict(os.environ)
+    env.pop('PYTHONHOME', None)
+    args = [ os.path.join(os.getenv('SNIPER_ROOT'), 'tools/mcpat.py'), '--serve', '-d', sim.config.output_dir, '-o', outputfile ]
+    if power_model:
+      args.append('--power-model=%s' % os.path.abspath(power_model))
+    self.proc = subprocess.Popen(args, stdin = subprocess.PIPE, stdout = subprocess.PIPE, env = env, close_fds = True)
+
+  def get_power(self, name0, name1, config = None, outputfile = None):
+    # Power for the interval between snapshots name0 and name1, with optional sim.cfg-style config overrides
+    request = { 'partial': [ name0, name1 ] }
+    if config:
+      request['config'] = config
+    if outputfile:
+      request['output'] = outputfile
+    # The service reads both snapshots from sim.stats.sqlite3, make sure they have been written out
+    sim.stats.flush()
+    self.proc.stdin.write(json.dumps(request) + '\n')
+    self.proc.stdin.flush()
+    reply = self.proc.stdout.readline()
+    if not reply:
+      raise RuntimeError('Power service exited unexpectedly')
+    reply = json.loads(reply)
+    if 'error' in reply:
+      raise RuntimeError('Power service: %s' % reply['error'])
+    return reply['power']
+
+  def close(self):
+    if self.proc:
+      self.proc.stdin.close()
+      self.proc.wait()
+      self.proc = None
+
+
+"""
+Output for the *trace.py scripts, one record of per-core values per interval
+Text output has a line per interval: time in ns, then one value per core (prefixed with [<tag>] when writing to the terminal)
+Filenames ending in .bin, .bin.gz or .bin.zst get binary output instead, read it with tools/sniper_trace.py:
+  magic (8 bytes), header length (uint32), JSON header (metric, tag, cores, width, interval in fs, dtype, compression, block_rows),
+  padding up to a multiple of 8 bytes, followed by fixed-width rows of time (uint64, ns) and width values (float32 or uint64) per core
+  .bin.gz files are gzip-compressed as a whole (zcat gives the .bin file),
+  .bin.zst files hold zstd-compressed blocks of block_rows rows, each preceded by row count and size (2x uint32)
+"""
+
+TRACE_MAGIC = 'SNIPRTRC'
+TRACE_VERSION = 1
+
+class TraceWriter:
+  def __init__(self, filename, metric, tag, interval, format = '%.3f', dtype = 'float32', width = 1, block_rows = 1024):
+    self.tag = tag
+    self.dtype = { 'float32': '<f4', 'uint64': '<u8' }[dtype]
+    self.format = format
+    self.block_rows = block_rows
+    self.rows = []
+    self.binary = bool(filename) and (filename.endswith('.bin') or filename.endswith('.bin.gz') or filename.endswith('.bin.zst'))
+    if filename and self.binary and filename.endswith('.gz'):
+      self.fd = gzip.GzipFile(os.path.join(sim.config.output_dir, filename), 'wb')
+      self.isTerminal = False
+    elif filename:
+      self.fd = file(os.path.join(sim.config.output_dir, filename), 'wb' if self.binary else 'w')
+      self.isTerminal = False
+    else:
+      self.fd = sys.stdout
+      self.isTerminal = True
+    if self.binary:
+      if filename.endswith('.zst') and zstandard:
+        self.compression = 'zstd'
+        self.compressor = zstandard.ZstdCompressor()
+      elif filename.endswith('.zst'):
+        print >> sys.stderr, '[TRACE] zstandard module not available, compressing %s using zlib instead' % filename
+        self.compression = 'zlib'
+      else:
+        # Also for .gz, where the gzip file object compresses the whole stream
+        self.compression = 'none'
+      self.record = struct.Struct('<Q%d%s' % (sim.config.ncores * width, { 'float32': 'f', 'uint64': 'Q' }[dtype]))
+      header = json.dumps({ 'version': TRACE_VERSION, 'metric': metric, 'tag': tag, 'cores': sim.config.ncores, 'width': width, 'interval': long(interval),
+                            'dtype': dtype, 'compression': self.compression, 'block_rows': block_rows })
+      # Align the first row so readers can memory-map uncompressed files
+      header += ' ' * (-(len(TRACE_MAGIC) + 4 + len(header)) % 8)
+      self.fd.write(TRACE_MAGIC + struct.pack('<I', len(header)) + header)
+    sim.hooks.register(sim.hooks.HOOK_SIM_END, self.close)
+
+  def write(self, time, values):
+    # time in ns, values: width per core (a list, or a numpy array)
+    is_array = numpy is not None and isinstance(values, numpy.ndarray)
+    if is_array:
+      values = values.ravel()
+    if self.binary and is_array:
+      self.rows.append(struct.pack('<Q', long(time)) + values.astype(self.dtype).tostring())
+    elif self.binary:
+      self.rows.append(self.record.pack(long(time), *values))
+    else:
+      self.rows.append(('[%s] ' % self.tag if self.isTerminal else '') + '%u' % time + ''.join([ ' ' + self.format % value for value in values ]) + '\n')
+    if len(self.rows) >= self.block_rows or self.isTerminal:
+      self.flush()
+
+  def flush(self):
+    if not self.rows:
+      return
+    data = ''.join(self.rows)
+    if self.binary and self.compression != 'none':
+      if self.compression == 'zstd':
+        data = self.compressor.compress(data)
+      else:
+        data = zlib.compress(data)
+      data = struct.pack('<II', len(self.rows), len(data)) + data
+    self.fd.write(data)
+    self.rows = []
+
+  def close(self):
+    if self.fd:
+      self.flush()
+      if self.isTerminal:
+        self.fd.flush()
+      else:
+        self.fd.close()
+      self.fd = None
+
+
+
+"""
+Thread scheduler base, for scripts that decide which threads run on which cores by setting thread affinities
+  Runnable threads waiting for a core are kept in a heap ordered by score, so picking the next thread is O(log n),
+  a second heap over all live threads gives the minimum score used for threads that wake up.
+  Affinity changes are collected during each event and applied once at its end, only for threads whose core changed.
+  The score policy is pluggable: threads with the lowest accumulated score run first.
+    equal_time:         non-idle time
+    equal_instructions: instructions executed
+    criticality:        non-idle time, discounted by the core's memory CPI fraction (see tcp.py),
+                        so threads that stall on memory more often (critical threads) get more time
+  Overhead is counted in scheduler.* statistics: events, picks, affinity-updates and walltime (in microseconds).
+
+Example usage (this is scheduler-locality.py):
+
+  class SchedulerLocality(sim.util.Scheduler):
+    pass
+
+  sim.util.register(SchedulerLocality())
+
+Run with -s <script>:<interval in ns>:<policy>:<core mask>, or override pick_cores() to change which cores are used.
+"""
+
+class SchedulerPolicyTime:
+  metric = 'nonidle_elapsed_time'
+  def get_metric(self, thread_id):
+    return long(sim.stats.get('thread', thread_id, self.metric))
+  def update(self, time, time_delta):
+    pass
+  def get_score(self, thread_id, core, delta):
+    return delta
+
+class SchedulerPolicyInstructions(SchedulerPolicyTime):
+  metric = 'instruction_count'
+
+TCP_CPI_MEM = (
+  "cpiDataCacheL2", "cpiDataCacheL2_S", "cpiDataCacheL3", "cpiDataCacheL3_S",
+  "cpiDataCachecache-remote", "cpiDataCachedram-local", "cpiDataCachedram-remote",
+  "cpiDataCacheunknown",
+)
+
+class SchedulerPolicyCriticality(SchedulerPolicyTime):
+  def __init__(self):
+    self.sd = StatsDelta()
+    self.cpimem = [ self.sd.getter_group("interval_timer", cpi) for cpi in TCP_CPI_MEM ]
+    self.tcp = [ 0 for core in range(sim.config.ncores) ]
+  def update(self, time, time_delta):
+    if self.sd.update() and time_delta:
+      for core in range(sim.config.ncores):
+        self.tcp[core] = min(1000, int(1000 * sum([ c.delta[core] for c in self.cpimem ]) / time_delta))
+  def get_score(self, thread_id, core, delta):
+    return delta * (1000 - self.tcp[core]) / 1000
+
+SCHEDULER_POLICIES = {
+  'equal_time': SchedulerPolicyTime,
+  'equal_instructions': SchedulerPolicyInstructions,
+  'criticality': SchedulerPolicyCriticality,
+}
+
+
+class PriorityQueue:
+  # Heap of (key, item) with removal and re-keying of items, removed entries are skipped lazily
+  def __init__(self):
+    self.heap = []
+    self.entries = {}
+  def __len__(self):
+    return len(self.entries)
+  def __contains__(self, item):
+    return item in self.entries
+  def push(self, item, key):
+    self.remove(item)
+    entry = [ key, item ]
+    self.entries[item] = entry
+    heapq.heappush(self.heap, entry)
+    if len(self.heap) > 2 * len(self.entries) + 64:
+      self.heap = [ entry for entry in self.heap if entry[1] is not None ]
+      heapq.heapify(self.heap)
+  def remove(self, item):
+    entry = self.entries.pop(item, None)
+    if entry:
+      entry[1] = None
+  def peek(self):
+    while self.heap and self.heap[0][1] is None:
+      heapq.heappop(self.heap)
+    return self.heap[0][1] if self.heap else None
+  def pop(self):
+    item = self.peek()
+    if item is not None:
+      heapq.heappop(self.heap)
+      del self.entries[item]
+    return item
+
+
+class SchedulerThread:
+  def __init__(self, thread_id, metric):
+    self.thread_id = thread_id
+    self.core = None
+    self.runnable = False
+    self.unscheduled = False
+    self.score = 0          # Accumulated score
+    self.metric_last = metric # State at start of last interval
+  def key(self):
+    return (self.score, self.thread_id)
+  def __repr__(self):
+    return 'Thread(%d, %s, score = %d)' % (self.thread_id, 'core = %d' % self.core if self.core is not None else 'no core', self.score)
+
+
+def scheduler_event(func):
+  # Wrap a Scheduler hook: apply affinity changes once at the end, and account for the time spent
+  def wrapper(self, *args):
+    start = timeit.default_timer()
+    func(self, *args)
+    self.flush_affinity()
+    self.counters['events'] += 1
+    self.counters['walltime'] += timeit.default_timer() - start
+  return wrapper
+
+
+class Scheduler:
+
+  def setup(self, args):
+    args = dict(enumerate((args or '').split(':')))
+    interval_ns = long(args.get(0, None) or 10000000)
+    policy = args.get(1, '') or 'equal_time'
+    core_mask = args.get(2, '')
+    if core_mask:
+      core_mask = map(int, core_mask.split(',')) + [0]*sim.config.ncores
+      cores = [ core for core in range(sim.config.ncores) if core_mask[core] ]
+    else:
+      cores = range(sim.config.ncores)
+    self.setup_scheduler(interval_ns, policy, cores)
+
+  def setup_scheduler(self, interval_ns, policy = 'equal_time', cores = None):
+    if policy not in SCHEDULER_POLICIES:
+      raise ValueError('Invalid scheduler type %s' % policy)
+    self.policy = SCHEDULER_POLICIES[policy]()
+    self.cores = self.pick_cores(cores if cores is not None else range(sim.config.ncores))
+    self.masks = dict([ (core, tuple([ c == core for c in range(sim.config.ncores) ])) for core in self.cores ])
+    self.threads = {}
+    self.running = {}                # core -> SchedulerThread
+    self.runqueue = PriorityQueue()  # Runnable threads without a core
+    self.scores = PriorityQueue()    # All live threads, for the minimum score
+    self.affinity = {}               # Threads whose core may have changed during this event, thread_id -> core before
+    self.counters = { 'events': 0, 'picks': 0, 'affinity-updates': 0, 'walltime': 0. }
+    for metric in self.counters:
+      sim.stats.register('scheduler', 0, metric, self.get_stat)
+    Every(interval_ns * Time.NS, self.periodic)
+
+  def pick_cores(self, cores):
+    # Cores this scheduler can use
+    return list(cores)
+
+  def get_stat(self, objectName, index, metricName):
+    if metricName == 'walltime':
+      return long(self.counters['walltime'] * 1e6)
+    return self.counters[metricName]
+
+  def update_score(self, thread):
+    metric_now = self.policy.get_metric(thread.thread_id)
+    self.set_score(thread, thread.score + self.policy.get_score(thread.thread_id, thread.core, metric_now - thread.metric_last))
+    thread.metric_last = metric_now
+
+  def set_score(self, thread, score):
+    thread.score = score
+    self.scores.push(thread, thread.key())
+    if thread in self.runqueue:
+      self.runqueue.push(thread, thread.key())
+
+  def set_core(self, thread, core):
+    core_before = thread.core
+    if thread.core is not None:
+      self.update_score(thread)
+      del self.running[thread.core]
+    thread.core = core
+    if core is not None:
+      self.running[core] = thread
+      self.runqueue.remove(thread)
+    elif thread.runnable:
+      self.runqueue.push(thread, thread.key())
+    self.affinity.setdefault(thread.thread_id, core_before)
+
+  def flush_affinity(self):
+    for thread_id, core_before in self.affinity.items():
+      thread = self.threads.get(thread_id)
+      core = thread.core if thread else None
+      if core != core_before:
+        sim.thread.set_thread_affinity(thread_id, self.masks[core] if core is not None else ())
+        self.counters['affinity-updates'] += 1
+    self.affinity = {}
+
+  def free_cores(self):
+    return [ core for core in self.cores if core not in self.running ]
+
+  def pick(self):
+    self.counters['picks'] += 1
+    return self.runqueue.pop()
+
+  @scheduler_event
+  def hook_thread_start(self, thread_id, time):
+    thread = SchedulerThread(thread_id, self.policy.get_metric(thread_id))
+    self.threads[thread_id] = thread
+    self.scores.push(thread, thread.key())
+    self.affinity[thread_id] = -1 # Unknown, always set
+    thread.runnable = True
+    free_cores = self.free_cores()
+    self.set_core(thread, free_cores[0] if free_cores else None)
+
+  @scheduler_event
+  def hook_thread_exit(self, thread_id, time):
+    self.stall(thread_id, 'exit')
+    thread = self.threads.pop(thread_id)
+    self.scores.remove(thread)
+
+  @scheduler_event
+  def hook_thread_stall(self, thread_id, reason, time):
+    self.stall(thread_id, reason)
+
+  def stall(self, thread_id, reason):
+    thread = self.threads[thread_id]
+    if reason == 'unscheduled':
+      # Ignore calls due to the thread being scheduled out
+      thread.unscheduled = True
+    else:
+      core = thread.core
+      thread.runnable = False
+      self.set_core(thread, None)
+      self.runqueue.remove(thread)
+      # Schedule the runnable thread with the lowest score on this free core
+      if core is not None and self.runqueue:
+        self.set_core(self.pick(), core)
+
+  @scheduler_event
+  def hook_thread_resume(self, thread_id, woken_by, time):
+    thread = self.threads[thread_id]
+    if thread.unscheduled:
+      # Ignore calls due to the thread being scheduled back in
+      thread.unscheduled = False
+    else:
+      thread.metric_last = self.policy.get_metric(thread_id)
+      self.set_score(thread, self.scores.peek().score)
+      thread.runnable = True
+      # If there is a free core, move us there now
+      free_cores = self.free_cores()
+      self.set_core(thread, free_cores[0] if free_cores else None)
+
+  @scheduler_event
+  def periodic(self, time, time_delta):
+    self.policy.update(time, time_delta)
+    # Update scores of running threads
+    for thread in self.running.values():
+      self.update_score(thread)
+
+    # Select threads to run now, one per core: the best of the running threads and the head of the runqueue
+    waiting = []
+    while len(waiting) < len(self.cores) and self.runqueue:
+      waiting.append(self.pick())
+    threads = sorted(self.running.values() + waiting, key = lambda thread: thread.key())[:len(self.cores)]
+    for thread in waiting:
+      if thread not in threads:
+        self.runqueue.push(thread, thread.key())
+
+    # Keep running threads on their current core, move new threads to the other cores
+    keep_cores = set([ thread.core for thread in threads if thread.core is not None ])
+    threads = [ thread for thread in threads if thread.core is None ]
+    for thread, core in zip(threads, [ core for core in self.cores if core not in keep_cores ]):
+      if core in self.running:
+        self.set_core(self.running[core], None)
+      self.set_core(thread, core)
@@ -4,6 +4,7 @@ stattrace.py
 Write a trace of deltas for an arbitrary statistic.
 First argument is the name of the statistic (<component-name>[.<subcomponent>].<stat-name>)
 Second argument is either a filename, or none to write to standard output
+  (filenames ending in .bin, .bin.gz or .bin.zst give compact binary output, see tools/sniper_trace.py)
 Third argument is the interval size in nanoseconds (default is 10000)
 """
 
@@ -35,41 +36,25 @@ class StatTrace:
       print 'Stat %s[*].%s not found' % (stat_component, stat_name)
       return
 
-    if filename:
-      self.fd = file(os.path.join(sim.config.output_dir, filename), 'w')
-      self.isTerminal = False
-    else:
-      self.fd = sys.stdout
-      self.isTerminal = True
+    self.trace = sim.util.TraceWriter(filename, stat, 'STAT:%s' % stat, interval_ns * sim.util.Time.NS)
 
     self.sd = sim.util.StatsDelta()
+    # Some components don't exist (i.e. DRAM reads on cores that don't have a DRAM controller),
+    # allow_missing makes these read as zero
     self.stats = {
-      'time': [ self.getStatsGetter('performance_model', core, 'elapsed_time') for core in range(sim.config.ncores) ],
-      'ffwd_time': [ self.getStatsGetter('fastforward_performance_model', core, 'fastforwarded_time') for core in range(sim.config.ncores) ],
-      'stat': [ self.getStatsGetter(stat_component, core, stat_name) for core in range(sim.config.ncores) ],
+      'time': self.sd.getter_group('performance_model', 'elapsed_time', allow_missing = True),
+      'ffwd_time': self.sd.getter_group('fastforward_performance_model', 'fastforwarded_time', allow_missing = True),
+      'stat': self.sd.getter_group(stat_component, stat_name, allow_missing = True),
     }
     sim.util.Every(interval_ns * sim.util.Time.NS, self.periodic, statsdelta = self.sd, roi_only = True)
 
   def periodic(self, time, time_delta):
-    if self.isTerminal:
-      self.fd.write('[STAT:%s] ' % self.stat_name)
-    self.fd.write('%u' % (time / 1e6)) # Time in ns
+    values = []
     for core in range(sim.config.ncores):
-      timediff = (self.stats['time'][core].delta - self.stats['ffwd_time'][core].delta) / 1e6 # Time in ns
-      statdiff = self.stats['stat'][core].delta
+      timediff = (self.stats['time'].delta[core] - self.stats['ffwd_time'].delta[core]) / 1e6 # Time in ns
+      statdiff = self.stats['stat'].delta[core]
       value = statdiff / (timediff or 1) # Avoid division by zero
-      self.fd.write(' %.3f' % value)
-    self.fd.write('\n')
-
-  def getStatsGetter(self, component, core, metric):
-    # Some components don't exist (i.e. DRAM reads on cores that don't have a DRAM controller),
-    # return a special object that always returns 0 in these cases
-    try:
-      return self.sd.getter(component, core, metric)
-    except:
-      class Zero():
-        def __init__(self): self.delta = 0
-        def update(self): pass
-      return Zero()
+      values.append(value)
+    self.trace.write(time / 1e6, values) # Time in ns
 
 sim.util.register(StatTrace())
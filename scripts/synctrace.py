@@ -1,22 +1,51 @@
+"""
+synctrace.py
+
+Record thread start, stall, resume and migration events in the event table of sim.stats.sqlite3
+(thread creation and exit are always recorded), read them back using dumpstats.py -e.
+1st argument, if present, is a comma-separated list of thread ids to record (default: all)
+2nd argument, if set to print, prints every event instead
+"""
+
 import sim
 
 class SyncTrace:
+  def setup(self, args):
+    args = dict(enumerate((args or '').split(':')))
+    threads = [ int(thread) for thread in args.get(0, '').split(',') if thread ]
+    self.do_print = args.get(1, '') == 'print'
+    self.events = sim.util.EventLog(threads = threads)
+
   def hook_thread_create(self, threadid, creator):
-    print '[SYNC]', threadid, 'from app', sim.thread.get_thread_appid(threadid), 'created by', creator
+    if self.do_print:
+      print '[SYNC]', threadid, 'from app', sim.thread.get_thread_appid(threadid), 'created by', creator
 
   def hook_thread_start(self, threadid, time):
-    print '[SYNC]', threadid, 'start at', time / 1000000 # Time in ns
+    if self.do_print:
+      print '[SYNC]', threadid, 'start at', time / 1000000 # Time in ns
+    else:
+      self.events.log(sim.util.EVENT_THREAD_START, time, -1, threadid)
 
   def hook_thread_exit(self, threadid, time):
-    print '[SYNC]', threadid, 'exit at', time / 1000000
+    if self.do_print:
+      print '[SYNC]', threadid, 'exit at', time / 1000000
 
   def hook_thread_stall(self, threadid, reason, time):
-    print '[SYNC]', threadid, 'sleep for', reason, 'at', time / 1000000
+    if self.do_print:
+      print '[SYNC]', threadid, 'sleep for', reason, 'at', time / 1000000
+    else:
+      self.events.log(sim.util.EVENT_THREAD_STALL, time, -1, threadid, description = reason)
 
   def hook_thread_resume(self, threadid, threadby, time):
-    print '[SYNC]', threadid, 'woken by', threadby, 'at', time / 1000000
+    if self.do_print:
+      print '[SYNC]', threadid, 'woken by', threadby, 'at', time / 1000000
+    else:
+      self.events.log(sim.util.EVENT_THREAD_RESUME, time, -1, threadid, threadby)
 
   def hook_thread_migrate(self, threadid, coreid, time):
-    print '[SYNC]', threadid, 'scheduled to', coreid, 'at', time / 1000000
+    if self.do_print:
+      print '[SYNC]', threadid, 'scheduled to', coreid, 'at', time / 1000000
+    else:
+      self.events.log(sim.util.EVENT_THREAD_MIGRATE, time, coreid, threadid)
 
 sim.util.register(SyncTrace())
@@ -1,13 +1,44 @@
+"""
+syscalls.py
+
+Record system calls (entry with arguments, exit with return value) in the event table of sim.stats.sqlite3,
+read them back using dumpstats.py -e.
+1st argument, if present, is a comma-separated list of syscall names or numbers to record (default: all)
+2nd argument, if present, is a comma-separated list of thread ids to record (default: all)
+3rd argument, if set to print, prints every system call instead (slow for syscall-heavy workloads)
+"""
+
 import sim, syscall_strings
 
 def syscall_name(syscall_number):
   return '%s[%d]' % (syscall_strings.syscall_strings.get(syscall_number, 'unknown'), syscall_number)
 
+def syscall_number(name):
+  if name.isdigit():
+    return int(name)
+  numbers = dict([ (_name, number) for number, _name in syscall_strings.syscall_strings.items() ])
+  if name not in numbers:
+    raise ValueError('Unknown system call %s' % name)
+  return numbers[name]
+
 class LogSyscalls:
+  def setup(self, args):
+    args = dict(enumerate((args or '').split(':')))
+    syscalls = [ syscall_number(name) for name in args.get(0, '').split(',') if name ]
+    threads = [ int(thread) for thread in args.get(1, '').split(',') if thread ]
+    self.do_print = args.get(2, '') == 'print'
+    self.events = sim.util.EventLog(syscalls = syscalls, threads = threads)
+
   def hook_syscall_enter(self, threadid, coreid, time, syscall_number, args):
-    print '[SYSCALL] @%10d ns: %-27s thread(%3d) core(%3d) args%s' % (time/1e6, syscall_name(syscall_number), threadid, coreid, args)
+    if self.do_print:
+      print '[SYSCALL] @%10d ns: %-27s thread(%3d) core(%3d) args%s' % (time/1e6, syscall_name(syscall_number), threadid, coreid, args)
+    else:
+      self.events.log_syscall_enter(threadid, coreid, time, syscall_number, args)
 
   def hook_syscall_exit(self, threadid, coreid, time, ret_val, emulated):
-    print '[SYSCALL] @%10d ns:                        exit thread(%3d) core(%3d) ret_val(%d) emulated(%s)' % (time/1e6, threadid, coreid, ret_val, emulated)
+    if self.do_print:
+      print '[SYSCALL] @%10d ns:                        exit thread(%3d) core(%3d) ret_val(%d) emulated(%s)' % (time/1e6, threadid, coreid, ret_val, emulated)
+    else:
+      self.events.log_syscall_exit(threadid, coreid, time, ret_val, emulated)
 
 sim.util.register(LogSyscalls())
@@ -14,19 +14,15 @@ SIM_USER_TCP = 0x0be00001
 INTERVAL = 100000 # in ns
 ncores = sim.config.ncores
 
-CPI_MEM = (
-  "cpiDataCacheL2", "cpiDataCacheL2_S", "cpiDataCacheL3", "cpiDataCacheL3_S",
-  "cpiDataCachecache-remote", "cpiDataCachedram-local", "cpiDataCachedram-remote",
-  "cpiDataCacheunknown",
-)
+CPI_MEM = sim.util.TCP_CPI_MEM
 
 class Tcp:
   def setup(self, args):
     self.sd = sim.util.StatsDelta()
     self.stats = {
-      'time':   [ self.sd.getter("performance_model", core, "elapsed_time") for core in range(ncores) ],
-      'instrs': [ self.sd.getter("performance_model", core, "instruction_count") for core in range(ncores) ],
-      'cpimem': [ [ self.sd.getter("interval_timer", core, cpi) for cpi in CPI_MEM ] for core in range(ncores) ],
+      'time':   self.sd.getter_group("performance_model", "elapsed_time"),
+      'instrs': self.sd.getter_group("performance_model", "instruction_count"),
+      'cpimem': [ self.sd.getter_group("interval_timer", cpi) for cpi in CPI_MEM ],
     }
     self.tcp = [ None for core in range(ncores) ]
     sim.util.Every(INTERVAL * sim.util.Time.NS, self.periodic, statsdelta = self.sd, roi_only = True)
@@ -34,9 +30,9 @@ class Tcp:
 
   def periodic(self, time, time_delta):
     for core in range(ncores):
-      cycles = self.stats['time'][core].delta * sim.dvfs.get_frequency(core) / 1e9 # convert fs to cycles
-      instrs = self.stats['instrs'][core].delta
-      cpimem = sum([ c.delta for c in self.stats['cpimem'][core] ])
+      cycles = self.stats['time'].delta[core] * sim.dvfs.get_frequency(core) / 1e9 # convert fs to cycles
+      instrs = self.stats['instrs'].delta[core]
+      cpimem = sum([ c.delta[core] for c in self.stats['cpimem'] ])
       self.tcp[core] = int(1000 * cpimem / time_delta)
 
   def get_tcp(self, core_caller, arg):
@@ -0,0 +1,97 @@
+#!/usr/bin/env python2
+
+# Check that the time series store keeps the whole run, and that the default level selection (as used by viz.py) covers it,
+# rather than only the most recent snapshots held at level 0
+#   With --synthetic, first write a database the way periodic-stats does, running well past the capacity of level 0
+
+import os, sys, getopt, sqlite3, tempfile, shutil
+HOME = os.path.abspath(os.path.dirname(__file__))
+sys.path.extend([ os.path.join(HOME, '..', '..', 'tools'), os.path.join(HOME, '..', '..', 'tools', 'viz') ])
+import sniper_stats_sqlite, viz
+
+def write_synthetic(resultsdir, num_snapshots = 200, capacity = 4, levels = 3, factor = 4, interval = 1000):
+  db = sqlite3.connect(os.path.join(resultsdir, 'sim.stats.sqlite3'))
+  db.execute('CREATE TABLE `names` (nameid INTEGER, objectname TEXT, metricname TEXT)')
+  db.execute('CREATE TABLE `prefixes` (prefixid INTEGER, prefixname TEXT)')
+  db.execute('CREATE TABLE `values` (prefixid INTEGER, nameid INTEGER, core INTEGER, value INTEGER)')
+  db.execute('CREATE TABLE `timeseries_levels` (level INTEGER, interval INTEGER, capacity INTEGER)')
+  db.execute('CREATE TABLE `timeseries` (level INTEGER, slot INTEGER, time INTEGER)')
+  db.execute('CREATE TABLE `timeseries_values` (level INTEGER, slot INTEGER, nameid INTEGER, core INTEGER, value INTEGER)')
+  db.execute('INSERT INTO `names` VALUES (1, "performance_model", "instruction_count")')
+  for level in range(levels):
+    db.execute('INSERT INTO `timeseries_levels` VALUES (?, ?, ?)', (level, interval * factor**level, capacity))
+  # The last level halves its resolution when it is full, instead of dropping its oldest snapshot
+  top, top_every, top_slots = levels - 1, factor**(levels - 1), {}
+  for n in range(num_snapshots):
+    slots = [ (level, (n / factor**level) % capacity) for level in range(top) if n % factor**level == 0 ]
+    if n % top_every == 0 and len(top_slots) >= capacity:
+      top_every *= 2
+      for _n in [ _n for _n in top_slots if _n % top_every ]:
+        db.execute('DELETE FROM `timeseries` WHERE level = ? AND slot = ?', (top, top_slots[_n]))
+        db.execute('DELETE FROM `timeseries_values` WHERE level = ? AND slot = ?', (top, top_slots[_n]))
+        del top_slots[_n]
+      db.execute('UPDATE `timeseries_levels` SET interval = ? WHERE level = ?', (interval * top_every, top))
+    if n % top_every == 0:
+      top_slots[n] = min(set(range(capacity)) - set(top_slots.values()))
+      slots.append((top, top_slots[n]))
+    for level, slot in slots:
+      db.execute('DELETE FROM `timeseries` WHERE level = ? AND slot = ?', (level, slot))
+      db.execute('DELETE FROM `timeseries_values` WHERE level = ? AND slot = ?', (level, slot))
+      db.execute('INSERT INTO `timeseries` VALUES (?, ?, ?)', (level, slot, n * interval))
+      db.execute('INSERT INTO `timeseries_values` VALUES (?, ?, 1, 0, ?)', (level, slot, n * 100))
+  db.commit()
+
+def check(resultsdir):
+  stats = sniper_stats_sqlite.SniperStatsSqlite(os.path.join(resultsdir, 'sim.stats.sqlite3'))
+  levels = stats.get_timeseries_levels()
+  retained = [ stats.get_timeseries_times(level) for level, interval, capacity in levels ]
+  retained = [ leveltimes for leveltimes in retained if leveltimes ]
+  first = min([ leveltimes[0] for leveltimes in retained ])
+  last = max([ leveltimes[-1] for leveltimes in retained ])
+  level0 = stats.get_timeseries_times(levels[0][0])
+  if not level0 or level0[0] == first:
+    print 'Run did not go past the capacity of level 0, nothing to check'
+    return False
+  if first != 0:
+    print 'FAIL: the start of the run is no longer retained, snapshots start at %d' % first
+    return False
+  times = viz.get_snapshot_times(stats)
+  print 'Level 0 holds %d..%d, selected %d snapshots covering %d..%d' % (level0[0], level0[-1], len(times), times[0], times[-1])
+  if times[0] != first:
+    print 'FAIL: selection starts at %d, but snapshots are retained from %d' % (times[0], first)
+    return False
+  if last - times[-1] >= max([ interval for level, interval, capacity in levels ]):
+    print 'FAIL: selection ends at %d, but snapshots are retained up to %d' % (times[-1], last)
+    return False
+  print 'OK'
+  return True
+
+
+if __name__ == '__main__':
+  def usage():
+    print 'Usage:', sys.argv[0], '[-h (help)] [--synthetic] [<resultsdir (default: .)>]'
+
+  synthetic = False
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "h", [ 'synthetic' ])
+  except getopt.GetoptError, e:
+    print e
+    usage()
+    sys.exit(-1)
+  for o, a in opts:
+    if o == '-h':
+      usage()
+      sys.exit()
+    if o == '--synthetic':
+      synthetic = True
+
+  if synthetic:
+    resultsdir = tempfile.mkdtemp()
+    try:
+      write_synthetic(resultsdir)
+      ok = check(resultsdir)
+    finally:
+      shutil.rmtree(resultsdir)
+  else:
+    ok = check(args[0] if args else '.')
+  sys.exit(0 if ok else 1)
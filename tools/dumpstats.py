@@ -1,14 +1,21 @@
 #!/usr/bin/env python2
 
-import sys, os, getopt, re, sniper_lib, sniper_stats
+import sys, os, getopt, re, struct, sniper_lib, sniper_stats
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+try:
+  import syscall_strings
+except ImportError:
+  syscall_strings = None
 
 def usage():
-  print 'Usage:', sys.argv[0], '[-h (help)] [-l|--list | -t|--topology | -m|--markers | -e|--events | -c|--config ] [--partial <section-start>:<section-end> (default: roi-begin:roi-end)] [--through-time|tt <statname>]  [-d <resultsdir (default: .)>]'
+  print 'Usage:', sys.argv[0], '[-h (help)] [-l|--list | -t|--topology | -m|--markers | -e|--events [--time-range <begin>:<end> (in ns)] | -c|--config ] [--partial <section-start>:<section-end> (default: roi-begin:roi-end)] [--phases (extrapolate from phase-sampling samples)] [--through-time|tt <statname>]  [-d <resultsdir (default: .)>]'
 
 
 jobid = 0
 resultsdir = '.'
 partial = None
+phases = False
+time_range = (None, None)
 through_time = None
 do_list = False
 do_topo = False
@@ -18,7 +25,7 @@ do_stats = True
 do_config = False
 
 try:
-  opts, args = getopt.getopt(sys.argv[1:], "hj:d:lmtec", [ 'list', 'markers', 'topology', 'events', 'config', 'partial=', 'tt=', 'through-time=' ])
+  opts, args = getopt.getopt(sys.argv[1:], "hj:d:lmtec", [ 'list', 'markers', 'topology', 'events', 'config', 'partial=', 'phases', 'time-range=', 'tt=', 'through-time=' ])
 except getopt.GetoptError, e:
   print e
   usage()
@@ -36,6 +43,14 @@ for o, a in opts:
       sys.stderr.write('--partial=<from>:<to>\n')
       usage()
     partial = a.split(':')
+  if o == '--phases':
+    phases = True
+  if o == '--time-range':
+    if ':' not in a:
+      sys.stderr.write('--time-range=<begin>:<end>\n')
+      usage()
+      sys.exit(-1)
+    time_range = [ long(float(t) * 1e6) if t else None for t in a.split(':', 1) ] # ns to fs
   if o in ('--tt', '--through-time'):
     through_time = a.split(',')
   if o in ('-l', '--list'):
@@ -63,6 +78,12 @@ if args:
 def format_event(timestamp, core, thread, message):
   return '%9ld ns: core(%2d) thread(%2d)  %s' % (timestamp / 1e6, core, thread, message)
 
+def syscall_name(syscall_number):
+  if syscall_strings:
+    return '%s[%d]' % (syscall_strings.syscall_strings.get(syscall_number, 'unknown'), syscall_number)
+  else:
+    return '[%d]' % syscall_number
+
 def format_marker(value0, value1, description):
   if description:
     return 'a = %3d,  str = "%s"' % (value0, description)
@@ -98,7 +119,7 @@ if do_events:
   import sniper_stats
   stats = sniper_stats.SniperStats(resultsdir = resultsdir, jobid = jobid)
   try:
-    events = stats.get_events()
+    events = stats.get_events(time_begin = time_range[0], time_end = time_range[1])
   except Exception, e:
     print >> sys.stderr, e
     print >> sys.stderr, "--events could not be fetched"
@@ -117,6 +138,18 @@ if do_events:
       print format_event(timestamp, core, thread, 'Thread created: application %d by thread %d' % (value0, value1))
     elif event == sniper_stats.EVENT_THREAD_EXIT:
       print format_event(timestamp, core, thread, 'Thread exit')
+    elif event == sniper_stats.EVENT_THREAD_START:
+      print format_event(timestamp, core, thread, 'Thread start')
+    elif event == sniper_stats.EVENT_THREAD_STALL:
+      print format_event(timestamp, core, thread, 'Thread sleep for %s' % description)
+    elif event == sniper_stats.EVENT_THREAD_RESUME:
+      print format_event(timestamp, core, thread, 'Thread woken by %d' % value0)
+    elif event == sniper_stats.EVENT_THREAD_MIGRATE:
+      print format_event(timestamp, core, thread, 'Thread scheduled to core %d' % core)
+    elif event == sniper_stats.EVENT_SYSCALL_ENTER:
+      print format_event(timestamp, core, thread, 'Syscall %s args%s' % (syscall_name(value0), struct.unpack('<6q', str(description))))
+    elif event == sniper_stats.EVENT_SYSCALL_EXIT:
+      print format_event(timestamp, core, thread, 'Syscall %s exit ret_val(%d)%s' % (syscall_name(value1), value0, ' emulated' if description else ''))
     else:
       print format_event(timestamp, core, thread, 'Unknown event %d (%d, %d, %s)' % (event, value0, value1, description))
 
@@ -142,34 +175,53 @@ if do_stats:
   if through_time:
     import sniper_stats
     stats = sniper_stats.SniperStats(resultsdir = resultsdir, jobid = jobid)
-    names = stats.read_metricnames()
     metrics = [ metric[1:] if metric[0] in '-' else metric for metric in through_time ]
-    nameids = dict([ ('%s.%s' % (objectname, metricname), nameid) for nameid, (objectname, metricname) in names.items() if '%s.%s' % (objectname, metricname) in metrics ])
     prefixes = stats.get_snapshots()
     prefixes_len = max(map(len, prefixes))
-    data = dict([ (prefix, stats.read_snapshot(prefix, metrics)) for prefix in prefixes ])
 
-    def do_op(op, state, v):
-      if op == '-':
-        for i, _v in enumerate(v):
-          v[i], state[i] = v[i] - state.get(i, 0), v[i]
-        return v
-      else:
-        return v
-
-    with sniper_lib.OutputToLess():
-      for metric, _metric in zip(metrics, through_time):
-        op = _metric[0]
-        print '==', metric, '=='
-        state = {}
-        for prefix in prefixes:
-          v = data[prefix].get(nameids[metric], {})
-          v = [ v.get(i, 0) for i in range(max(v.keys() or [0])+1) ]
-          v = do_op(op, state, v)
-          print_result('%-*s' % (prefixes_len, prefix), v)
+    if sniper_lib.numpy is None:
+      # Without numpy (e.g. the simulator's embedded Python), read snapshots one by one
+      names = stats.read_metricnames()
+      nameids = dict([ ('%s.%s' % (objectname, metricname), nameid) for nameid, (objectname, metricname) in names.items() if '%s.%s' % (objectname, metricname) in metrics ])
+      data = dict([ (prefix, stats.read_snapshot(prefix, metrics)) for prefix in prefixes ])
+
+      def do_op(op, state, v):
+        if op == '-':
+          for i, _v in enumerate(v):
+            v[i], state[i] = v[i] - state.get(i, 0), v[i]
+          return v
+        else:
+          return v
+
+      with sniper_lib.OutputToLess():
+        for metric, _metric in zip(metrics, through_time):
+          op = _metric[0]
+          print '==', metric, '=='
+          state = {}
+          for prefix in prefixes:
+            v = data[prefix].get(nameids[metric], {})
+            v = [ v.get(i, 0) for i in range(max(v.keys() or [0])+1) ]
+            v = do_op(op, state, v)
+            print_result('%-*s' % (prefixes_len, prefix), v)
+    else:
+      # All snapshots in one go, as a snapshots x metrics x cores array
+      snapshots = sniper_lib.get_interval_series(stats = stats, prefixes = prefixes, metrics = metrics, as_array = True)
+
+      with sniper_lib.OutputToLess():
+        for metric, _metric in zip(metrics, through_time):
+          op = _metric[0]
+          print '==', metric, '=='
+          m = snapshots.index(metric)
+          values = snapshots.values[:, m, -snapshots.coremin:]
+          if op == '-':
+            values = sniper_lib.numpy.concatenate((values[:1], values[1:] - values[:-1]))
+          for idx, prefix in enumerate(prefixes):
+            # Cores present in this snapshot (none for metrics that only have a global value, a single zero for missing metrics)
+            ncores = snapshots.hi[idx, m] if snapshots.hi[idx, m] or snapshots.lo[idx, m] else 1
+            print_result('%-*s' % (prefixes_len, prefix), values[idx, :ncores].tolist())
 
   else:
-    results = sniper_lib.get_results(jobid, resultsdir, partial = partial)
+    results = sniper_lib.get_results(jobid, resultsdir, partial = partial, phases = phases)
 
     def natural_key(string_):
       """See http://www.codinghorror.com/blog/archives/001018.html"""
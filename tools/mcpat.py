@@ -1,6 +1,10 @@
 #!/usr/bin/env python2
 
-import os, sys, math, re, collections, buildstack, gnuplot, getopt, pprint, sniper_lib, sniper_config, sniper_stats
+import os, sys, math, re, collections, multiprocessing, tempfile, shutil, buildstack, gnuplot, getopt, pprint, sniper_lib, sniper_config, sniper_stats, mcpat_cache
+try:
+  import json
+except ImportError:
+  import localjson as json
 import math
 
 #ISSUE_WIDTH = 4
@@ -93,7 +97,7 @@ def mcpat_bin():
     # Fancy McPAT versions haven't been downloaded yet, use the plain old one
     return bin
   else:
-    os.path.join(mcpatdir, 'mcpat-1.0')
+    return os.path.join(mcpatdir, 'mcpat-1.0')
 
 def mcpat_run(inputfile, outputfile):
   os.system("LD_LIBRARY_PATH=$LD_LIBRARY_PATH:%s %s -print_level 5 -opt_for_clk 1 -infile %s > %s" % \
@@ -124,26 +128,47 @@ all_names = buildstack.get_names(all_items)
 def get_all_names():
   return all_names
 
-def main(jobid, resultsdir, outputfile, powertype = 'dynamic', config = None, no_graph = False, partial = None, print_stack = True, return_data = False):
-  tempfile = outputfile + '.xml'
+# Run McPAT on get_results()-style results and configuration, returns the power dictionary
+# Intermediate files are written to <outputfile>.xml and <outputfile>.txt, the power dictionary to <outputfile>.py
+# McPAT is skipped when its result for the same input is in the McPAT cache (see mcpat_cache.py)
+def compute_power(stats, results, config, outputfile):
+  return finish_power(run_mcpat(prepare_power(stats, results, config, outputfile)), results, config, outputfile)
 
-  results = sniper_lib.get_results(jobid, resultsdir, partial = partial)
-  if config:
-    results['config'] = sniper_config.parse_config(file(config).read(), results['config'])
-  stats = sniper_stats.SniperStats(resultsdir = resultsdir, jobid = jobid)
+# The steps of compute_power(): generating the McPAT input needs the statistics, running McPAT only needs the job
+# that prepare_power() returns, so that part can be done in a separate process (see get_power_many())
+def prepare_power(stats, results, config, outputfile):
+  power, nuca_at_level = edit_XML(stats, results, config)
+  file(outputfile + '.xml', "w").write(power)
+  cachekey = mcpat_cache.enabled() and mcpat_cache.make_key(power, mcpat_bin(), nuca_at_level)
+  return (outputfile, nuca_at_level, cachekey)
 
-  power, nuca_at_level = edit_XML(stats, results['results'], results['config'])
-  power = map(lambda v: v[0], power)
-  file(tempfile, "w").write('\n'.join(power))
+def run_mcpat((outputfile, nuca_at_level, cachekey)):
+  cached = mcpat_cache.get(cachekey)
+  if cached:
+    power_dat, power_txt = cached
+    file(outputfile + '.txt', 'w').write(power_txt)
+  else:
+    # Run McPAT
+    mcpat_run(outputfile + '.xml', outputfile + '.txt')
+
+    # Parse output
+    power_txt = file(outputfile + '.txt').read()
+    power_dat = parse_output(power_txt, nuca_at_level)
+    mcpat_cache.put(cachekey, power_dat, power_txt)
+  return power_dat
+
+def finish_power(power_dat, results, config, outputfile):
+  # Add DRAM power
+  add_dram_power(power_dat, results, config)
+  # Write back
+  file(outputfile + '.py', 'w').write("power = " + pprint.pformat(power_dat))
+  return power_dat
 
-  # Run McPAT
-  mcpat_run(tempfile, outputfile + '.txt')
 
-  # Parse output
-  power_txt = file(outputfile + '.txt')
+def parse_output(power_txt, nuca_at_level):
   power_dat = {}
 
-  components = power_txt.read().split('*'*89)[2:-1]
+  components = power_txt.split('*'*89)[2:-1]
   for component in components:
     lines = component.strip().split('\n')
     componentname = lines[0].strip().strip(':')
@@ -192,9 +217,167 @@ def main(jobid, resultsdir, outputfile, powertype = 'dynamic', config = None, no
 
   if not power_dat:
     raise ValueError('No valid McPAT output found')
+  return power_dat
 
-  # Add DRAM power
-  dram_dyn, dram_stat = dram_power(results['results'], results['config'])
+
+# Surrogate power model: a per-component linear fit of McPAT output versus counter rates, made by calibrate()
+# Evaluating the model takes microseconds, get_power() uses it instead of McPAT when it is accurate enough for the configuration
+# Core power is scaled to other per-core frequencies and Vdds (DVFS), but only to operating points calibrate() checked against McPAT,
+# see surrogate_scaling()
+SURROGATE_FILENAME = 'power-model.json' # Default location, in the results directory next to sim.cfg
+SURROGATE_VERSION = 2
+SURROGATE_MAX_ERROR = .05 # Relative error in chip power (leave-one-out) above which we keep running McPAT
+SURROGATE_COUNTERS = [
+  ('performance_model.instruction_count',),
+  ('L1-I.loads',), ('L1-I.load-misses',),
+  ('L1-D.loads',), ('L1-D.stores',), ('L1-D.load-misses',), ('L1-D.store-misses',),
+  ('L2.loads',), ('L2.stores',), ('L2.load-misses',), ('L2.store-misses',),
+  ('L3.loads',), ('L3.stores',), ('L3.load-misses',), ('L3.store-misses',),
+  ('branch_predictor.num-incorrect',),
+  ('interval_timer.uops_total', 'rob_timer.uops_total'),
+  ('interval_timer.uop_branch', 'rob_timer.uop_branch'),
+  ('interval_timer.uop_fp_addsub', 'rob_timer.uop_fp_addsub'),
+  ('interval_timer.uop_fp_muldiv', 'rob_timer.uop_fp_muldiv'),
+]
+
+def surrogate_features(results, ncores):
+  # One row per core, and a last row for the whole chip: constant, non-idle fraction, then the rate (per second) of each counter
+  numpy = sniper_lib.numpy
+  seconds = results['global.time'] * 1e-15 or 1
+  features = numpy.zeros((ncores + 1, len(SURROGATE_COUNTERS) + 2))
+  features[:,0] = 1
+  for core in range(ncores):
+    elapsed = float(results['performance_model.elapsed_time'][core] or 1)
+    features[core,1] = 1 - results['performance_model.idle_elapsed_time'][core] / elapsed
+  for i, names in enumerate(SURROGATE_COUNTERS):
+    for name in names:
+      if name in results:
+        features[:ncores,i+2] = (list(results[name]) + [ 0 ] * ncores)[:ncores]
+        break
+  features[:ncores,2:] /= seconds
+  features[ncores,1:] = features[:ncores,1:].sum(axis = 0)
+  return features
+
+def surrogate_fingerprint(config):
+  # Configuration the model is valid for: core count, and the per-core frequency and Vdd it was calibrated at
+  ncores = int(config['general/total_cores'])
+  return {
+    'ncores': ncores,
+    'frequency': [ float(f) for f in sniper_config.get_config_array(config, 'perf_model/core/frequency', ncores) ],
+    'vdd': [ float(v) for v in sniper_config.get_config_array(config, 'power/vdd', ncores) ] if 'power/vdd' in config else None,
+  }
+
+def surrogate_operating_point(config, frequency, vdd):
+  # Copy of config with all cores at frequency (in GHz) and vdd, set the way scripts/energystats.py does for DVFS
+  ncores = int(config['general/total_cores'])
+  return sniper_config.parse_config('[perf_model/core]\nfrequency[] = %s\n[power]\nvdd[] = %s\n' % (','.join([ str(frequency) ] * ncores), ','.join([ str(vdd) ] * ncores)), config.copy())
+
+def surrogate_scaling(model, config):
+  # Per-core (frequency, Vdd) ratios of config to the operating point the model was calibrated at, as numpy arrays
+  # Returns (None, None) when no scaling is needed, raises ValueError if the model can't be used for config
+  calibrated = model['config']
+  fingerprint = surrogate_fingerprint(config)
+  if fingerprint['ncores'] != calibrated['ncores']:
+    raise ValueError('calibrated for %d cores' % calibrated['ncores'])
+  if (fingerprint['vdd'] is None) != (calibrated['vdd'] is None):
+    # One of them uses McPAT's default Vdd, which we don't know
+    raise ValueError('calibrated %s power/vdd' % ('without' if calibrated['vdd'] is None else 'with'))
+  # Scaling is a heuristic, only use it for (frequency, Vdd) pairs that were compared against McPAT when calibrating
+  for f, v in zip(fingerprint['frequency'], fingerprint['vdd'] or [ None ] * fingerprint['ncores']):
+    point = '%g GHz' % f + (' / %g V' % v if v is not None else '')
+    errors = [ error for _f, _v, error in model['points'] if abs(_f - f) <= 1e-6 * f and (v is None or abs(_v - v) <= 1e-6 * v) ]
+    if not errors:
+      raise ValueError('not calibrated at %s' % point)
+    if min(errors) > SURROGATE_MAX_ERROR:
+      raise ValueError('error %.1f%% at %s is above %.0f%%' % (100 * min(errors), point, 100 * SURROGATE_MAX_ERROR))
+  if fingerprint == calibrated:
+    return None, None
+  return surrogate_ratios(calibrated, fingerprint)
+
+def surrogate_ratios(calibrated, fingerprint):
+  # Per-core frequency and Vdd ratios between two surrogate_fingerprint()s
+  numpy = sniper_lib.numpy
+  f = numpy.array(fingerprint['frequency']) / numpy.array(calibrated['frequency'])
+  v = numpy.array(fingerprint['vdd']) / numpy.array(calibrated['vdd']) if fingerprint['vdd'] else numpy.ones(fingerprint['ncores'])
+  return f, v
+
+def surrogate_blocks(power_dat, ncores):
+  # Split McPAT output into blocks of values that are fitted together: Core entries on per-core counters, everything else on chip-wide ones
+  # DRAM power isn't from McPAT, we compute it directly
+  blocks = {}
+  for component, values in power_dat.items():
+    if component == 'DRAM':
+      continue
+    elif component == 'Core':
+      blocks['Core'] = values
+    elif type(values) is list:
+      for index, _values in enumerate(values):
+        blocks['%s/%d' % (component, index)] = [ _values ]
+    else:
+      blocks[component] = [ values ]
+  return blocks
+
+def surrogate_fit(samples, ncores):
+  # samples: list of (surrogate_features(), McPAT power dictionary), returns { block: (keys, coefficients) }
+  numpy = sniper_lib.numpy
+  model = {}
+  for block in surrogate_blocks(samples[0][1], ncores).keys():
+    rows = [ (features[:ncores] if block == 'Core' else features[ncores:], surrogate_blocks(power_dat, ncores)[block]) for features, power_dat in samples ]
+    keys = sorted(reduce(lambda a, b: a & b, [ set(values.keys()) for _, instances in rows for values in instances ]))
+    X = numpy.concatenate([ features for features, _ in rows ])
+    Y = numpy.array([ [ values[key] for key in keys ] for _, instances in rows for values in instances ])
+    # Normalize columns, so the minimum-norm solution for sparse or collinear counters doesn't depend on their scale
+    scale = numpy.abs(X).max(axis = 0)
+    scale[scale == 0] = 1
+    coefs = numpy.linalg.lstsq(X / scale, Y, rcond = -1)[0] / scale[:,numpy.newaxis]
+    model[block] = (keys, coefs)
+  return model
+
+def surrogate_scale_cores(keys, coefs, features, f, v):
+  # Core power at per-core frequency ratios f and Vdd ratios v: dynamic energy per event goes with Vdd^2
+  # (the counter rates already reflect the new frequency), the constant and non-idle terms (clock tree,
+  # always-on logic) with f * Vdd^2, and leakage is approximated as linear in Vdd
+  numpy = sniper_lib.numpy
+  per_event = features[:,2:].dot(coefs[2:])
+  per_cycle = features[:,:2].dot(coefs[:2])
+  values = per_event + per_cycle
+  for k, key in enumerate(keys):
+    if 'Dynamic' in key:
+      values[:,k] = (per_event[:,k] + per_cycle[:,k] * f) * v**2
+    elif 'Leakage' in key:
+      values[:,k] *= v
+  return values
+
+def surrogate_evaluate(model, features, ncores, f = None, v = None):
+  # f, v: per-core frequency and Vdd ratios to the calibrated operating point (see surrogate_scaling), None to not scale
+  power_dat = {}
+  core_delta = {}
+  for block, (keys, coefs) in model.items():
+    if block == 'Core':
+      values = features[:ncores].dot(coefs)
+      if f is not None:
+        scaled = surrogate_scale_cores(keys, coefs, features[:ncores], f, v)
+        # Chip totals are fitted on chip-wide counters, correct them for the change in core power
+        core_delta = dict(zip(keys, (scaled - values).sum(axis = 0).tolist()))
+        values = scaled
+      power_dat['Core'] = [ dict(zip(keys, _values)) for _values in values.tolist() ]
+    elif '/' in block:
+      component, index = block.split('/')
+      instances = power_dat.setdefault(component, [])
+      instances.extend([ None ] * (int(index) + 1 - len(instances)))
+      instances[int(index)] = dict(zip(keys, features[ncores].dot(coefs).tolist()))
+    else:
+      power_dat[block] = dict(zip(keys, features[ncores].dot(coefs).tolist()))
+  for key, delta in core_delta.items():
+    if key in power_dat.get('Processor', {}):
+      power_dat['Processor'][key] += delta
+  return power_dat
+
+def surrogate_chip_power(power_dat):
+  return sum([ power_dat['Processor'].get(key, 0) for key in ('Runtime Dynamic', 'Subthreshold Leakage', 'Gate Leakage') ])
+
+def add_dram_power(power_dat, results, config):
+  dram_dyn, dram_stat = dram_power(results, config)
   power_dat['DRAM'] = {
     'Peak Dynamic': dram_dyn,
     'Runtime Dynamic': dram_dyn,
@@ -203,10 +386,256 @@ def main(jobid, resultsdir, outputfile, powertype = 'dynamic', config = None, no
     'Gate Leakage': 0,
     'Area': 0,
   }
-  # Write back
-  file(outputfile + '.py', 'w').write("power = " + pprint.pformat(power_dat))
+  return power_dat
+
+surrogates = {}
+
+def load_surrogate(filename):
+  if sniper_lib.numpy is None:
+    print >> sys.stderr, '[mcpat.py] Warning: the surrogate power model requires numpy, running McPAT instead'
+    return None
+  key = (os.path.realpath(filename), os.stat(filename).st_mtime)
+  if key not in surrogates:
+    data = json.load(open(filename))
+    if data.get('version') != SURROGATE_VERSION:
+      raise ValueError('Unsupported power model version in %s, please recalibrate' % filename)
+    data['blocks'] = dict([ (str(block), (map(str, keys), sniper_lib.numpy.array(coefs))) for block, (keys, coefs) in data['blocks'].items() ])
+    surrogates[key] = data
+  return surrogates[key]
+
+surrogate_warnings = set()
+
+def surrogate_power(model, results, config):
+  # Power dictionary from the surrogate model, or None if the model cannot be used for this configuration
+  try:
+    if model['error'] > SURROGATE_MAX_ERROR:
+      raise ValueError('error %.1f%% is above %.0f%%' % (100 * model['error'], 100 * SURROGATE_MAX_ERROR))
+    f, v = surrogate_scaling(model, config)
+  except ValueError, e:
+    # Warn once per reason, not for every interval
+    if str(e) not in surrogate_warnings:
+      print >> sys.stderr, '[mcpat.py] Warning: not using the power model (%s), running McPAT instead' % e
+      surrogate_warnings.add(str(e))
+    return None
+  ncores = model['config']['ncores']
+  power_dat = surrogate_evaluate(model['blocks'], surrogate_features(results, ncores), ncores, f, v)
+  return add_dram_power(power_dat, results, config)
+
+def get_power(stats, results, config, outputfile, model = None):
+  # Use the surrogate model when given and valid for config, run McPAT otherwise
+  return get_power_many(stats, [ (results, config, outputfile) ], model, workers = 1)[0]
+
+def get_power_many(stats, items, model = None, workers = None, verbose = False):
+  # Power for a list of (results, config, outputfile), in order
+  #   The McPAT inputs are generated first, then McPAT is run on a pool of workers (default: one per CPU)
+  powers = [ model and surrogate_power(model, results, config) for results, config, outputfile in items ]
+  for power_dat, (results, config, outputfile) in zip(powers, items):
+    if power_dat is not None:
+      file(outputfile + '.py', 'w').write("power = " + pprint.pformat(power_dat))
+  todo = [ i for i, power_dat in enumerate(powers) if power_dat is None ]
+  if not todo:
+    return powers
+
+  jobs = []
+  for n, i in enumerate(todo):
+    if verbose:
+      print >> sys.stderr, '[mcpat.py] Generating McPAT input %d / %d\r' % (n+1, len(todo)),
+    jobs.append(prepare_power(stats, *items[i]))
+  if verbose:
+    print >> sys.stderr
+
+  workers = min(workers or multiprocessing.cpu_count(), len(jobs))
+  if workers <= 1:
+    outputs = (run_mcpat(job) for job in jobs)
+  else:
+    pool = multiprocessing.Pool(workers)
+    outputs = pool.imap(run_mcpat, jobs)
+  try:
+    for n, power_dat in enumerate(outputs):
+      if verbose:
+        print >> sys.stderr, '[mcpat.py] Running McPAT %d / %d (%d workers)\r' % (n+1, len(todo), workers),
+      results, config, outputfile = items[todo[n]]
+      powers[todo[n]] = finish_power(power_dat, results, config, outputfile)
+  finally:
+    if workers > 1:
+      pool.terminate()
+      pool.join()
+  if verbose:
+    print >> sys.stderr
+  return powers
+
+def calibrate(jobid, resultsdir, config = None, num_samples = 32, filename = None, workers = None, operating_points = []):
+  # Run McPAT on up to num_samples intervals between consecutive periodic snapshots, fit the surrogate model and write it to filename
+  # operating_points: (frequency in GHz, Vdd) pairs the model should also be used at (DVFS), McPAT is run on the same intervals
+  #   at each of them to check the model's scaling
+  stats = sniper_stats.SniperStats(resultsdir = resultsdir, jobid = jobid)
+  base_config = sniper_lib.get_config(jobid, resultsdir)
+  if config:
+    base_config = sniper_config.parse_config(file(config).read(), base_config)
+  ncores = int(base_config['general/total_cores'])
+  snapshots = sorted([ name for name in stats.get_snapshots() if re.match(r'periodic-[0-9]+$', name) ], key = lambda name: long(name.split('-')[1]))
+  intervals = zip(snapshots[:-1], snapshots[1:])
+  if len(intervals) > num_samples:
+    # Spread the samples out over the whole run
+    intervals = [ intervals[i * len(intervals) / num_samples] for i in range(num_samples) ]
+  if len(intervals) < 2:
+    raise ValueError('Calibrating a power model needs at least three periodic snapshots (run with -s periodic-stats)')
+  if operating_points and 'power/vdd' not in base_config:
+    raise ValueError('Calibrating DVFS operating points needs power/vdd in the configuration')
+
+  # McPAT's intermediate files only live until the model is fitted
+  tempdir = tempfile.mkdtemp()
+  try:
+    items = []
+    for i, partial in enumerate(intervals):
+      cfg = base_config.copy()
+      results = sniper_lib.get_results(config = cfg, stats = stats, partial = partial)['results']
+      items.append((results, cfg, os.path.join(tempdir, 'power-%d' % i)))
+    point_items = []
+    for p, (frequency, vdd) in enumerate(operating_points):
+      cfg = surrogate_operating_point(base_config, frequency, vdd)
+      point_items.extend([ (results, cfg, os.path.join(tempdir, 'power-%d-%d' % (p, i))) for i, (results, _cfg, outputfile) in enumerate(items) ])
+    powers = get_power_many(stats, items + point_items, workers = workers, verbose = True)
+  finally:
+    shutil.rmtree(tempdir, ignore_errors = True)
+  powers, point_powers = powers[:len(items)], powers[len(items):]
+  samples = [ (surrogate_features(results, ncores), power_dat) for (results, cfg, outputfile), power_dat in zip(items, powers) ]
+
+  # Fit error: predict each sample with a model fitted on all others
+  numpy = sniper_lib.numpy
+  errors = []
+  for i, (features, power_dat) in enumerate(samples):
+    predicted = surrogate_evaluate(surrogate_fit(samples[:i] + samples[i+1:], ncores), features, ncores)
+    errors.append(abs(surrogate_chip_power(predicted) - surrogate_chip_power(power_dat)) / (abs(surrogate_chip_power(power_dat)) or 1))
+
+  model = surrogate_fit(samples, ncores)
+  fingerprint = surrogate_fingerprint(base_config)
+  # Operating points the model may be used at, with their maximum error: those of the calibration run itself,
+  # and the DVFS ones, predicted by scaling the fitted model
+  points = [ (f, v, max(errors)) for f, v in zip(fingerprint['frequency'], fingerprint['vdd'] or [ None ] * ncores) ]
+  for p, (frequency, vdd) in enumerate(operating_points):
+    f, v = surrogate_ratios(fingerprint, surrogate_fingerprint(point_items[p * len(samples)][1]))
+    point_errors = []
+    for (features, _power_dat), power_dat in zip(samples, point_powers[p * len(samples):(p+1) * len(samples)]):
+      predicted = surrogate_evaluate(model, features, ncores, f, v)
+      point_errors.append(abs(surrogate_chip_power(predicted) - surrogate_chip_power(power_dat)) / (abs(surrogate_chip_power(power_dat)) or 1))
+    points.append((float(frequency), float(vdd), max(point_errors)))
+  data = {
+    'version': SURROGATE_VERSION,
+    'config': fingerprint,
+    'counters': SURROGATE_COUNTERS,
+    'samples': intervals,
+    'error': max(errors),
+    'mean_error': float(numpy.mean(errors)),
+    'points': points,
+    'blocks': dict([ (block, (keys, coefs.tolist())) for block, (keys, coefs) in model.items() ]),
+  }
+  filename = filename or os.path.join(resultsdir, SURROGATE_FILENAME)
+  json.dump(data, open(filename, 'w'))
+  print 'Power model written to %s' % filename
+  print 'Chip power error versus McPAT (leave-one-out over %d intervals): mean %.2f%%, max %.2f%%' % (len(samples), 100 * data['mean_error'], 100 * data['error'])
+  if data['error'] > SURROGATE_MAX_ERROR:
+    print 'Maximum error is above %.0f%%, McPAT will still be used instead of this model' % (100 * SURROGATE_MAX_ERROR)
+  for frequency, vdd, error in points[ncores:]:
+    print 'Chip power error versus McPAT at %g GHz / %g V: max %.2f%%%s' % (frequency, vdd, 100 * error, ' (McPAT will be used here)' if error > SURROGATE_MAX_ERROR else '')
+  return data
+
+
+# Long-running power service, used by scripts/energystats.py and scripts/powertrace.py through sim.util.PowerService
+# Keeps the configuration, statistics database and McPAT templates loaded, and handles one JSON request per line on fpin:
+#   { "partial": [ <from>, <to> ] }: power for the interval between two snapshots in the statistics database
+#   { "results": [ [ <name>, <core>, <delta> ], ... ] }: power for the given counter deltas
+# Requests can optionally include "config": <sim.cfg-style overrides> (e.g. DVFS settings) and "output": <output-file>
+# Each request is answered with a line containing { "power": <power dictionary> } or { "error": <message> }
+def serve(resultsdir, outputfile, configfile = None, power_model = None, fpin = sys.stdin, fpout = sys.stdout):
+  stats = sniper_stats.SniperStats(resultsdir = resultsdir)
+  model = power_model and load_surrogate(power_model)
+  config = stats.config
+  if configfile:
+    config = sniper_config.parse_config(file(configfile).read(), config.copy())
+  ncores = int(config['general/total_cores'])
+  # Anything else we (or parse_config) print must not end up in the replies
+  sys.stdout = sys.stderr
+  for line in iter(fpin.readline, ''):
+    if not line.strip():
+      continue
+    try:
+      request = json.loads(line)
+      cfg = config.copy()
+      if request.get('config'):
+        cfg = sniper_config.parse_config(str(request['config']), cfg)
+      if 'partial' in request:
+        if hasattr(stats, 'read_metricnames'):
+          # Pick up metrics that were registered since we started
+          names = stats.read_metricnames()
+          if names != stats.names:
+            stats.names = names
+            stats.selections = {}
+        results = sniper_lib.get_results(config = cfg, stats = stats, partial = map(str, request['partial']))['results']
+      else:
+        rows = [ (str(name), core, value) for name, core, value in request['results'] ]
+        if sniper_lib.numpy is None:
+          results = sniper_lib.stats_process(cfg, rows)
+        else:
+          results = sniper_stats.arrays_to_lists(sniper_lib.stats_process_arrays(cfg, sniper_stats.results_to_arrays(rows, ncores)))
+      reply = { 'power': get_power(stats, results, cfg, str(request.get('output', outputfile)), model) }
+    except Exception, e:
+      reply = { 'error': '%s: %s' % (e.__class__.__name__, e) }
+    fpout.write(json.dumps(reply) + '\n')
+    fpout.flush()
+
+
+def main(jobid, resultsdir, outputfile, powertype = 'dynamic', config = None, no_graph = False, partial = None, print_stack = True, return_data = False, power_model = None):
+  results = sniper_lib.get_results(jobid, resultsdir, partial = partial)
+  if config:
+    results['config'] = sniper_config.parse_config(file(config).read(), results['config'])
+  stats = sniper_stats.SniperStats(resultsdir = resultsdir, jobid = jobid)
 
+  power_dat = get_power(stats, results['results'], results['config'], outputfile, power_model and load_surrogate(power_model))
 
+  plot_labels, plot_data, ncores, seconds = make_plot_data(power_dat, results, powertype, print_stack)
+
+  if not no_graph:
+    # Use Gnuplot to make a stacked bargraphs of these cpi-stacks
+    if 'other' in plot_labels:
+      all_names.append('other')
+    all_names_with_colors = zip(all_names, range(1,len(all_names)+1))
+    plot_labels_with_color = [n for n in all_names_with_colors if n[0] in plot_labels]
+    gnuplot.make_stacked_bargraph(outputfile, plot_labels_with_color, plot_data, 'Energy (J)')
+
+  if return_data:
+    return {'labels': plot_labels, 'power_data': plot_data, 'ncores': ncores, 'time_s': seconds}
+
+
+# Same as main(return_data = True, no_graph = True, print_stack = False) for a list of partials, with McPAT running in parallel
+#   Returns a list of {'labels', 'power_data', 'ncores', 'time_s'} dictionaries, intermediate files are <outputfile>-<index>.*
+def main_many(jobid, resultsdir, outputfile, partials, powertype = 'dynamic', config = None, power_model = None, workers = None, verbose = False, stats = None):
+  stats = stats or sniper_stats.SniperStats(resultsdir = resultsdir, jobid = jobid)
+  cfg = stats.config
+  if config:
+    cfg = sniper_config.parse_config(file(config).read(), cfg.copy())
+  if partials and all([ p1[1] == p2[0] for p1, p2 in zip(partials[:-1], partials[1:]) ]):
+    # Consecutive intervals: read each snapshot only once
+    series = sniper_lib.get_interval_series(stats = stats, config = cfg, prefixes = [ partials[0][0] ] + [ partial[1] for partial in partials ])
+  else:
+    series = (sniper_lib.get_results(config = cfg, stats = stats, partial = partial) for partial in partials)
+  results = []
+  for i, res in enumerate(series):
+    if verbose:
+      print >> sys.stderr, '[mcpat.py] Collecting statistics %d / %d\r' % (i+1, len(partials)),
+    results.append(res)
+  if verbose:
+    print >> sys.stderr
+  powers = get_power_many(stats, [ (res['results'], res['config'], '%s-%d' % (outputfile, i)) for i, res in enumerate(results) ],
+                          power_model and load_surrogate(power_model), workers = workers, verbose = verbose)
+  data = []
+  for power_dat, res in zip(powers, results):
+    plot_labels, plot_data, ncores, seconds = make_plot_data(power_dat, res, powertype, print_stack = False)
+    data.append({'labels': plot_labels, 'power_data': plot_data, 'ncores': ncores, 'time_s': seconds})
+  return data
+
+
+def make_plot_data(power_dat, results, powertype = 'dynamic', print_stack = True):
   # Build stack
   ncores = int(results['config']['general/total_cores'])
   time0_begin = results['results']['global.time_begin']
@@ -261,16 +690,7 @@ def main(jobid, resultsdir, outputfile, powertype = 'dynamic', config = None, no
         energy, energy_scale = sniper_lib.scale_sci(float(total) * seconds)
         print '  %-12s    %6.2f W   %6.2f %sJ    %6.2f%%' % ('total', float(total), energy, energy_scale, 100 * float(total) / total)
 
-  if not no_graph:
-    # Use Gnuplot to make a stacked bargraphs of these cpi-stacks
-    if 'other' in plot_labels:
-      all_names.append('other')
-    all_names_with_colors = zip(all_names, range(1,len(all_names)+1))
-    plot_labels_with_color = [n for n in all_names_with_colors if n[0] in plot_labels]
-    gnuplot.make_stacked_bargraph(outputfile, plot_labels_with_color, plot_data, 'Energy (J)')
-
-  if return_data:
-    return {'labels': plot_labels, 'power_data': plot_data, 'ncores': ncores, 'time_s': seconds}
+  return plot_labels, plot_data, ncores, seconds
 
 
 
@@ -327,459 +747,456 @@ def power_stack(power_dat, powertype = 'total', nocollapse = False):
   return buildstack.merge_items({ 0: data }, all_items, nocollapse = nocollapse)
 
 
-def edit_XML(statsobj, stats, cfg):
-  #param = res['param']         #do it separately
-
-  ncores = int(cfg['general/total_cores'])
-  technology_node = int(sniper_config.get_config_default(cfg, 'power/technology_node', 45))
+# McPAT input for one configuration
+#   The XML skeleton, and every value in it that only depends on the configuration (system layout, clocks, cache parameters),
+#   is built once. make() then only formats the statistics of an interval into it.
+#   Use get_input() to share instances between intervals with the same configuration.
+class McPATInput:
+  def __init__(self, statsobj, cfg):
+    # NUCA parameters are copied into the L2 or L3 configuration, don't modify the caller's
+    cfg = cfg.copy()
+    ncores = int(cfg['general/total_cores'])
+    technology_node = int(sniper_config.get_config_default(cfg, 'power/technology_node', 45))
 
-  l3_cacheSharedCores = long(sniper_config.get_config_default(cfg, 'perf_model/l3_cache/shared_cores', 0))
-  l2_cacheSharedCores = long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/shared_cores', 0))
-  nuca_at_level = False
-  private_l2s = True
+    l3_cacheSharedCores = long(sniper_config.get_config_default(cfg, 'perf_model/l3_cache/shared_cores', 0))
+    l2_cacheSharedCores = long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/shared_cores', 0))
+    nuca_at_level = False
+    private_l2s = True
 
-  if long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/data_access_time', 0)) > 0:
-    num_l2s = int(math.ceil(ncores / float(l2_cacheSharedCores)))
-    private_l2s = int(sniper_config.get_config(cfg, 'perf_model/l2_cache/shared_cores')) == 1
-  else:
-    # L2 with zero access latency can be used when we don't really want an L2, but need one to interface with the NoC
-    num_l2s = 0
-  if int(cfg['perf_model/cache/levels']) >= 3:
-    num_l3s = int(math.ceil(ncores / float(l3_cacheSharedCores)))
-    if cfg.get('perf_model/nuca/enabled') == 'true':
-      print >> sys.stderr, "L3 configured, NUCA power will be ignored"
-  elif cfg.get('perf_model/nuca/enabled') == 'true':
-    if cfg['perf_model/dram_directory/locations'] == 'interleaved':
-      nuca_cacheSharedCores = int(cfg['perf_model/dram_directory/interleaving'])
-      num_nucas = int(math.ceil(ncores / float(nuca_cacheSharedCores)))
+    if long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/data_access_time', 0)) > 0:
+      num_l2s = int(math.ceil(ncores / float(l2_cacheSharedCores)))
+      private_l2s = int(sniper_config.get_config(cfg, 'perf_model/l2_cache/shared_cores')) == 1
     else:
-      nuca_locations = [ lid for name, lid, mid in statsobj.get_topology() if name == 'nuca-cache' ]
-      # Right now we only support NUCA slices at regular interleaving
-      num_nucas = len(nuca_locations)
-      nuca_cacheSharedCores = ncores / num_nucas
-      nuca_locations_assumed = [ i*nuca_cacheSharedCores for i in range(num_nucas) ]
-      if nuca_locations != nuca_locations_assumed:
-        raise ValueError('Unsupported tag directory locations %s' % cfg['perf_model/dram_directory/locations'])
-    if num_l2s == 0:
-      # No L2s, use them for NUCA
-      num_l2s = num_nucas
-      l2_cacheSharedCores = nuca_cacheSharedCores
-      l = 2
-      num_l3s = 0
-      nuca_at_level = 2
+      # L2 with zero access latency can be used when we don't really want an L2, but need one to interface with the NoC
+      num_l2s = 0
+    if int(cfg['perf_model/cache/levels']) >= 3:
+      num_l3s = int(math.ceil(ncores / float(l3_cacheSharedCores)))
+      if cfg.get('perf_model/nuca/enabled') == 'true':
+        print >> sys.stderr, "L3 configured, NUCA power will be ignored"
+    elif cfg.get('perf_model/nuca/enabled') == 'true':
+      if cfg['perf_model/dram_directory/locations'] == 'interleaved':
+        nuca_cacheSharedCores = int(cfg['perf_model/dram_directory/interleaving'])
+        num_nucas = int(math.ceil(ncores / float(nuca_cacheSharedCores)))
+      else:
+        nuca_locations = [ lid for name, lid, mid in statsobj.get_topology() if name == 'nuca-cache' ]
+        # Right now we only support NUCA slices at regular interleaving
+        num_nucas = len(nuca_locations)
+        nuca_cacheSharedCores = ncores / num_nucas
+        nuca_locations_assumed = [ i*nuca_cacheSharedCores for i in range(num_nucas) ]
+        if nuca_locations != nuca_locations_assumed:
+          raise ValueError('Unsupported tag directory locations %s' % cfg['perf_model/dram_directory/locations'])
+      if num_l2s == 0:
+        # No L2s, use them for NUCA
+        num_l2s = num_nucas
+        l2_cacheSharedCores = nuca_cacheSharedCores
+        l = 2
+        num_l3s = 0
+        nuca_at_level = 2
+      else:
+        # We do have L2s, use L3 for NUCA
+        num_l3s = num_nucas
+        l3_cacheSharedCores = nuca_cacheSharedCores
+        l = 3
+        nuca_at_level = 3
+      # Copy over NUCA parameters into the L2/L3 configuration so we don't have to change anything below here
+      cfg['perf_model/l%d_cache/data_access_time'%l] = cfg['perf_model/nuca/data_access_time']
+      cfg['perf_model/l%d_cache/associativity'%l] = cfg['perf_model/nuca/associativity']
+      cfg['perf_model/l%d_cache/cache_block_size'%l] = cfg['perf_model/l2_cache/cache_block_size']
+      cfg['perf_model/l%d_cache/cache_size'%l] = cfg['perf_model/nuca/cache_size']
+      cfg['perf_model/l%d_cache/writeback_time'%l] = 0
+      cfg['perf_model/l%d_cache/dvfs_domain'%l] = 'global'
     else:
-      # We do have L2s, use L3 for NUCA
-      num_l3s = num_nucas
-      l3_cacheSharedCores = nuca_cacheSharedCores
-      l = 3
-      nuca_at_level = 3
-    # Copy over NUCA statistics into L2/L3 statistics so we don't have to change anything below here
-    cfg['perf_model/l%d_cache/data_access_time'%l] = cfg['perf_model/nuca/data_access_time']
-    cfg['perf_model/l%d_cache/associativity'%l] = cfg['perf_model/nuca/associativity']
-    cfg['perf_model/l%d_cache/cache_block_size'%l] = cfg['perf_model/l2_cache/cache_block_size']
-    cfg['perf_model/l%d_cache/cache_size'%l] = cfg['perf_model/nuca/cache_size']
-    cfg['perf_model/l%d_cache/writeback_time'%l] = 0
-    cfg['perf_model/l%d_cache/dvfs_domain'%l] = 'global'
-    stats['L%d.loads'%l] = stats['nuca-cache.reads']
-    stats['L%d.stores'%l] = stats['nuca-cache.writes']
-    stats['L%d.load-misses'%l] = stats['nuca-cache.read-misses']
-    stats['L%d.store-misses'%l] = stats['nuca-cache.write-misses']
-  else:
-    num_l3s = 0
-
-  #print stats
-#---------------------------
-  #loads = long(stats['L1-D.loads'])
-  #stores = long(stats['L1-D.stores'])
-#---------------------------
-
-  cycles_scale = stats['fs_to_cycles_cores']
-  instrs = stats['performance_model.instruction_count']
-  times = stats['performance_model.elapsed_time']
-  cycles = map(lambda c, t: c * t, cycles_scale[:ncores], times[:ncores])
-  max_system_cycles = float(max(cycles)) or 1 # avoid division by zero
-  data = [ {} for core in range(ncores) ]
-  for core in range(ncores):
-    data[core]['idle_cycles'] = cycles_scale[core] * stats['performance_model.idle_elapsed_time'][core]
-    data[core]['FP_instructions'] = (stats.get('interval_timer.uop_fp_addsub', stats.get('rob_timer.uop_fp_addsub', []))[core] \
-                                  + stats.get('interval_timer.uop_fp_muldiv', stats.get('rob_timer.uop_fp_muldiv', []))[core])
-    data[core]['Branch_instructions'] = (stats.get('interval_timer.uop_branch', stats.get('rob_timer.uop_branch', []))[core])
-    data[core]['ialu_accesses'] = (stats.get('interval_timer.uop_load', stats.get('rob_timer.uop_load', []))[core]) \
-                                + (stats.get('interval_timer.uop_store', stats.get('rob_timer.uop_store', []))[core]) \
-                                + (stats.get('interval_timer.uop_generic', stats.get('rob_timer.uop_generic', []))[core])
-  total_system_instructions = sum(instrs)
-  DRAM_reads = int(stats['dram.reads'][0])
-  DRAM_writes = int(stats['dram.writes'][0])
-  #branch_misprediction = stats['branch_predictor.num-incorrect'][1]
-
-  template=readTemplate(ncores, num_l2s, private_l2s, num_l3s, technology_node)
-  #for j in range(ncores):
-  for i in xrange(len(template)-1):
-    #for j in range(ncores):
-      if template[i][1] and template[i][1][1] in ('stat', 'cfg', 'comb'):
-        core = template[i][1][2]
+      num_l3s = 0
+
+    self.ncores = ncores
+    self.nuca_at_level = nuca_at_level
+    self.l2_cacheSharedCores = l2_cacheSharedCores
+    self.l3_cacheSharedCores = l3_cacheSharedCores
+
+    self.lines = [] # XML lines, statistics are left as format placeholders
+    self.stats = [] # (line, statistic, core or cache index) for each placeholder
+    params = {}
+    for entry in readTemplate(ncores, num_l2s, private_l2s, num_l3s, technology_node):
+      line, spec = entry[:2]
+      if spec and len(spec) == 1:
+        # hardcoded
+        line = line % spec[0]
+      elif spec and spec[1] == 'stat':
+        self.stats.append((len(self.lines), spec[0], spec[2]))
+      elif spec:
+        if (spec[0], spec[2]) not in params:
+          params[(spec[0], spec[2])] = self.get_param(cfg, spec[0], spec[2])
+        line = line % params[(spec[0], spec[2])]
+      self.lines.append(line)
+    self.ALU_per_core = dict([ (core, self.get_param(cfg, 'ALU_per_core', core)) for i, name, core in self.stats if name == 'ALU.duty_cycle' ])
+
+  def get_param(self, cfg, name, core):
+    # Value of a cfg or comb template entry
+    def get_domain(component, value_core, value_global):
+      domain = sniper_config.get_config(cfg, component+'/dvfs_domain', core)
+      if domain == 'core':
+        return value_core()
+      elif domain == 'global':
+        return value_global()
       else:
-        core = None
-      clock_core = float(sniper_config.get_config(cfg, 'perf_model/core/frequency', core))*1000
-      clock_global = float(sniper_config.get_config(cfg, 'perf_model/core/frequency'))*1000
-      if 'power/vdd' in cfg:
-        vdd_global = float(sniper_config.get_config(cfg, 'power/vdd'))
-        vdd_core = float(sniper_config.get_config(cfg, 'power/vdd', core))
+        raise ValueError('Unknown DVFS domain %s' % domain)
+    clock_core = lambda: float(sniper_config.get_config(cfg, 'perf_model/core/frequency', core))*1000
+    clock_global = lambda: float(sniper_config.get_config(cfg, 'perf_model/core/frequency'))*1000
+    vdd_core = lambda: float(sniper_config.get_config(cfg, 'power/vdd', core)) if 'power/vdd' in cfg else 0
+    vdd_global = lambda: float(sniper_config.get_config(cfg, 'power/vdd')) if 'power/vdd' in cfg else 0
+    get_long = lambda key: long(sniper_config.get_config_default(cfg, key, 0, core))
+    if name=="core_clock":
+      return clock_core()
+    elif name=="core_vdd":
+      return vdd_core()
+    elif name=="issue_width":
+      return long(sniper_config.get_config(cfg, 'perf_model/core/interval_timer/dispatch_width', core))
+    elif name in ("peak_issue_width", "ALU_per_core"):
+      return long(long(sniper_config.get_config(cfg, 'perf_model/core/interval_timer/dispatch_width', core)) * 1.5)
+    elif name=="window_size":
+      return int(sniper_config.get_config(cfg, "perf_model/core/interval_timer/window_size", core))
+    elif name=="machineType":
+      if sniper_config.get_config(cfg, "perf_model/core/type", core) == 'rob' and sniper_config.get_config_bool(cfg, "perf_model/core/rob_timer/in_order", core):
+        return 1 # in-order
       else:
-        vdd_global = 0
-        vdd_core = 0
-      def get_clock(component):
-        domain = sniper_config.get_config(cfg, component+'/dvfs_domain', core)
-        if domain == 'core':
-          return clock_core
-        elif domain == 'global':
-          return clock_global
+        return 0 # OoO
+    elif name=="L2_clock":
+      return get_domain('perf_model/l2_cache', clock_core, clock_global)
+    elif name=="L3_clock":
+      return get_domain('perf_model/l3_cache', clock_core, clock_global)
+    elif name=="NoC_clock":
+      return clock_global()
+    elif name=="L2_vdd":
+      return get_domain('perf_model/l2_cache', vdd_core, vdd_global)
+    elif name=="L3_vdd":
+      return get_domain('perf_model/l3_cache', vdd_core, vdd_global)
+    elif name=="NoC_vdd":
+      return vdd_global()
+    elif name=="icache_cfg":
+      return (int(get_long('perf_model/l1_icache/cache_size'))*1024,
+              get_long('perf_model/l1_icache/cache_block_size'),
+              power2up(get_long('perf_model/l1_icache/associativity')),
+              1,
+              1,                                                         #thoughput="Cycle time of the component"
+              long(sniper_config.get_config(cfg, 'perf_model/l1_icache/data_access_time', core)), #latency="access time"
+              0, # unused?
+              1) # 1 for writeback
+    elif name=="L2_config":
+      return (int(get_long('perf_model/l2_cache/cache_size'))*1024,
+              get_long('perf_model/l2_cache/cache_block_size'),
+              power2up(get_long('perf_model/l2_cache/associativity')),
+              8,
+              1,
+              get_long('perf_model/l2_cache/data_access_time'),
+              0, # unused?
+              1) # 1 for writeback
+    elif name=="dcache_cfg":
+      return (int(get_long('perf_model/l1_dcache/cache_size'))*1024,
+              get_long('perf_model/l1_dcache/cache_block_size'),
+              power2up(get_long('perf_model/l1_dcache/associativity')),
+              2,            #banks
+              # Increase throughput and latency constraints, otherwise McPAT calls CACTI some more
+              #   with tighter constraints, resulting in a ridiculously large dcache
+              10,           #thoughput="Cycle time of the component"
+              10*long(sniper_config.get_config(cfg, 'perf_model/l1_dcache/data_access_time', core)),
+              0, # unused?
+              1) # 1 for writeback
+    elif name=="L3_config":
+      return (int(get_long('perf_model/l3_cache/cache_size'))*1024,
+              64,
+              power2up(get_long('perf_model/l3_cache/associativity')),
+              16,
+              16,
+              get_long('perf_model/l3_cache/data_access_time'),
+              1)
+    else:
+      raise ValueError('Unknown cfg template %s' % name)
+
+  def make(self, stats):
+    # McPAT input (XML text) for get_results()-style statistics
+    ncores = self.ncores
+    if self.nuca_at_level:
+      # Copy over NUCA statistics into L2/L3 statistics so we don't have to change anything below here
+      l = self.nuca_at_level
+      stats = dict(stats)
+      stats['L%d.loads'%l] = stats['nuca-cache.reads']
+      stats['L%d.stores'%l] = stats['nuca-cache.writes']
+      stats['L%d.load-misses'%l] = stats['nuca-cache.read-misses']
+      stats['L%d.store-misses'%l] = stats['nuca-cache.write-misses']
+
+    cycles_scale = stats['fs_to_cycles_cores']
+    instrs = stats['performance_model.instruction_count']
+    times = stats['performance_model.elapsed_time']
+    cycles = map(lambda c, t: c * t, cycles_scale[:ncores], times[:ncores])
+    max_system_cycles = float(max(cycles)) or 1 # avoid division by zero
+    data = [ {} for core in range(ncores) ]
+    for core in range(ncores):
+      data[core]['idle_cycles'] = cycles_scale[core] * stats['performance_model.idle_elapsed_time'][core]
+      data[core]['FP_instructions'] = (stats.get('interval_timer.uop_fp_addsub', stats.get('rob_timer.uop_fp_addsub', []))[core] \
+                                    + stats.get('interval_timer.uop_fp_muldiv', stats.get('rob_timer.uop_fp_muldiv', []))[core])
+      data[core]['Branch_instructions'] = (stats.get('interval_timer.uop_branch', stats.get('rob_timer.uop_branch', []))[core])
+      data[core]['ialu_accesses'] = (stats.get('interval_timer.uop_load', stats.get('rob_timer.uop_load', []))[core]) \
+                                  + (stats.get('interval_timer.uop_store', stats.get('rob_timer.uop_store', []))[core]) \
+                                  + (stats.get('interval_timer.uop_generic', stats.get('rob_timer.uop_generic', []))[core])
+    total_system_instructions = sum(instrs)
+    DRAM_reads = int(stats['dram.reads'][0])
+    DRAM_writes = int(stats['dram.writes'][0])
+
+    l2_cacheSharedCores = self.l2_cacheSharedCores
+    l3_cacheSharedCores = self.l3_cacheSharedCores
+    lines = list(self.lines)
+    for i, name, core in self.stats:
+      if name=="ALU.duty_cycle":
+        ALU_per_core = self.ALU_per_core[core]
+      cores_l2s = range(l2_cacheSharedCores*core, min(ncores, l2_cacheSharedCores*core+l2_cacheSharedCores))
+      cores_l3s = range(l3_cacheSharedCores*core, min(ncores, l3_cacheSharedCores*core+l3_cacheSharedCores))
+      # core statistics
+      if name=="total_cycles":
+        value = cycles[core]
+      elif name=="busy_cycles":
+        value = (cycles[core] - data[core]['idle_cycles'])
+      elif name=="idle_cycles":
+        value = data[core]['idle_cycles']
+      elif name=="total_system_cycles":
+        value = int(max_system_cycles)
+      elif name=="total_system_idle_cycles":
+        value = int(0)
+      elif name=="total_system_busy_cycles":
+        value = int(max_system_cycles)
+      elif name=="function_calls":
+        value = int(instrs[core] * 0.05)
+      elif name=="IFU.duty_cycle":
+        if float(((instrs[core]))/max_system_cycles) > 1:
+          value = 1
         else:
-          raise ValueError('Unknown DVFS domain %s' % domain)
-      def get_vdd(component):
-        domain = sniper_config.get_config(cfg, component+'/dvfs_domain', core)
-        if domain == 'core':
-          return vdd_core
-        elif domain == 'global':
-          return vdd_global
+          value = float(((instrs[core]))/max_system_cycles)
+      elif name=="LSU.duty_cycle":
+        if float((long(stats['L1-D.loads'][core])+long(stats['L1-D.stores'][core]))/max_system_cycles) <= 1:
+          value = float((long(stats['L1-D.loads'][core])+long(stats['L1-D.stores'][core]))/max_system_cycles)
         else:
-          raise ValueError('Unknown DVFS domain %s' % domain)
-      issue_width = long(sniper_config.get_config(cfg, 'perf_model/core/interval_timer/dispatch_width', core))
-      peak_issue_width = long(long(sniper_config.get_config(cfg, 'perf_model/core/interval_timer/dispatch_width', core)) * 1.5)
-      ALU_per_core = peak_issue_width
-      window_size = int(sniper_config.get_config(cfg, "perf_model/core/interval_timer/window_size", core))
-      if sniper_config.get_config(cfg, "perf_model/core/type", core) == 'rob' and sniper_config.get_config_bool(cfg, "perf_model/core/rob_timer/in_order", core):
-        machineType = 1 # in-order
+          value = 1
+      elif name=="MemManU.I.duty_cycle":
+        if float((long(stats['L1-I.loads'][core])+long(stats['L1-I.stores'][core]))/max_system_cycles) <= 1:
+          value = float((long(stats['L1-I.loads'][core])+long(stats['L1-I.stores'][core]))/max_system_cycles)
+        else:
+          value = 1
+      elif name=="MemManU.D.duty_cycle":
+        if float((long(stats['L1-D.loads'][core])+long(stats['L1-D.stores'][core]))/max_system_cycles) <= 1:
+          value = float((long(stats['L1-D.loads'][core])+long(stats['L1-D.stores'][core]))/max_system_cycles)
+        else:
+          value = 1
+      elif name=="FPU.duty_cycle":
+        value = min(1,float((int(data[core]['FP_instructions']))/max_system_cycles))
+      elif name=="MUL.duty_cycle":
+        value = min(1,float((stats.get('interval_timer.uop_fp_muldiv', stats.get('rob_timer.uop_fp_muldiv', []))[core])/max_system_cycles))
+      elif name=="ALU.duty_cycle":             #check whether it is per FP  basis or total
+        value = min(1,((instrs[core] - data[core]['FP_instructions'])/(max_system_cycles *  ALU_per_core)))
+      elif name=="memory.reads":
+        value = DRAM_reads
+      elif name=="memory.writes":
+        value = DRAM_writes
+      elif name=="memory.accesses":
+        value = (int(DRAM_reads) + int(DRAM_writes))
+      elif name=="NoC.type":
+        if 'network.shmem-1.mesh.link-in.num-requests' in stats or 'network.shmem-1.mesh.packets-in' in stats:
+          # 1 = NoC
+          value = 1
+        else:
+          # 0 = bus
+          value = 0
+      elif name=="NoC.total_accesses":
+        if 'network.shmem-1.mesh.link-in.num-requests' in stats:
+          value = sum(stats['network.shmem-1.mesh.link-in.num-requests'])
+        elif 'network.shmem-1.mesh.packets-in' in stats:
+          value = sum(stats['network.shmem-1.mesh.packets-in'])
+        elif 'network.shmem-1.bus.num-requests' in stats:
+          value = int(stats['network.shmem-1.bus.num-requests'][0])  #assumption
+        elif 'network.shmem-1.bus.num-packets' in stats:
+          value = int(stats['network.shmem-1.bus.num-packets'][0])  #assumption
+        else:
+          value = int(stats['bus.num-requests'][0])  #assumption
+      elif name=="NoC.duty_cycle":
+        if 'network.shmem-1.mesh.link-left.total-time-used' in stats:
+          DIRECTIONS = ('up', 'down', 'left', 'right')
+          total_time_used = sum([ sum(stats['network.shmem-1.mesh.link-%s.total-time-used' % direction]) for direction in DIRECTIONS ])
+          num_links_used = sum([ sum([ v > 0 and 1 or 0 for v in stats['network.shmem-1.mesh.link-%s.num-requests' % direction] ]) for direction in DIRECTIONS ])
+          # Not all links (e.g. boundary of mesh) are actually present in hardware
+          # Here we assume that all real links are used at least ones
+          avg_time_used = total_time_used / float(num_links_used or 1.)
+          duty_cycle = avg_time_used / (stats['global.time'] or 1.)
+          value = duty_cycle
+        elif 'network.shmem-1.mesh.packets-in' in stats:
+          # Mesh network model without proper accounting. Take a wild guess...
+          value = .5
+        elif 'network.shmem-1.bus.time-used' in stats:
+          value = min(1, cycles_scale[core]*float(stats['network.shmem-1.bus.time-used'][0])/max_system_cycles)
+        else:
+          value = min(1, cycles_scale[core]*float(stats['bus.time-used'][0])/max_system_cycles)
+      elif name=="loads":
+        value = long(stats['L1-D.loads'][core])
+      elif name=="stores":
+        value = long(stats['L1-D.stores'][core])
+      elif name=="total_instructions":
+        value = instrs[core]
+      elif name=="integer_ins":
+        value = int(int(instrs[core]) - int(data[core]['FP_instructions']) - int(data[core]['Branch_instructions']))
+      elif name=="fp_ins":
+        value = int(data[core]['FP_instructions'])
+      elif name=="itlb_total_accesses":
+        value = int(instrs[core]*0.5)
+      elif name=="itlb_misses":
+        value = int(instrs[core]*(0.5*0.5/10000))
+      elif name=="BTB.read_accesses":
+        value = int(data[core]['Branch_instructions'])  #instrs[core]
+      elif name=="RAT_rename.reads":
+        value = int(2 * instrs[core])
+      elif name=="RAT_rename.writes":
+        value = int(instrs[core])
+      elif name=="RAT_fp_rename.reads":
+        value = int(2 * int(data[core]['FP_instructions']))
+      elif name=="RAT_fp_rename.writes":
+        value = int(data[core]['FP_instructions'])
+      elif name=="instr.reads":                #inst window stats
+        value = instrs[core]
+      elif name=="instr.writes":
+        value = instrs[core]
+      elif name=="instr.wakeup":
+        value = int(instrs[core]*2)
+      elif name=="instr.fp.reads":
+        value = int(instrs[core]*0.5)
+      elif name=="instr.fp.writes":
+        value = int(instrs[core]*0.5)
+      elif name=="instr.fp.wakeup":
+        value = instrs[core]
+      elif name=="window_switches.ialu_accesses":
+        value = int(data[core]['ialu_accesses'])
+      elif name=="window_switches.fpu_accesses":
+        value = int(data[core]['FP_instructions'])
+      elif name=="window_switches.mul_accesses":
+        value = int(stats.get('interval_timer.uop_fp_muldiv', stats.get('rob_timer.uop_fp_muldiv', []))[core])
+      elif name=="window_switches.cdb_alu_accesses":
+        value = int(data[core]['ialu_accesses'])
+      elif name=="window_switches.cdb_fpu_accesses":
+        value = int(data[core]['FP_instructions'])
+      elif name=="window_switches.cdb_mul_accesses":
+        value = int(stats.get('interval_timer.uop_fp_muldiv', stats.get('rob_timer.uop_fp_muldiv', []))[core])
+      elif name=="RF_accesses.int_regfile_reads":
+        value = int(instrs[core]*1.5)
+      elif name=="RF_accesses.fp_regfile_reads":
+        value = int(instrs[core]*0.25)
+      elif name=="RF_accesses.int_regfile_writes":
+        value = int(instrs[core]*0.75)
+      elif name=="RF_accesses.fp_regfile_writes":
+        value = int(instrs[core]*0.125)
+      elif name=="ROB_reads":
+        value = int(stats.get('interval_timer.uops_total', stats.get('rob_timer.uops_total', []))[core]*1)
+      elif name=="ROB_writes":
+        value = int(stats.get('interval_timer.uops_total', stats.get('rob_timer.uops_total', []))[core]*1)
+      elif name=="branch_ins":
+        value = int(data[core]['Branch_instructions'])
+      elif name=="branch_mis":
+        value = int('branch_predictor.num-incorrect' in stats and stats['branch_predictor.num-incorrect'][core] or 0)
+      elif name=="committed_ins":
+        value = int(instrs[core])
+      elif name=="committed_int":
+        value = int((instrs[core])*0.5)
+      elif name=="committed_fp":
+        value = int((instrs[core])*0.5)
+      elif name=="itlb.total_accesses":        #itlb equals icache reads and writes
+        value = int(stats['L1-I.loads'][core] + stats['L1-I.stores'][core])
+      elif name=="itlb.total_misses":
+        value = int(stats['L1-I.load-misses'][core] + stats['L1-I.store-misses'][core])
+      elif name=="icache.read_accesses":
+        value = int(stats['L1-I.loads'][core])
+      elif name=="dtlb.total_accesses":        #dtlb equals dcache reads and writes
+        value = int(stats['L1-D.loads'][core] + stats['L1-D.stores'][core])
+      elif name=="dtlb.total_misses":
+        value = int(stats['L1-D.load-misses'][core] + stats['L1-D.store-misses'][core])
+      elif name=="dcache.read_accesses":
+        value = int(stats['L1-D.loads'][core])
+      elif name=="dcache.read_misses":
+        value = int(stats['L1-D.load-misses'][core])
+      elif name=="dcache.write_accesses":
+        value = int(stats['L1-D.stores'][core])
+      elif name=="dcache.write_misses":
+        value = int(stats['L1-D.store-misses'][core])
+      elif name=="function_calls":
+        value = int(instrs[core] * 0.35000)
+      # L1 directory (not modeled)
+      elif name=="L1_directory.read_accesses":
+        value = int(instrs[core] * 2)
+      elif name=="L1_directory.write_accesses":
+        value = int(instrs[core] * 0.06667)
+      elif name=="L1_directory.read_misses":
+        value = int(instrs[core] * 0.00408)
+      elif name=="L1_directory.write_misses":
+        value = int(instrs[core] * 0.00005)
+      elif name=="L1_directory.conflicts":
+        value = int(instrs[core]*0.00005)
+      # L2 directory (not modeled)
+      elif name=="L2_directory.read_accesses":         #check for L2 or L2dir
+        value = int((instrs[core])*(0.125))
+      elif name=="L2_directory.write_accesses":
+        value = int((instrs[core])*(0.0625))
+      elif name=="L2_directory.read_misses":
+        value = int((instrs[core])*(0.004))
+      elif name=="L2_directory.write_misses":
+        value = int((instrs[core])*(0.0004))
+      elif name=="L2_directory.conflicts":
+        value = int((instrs[core])*(0.00025))
+      # L2 caches
+      elif name=="L2.read_accesses":
+        value = sum([ stats['L2.loads'][c] for c in cores_l2s ])
+      elif name=="L2.write_accesses":
+        value = sum([ stats['L2.stores'][c] for c in cores_l2s ])
+      elif name=="L2.read_misses":
+        value = sum([ stats['L2.load-misses'][c] for c in cores_l2s ])
+      elif name=="L2.write_misses":
+        value = sum([ stats['L2.store-misses'][c] for c in cores_l2s ])
+      elif name=="L2_duty_cycle":
+        value = min(1,(sum([ stats['L2.loads'][c] + stats['L2.stores'][c] for c in cores_l2s ]) / float(max_system_cycles)))
+      # L3 caches
+      elif name=="L3.read_accesses":
+        value = ('L3.loads' in stats and sum([ stats['L3.loads'][c] for c in cores_l3s ]) or 0)
+      elif name=="L3.write_accesses":
+        value = ('L3.stores' in stats and sum([ stats['L3.stores'][c] for c in cores_l3s ]) or 0)
+      elif name=="L3.read_misses":
+        value = ('L3.load-misses' in stats and sum([ stats['L3.load-misses'][c] for c in cores_l3s ]) or 0)
+      elif name=="L3.write_misses":
+        value = ('L3.store-misses' in stats and sum([ stats['L3.store-misses'][c] for c in cores_l3s ]) or 0)
+      elif name=="L3_duty_cycle":
+        value = min(1,('L3.loads' in stats and sum([ stats['L3.loads'][c] + stats['L3.stores'][c] for c in cores_l3s ]) / float(max_system_cycles) or 0))
       else:
-        machineType = 0 # OoO
-      latency_bp = long(sniper_config.get_config(cfg, 'perf_model/branch_predictor/mispredict_penalty', core))
-        #---FROM CONFIG----------
-      latency_l1_d = long(sniper_config.get_config(cfg, 'perf_model/l1_dcache/data_access_time', core))
-      latency_l1_i = long(sniper_config.get_config(cfg, 'perf_model/l1_icache/data_access_time', core))
-      latency_l2 = long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/data_access_time', 0, core))
-      latency_l3 = long(sniper_config.get_config_default(cfg, 'perf_model/l3_cache/data_access_time', 0, core))
-      l1_dcacheAssociativity = power2up(long(sniper_config.get_config_default(cfg, 'perf_model/l1_dcache/associativity', 0, core)))
-      l1_dcacheBlockSize = long(sniper_config.get_config_default(cfg, 'perf_model/l1_dcache/cache_block_size', 0, core))
-      l1_dcacheSize= long(sniper_config.get_config_default(cfg, 'perf_model/l1_dcache/cache_size', 0, core))
-      l1_dcacheSharedCores = long(sniper_config.get_config_default(cfg, 'perf_model/l1_dcache/shared_cores', 0, core))
-      l1_dcacheWriteBackTime = long(sniper_config.get_config_default(cfg, 'perf_model/l1_dcache/writeback_time', 0, core))
-      l1_icacheAssociativity = power2up(long(sniper_config.get_config_default(cfg, 'perf_model/l1_icache/associativity', 0, core)))
-      l1_icacheBlockSize = long(sniper_config.get_config_default(cfg, 'perf_model/l1_icache/cache_block_size', 0, core))
-      l1_icacheSize = long(sniper_config.get_config_default(cfg, 'perf_model/l1_icache/cache_size', 0, core))
-      l1_icacheSharedCores = long(sniper_config.get_config_default(cfg, 'perf_model/l1_icache/shared_cores', 0, core))
-      l1_icacheWriteBackTime = long(sniper_config.get_config_default(cfg, 'perf_model/l1_icache/writeback_time', 0, core))
-      l2_cacheAssociativity = power2up(long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/associativity', 0, core)))
-      l2_cacheSize = long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/cache_size', 0, core))
-      l2_cacheBlockSize = long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/cache_block_size', 0, core))
-      l2_cacheWriteBackTime = long(sniper_config.get_config_default(cfg, 'perf_model/l2_cache/writeback_time', 0, core))
-      l3_cacheAssociativity = power2up(long(sniper_config.get_config_default(cfg, 'perf_model/l3_cache/associativity', 0, core)))
-      l3_cacheBlockSize = long(sniper_config.get_config_default(cfg, 'perf_model/l3_cache/cache_block_size', 0, core))
-      l3_cacheSize = long(sniper_config.get_config_default(cfg, 'perf_model/l3_cache/cache_size', 0, core))
-      l3_cacheWriteBackTime = long(sniper_config.get_config_default(cfg, 'perf_model/l3_cache/writeback_time', 0, core))
-
-      if template[i][1]:
-           #if template[i][1][1]=="cfg":
-          #template[i][0] = template[i][0] % int(calc_param(template[i][1][0],config))
-        if len(template[i][1]) == 1:
-          # hardcoded
-          template[i][0] = template[i][0] % template[i][1][0]
-        elif template[i][1][1]=="cfg":
-          if template[i][1][0]=="core_clock":
-            template[i][0] = template[i][0] % clock_core
-          elif template[i][1][0]=="core_vdd":
-            template[i][0] = template[i][0] % vdd_core
-          elif template[i][1][0]=="issue_width":
-            template[i][0] = template[i][0] % issue_width
-          elif template[i][1][0]=="peak_issue_width":
-            template[i][0] = template[i][0] % peak_issue_width
-          elif template[i][1][0]=="ALU_per_core":
-            template[i][0] = template[i][0] % ALU_per_core
-          elif template[i][1][0]=="window_size":
-            template[i][0] = template[i][0] % window_size
-          elif template[i][1][0]=="machineType":
-            template[i][0] = template[i][0] % machineType
-          elif template[i][1][0]=="L2_clock":
-            template[i][0] = template[i][0] % get_clock('perf_model/l2_cache')
-          elif template[i][1][0]=="L3_clock":
-            template[i][0] = template[i][0] % get_clock('perf_model/l3_cache')
-          elif template[i][1][0]=="NoC_clock":
-            template[i][0] = template[i][0] % clock_global
-          elif template[i][1][0]=="L2_vdd":
-            template[i][0] = template[i][0] % get_vdd('perf_model/l2_cache')
-          elif template[i][1][0]=="L3_vdd":
-            template[i][0] = template[i][0] % get_vdd('perf_model/l3_cache')
-          elif template[i][1][0]=="NoC_vdd":
-            template[i][0] = template[i][0] % vdd_global
-          else:
-            raise ValueError('Unknown cfg template %s' % template[i][1][0])
-        elif template[i][1][1]=="stat":
-          cores_l2s = range(l2_cacheSharedCores*core, min(ncores, l2_cacheSharedCores*core+l2_cacheSharedCores))
-          cores_l3s = range(l3_cacheSharedCores*core, min(ncores, l3_cacheSharedCores*core+l3_cacheSharedCores))
-          # core statistics
-          if template[i][1][0]=="total_cycles":
-            template[i][0] = template[i][0] % cycles[core]
-          elif template[i][1][0]=="busy_cycles":
-            template[i][0] = template[i][0] % (cycles[core] - data[core]['idle_cycles'])
-          elif template[i][1][0]=="idle_cycles":
-            template[i][0] = template[i][0] % data[core]['idle_cycles']
-          elif template[i][1][0]=="total_system_cycles":
-            template[i][0] = template[i][0] % int(max_system_cycles)
-          elif template[i][1][0]=="total_system_idle_cycles":
-            template[i][0] = template[i][0] % int(0)
-          elif template[i][1][0]=="total_system_busy_cycles":
-            template[i][0] = template[i][0] % int(max_system_cycles)
-          elif template[i][1][0]=="function_calls":
-            template[i][0] = template[i][0] % int(instrs[core] * 0.05)
-          elif template[i][1][0]=="IFU.duty_cycle":
-            if float(((instrs[core]))/max_system_cycles) > 1:
-              template[i][0] = template[i][0] % 1
-            else:
-              template[i][0] = template[i][0] % float(((instrs[core]))/max_system_cycles)
-          elif template[i][1][0]=="LSU.duty_cycle":
-            if float((long(stats['L1-D.loads'][core])+long(stats['L1-D.stores'][core]))/max_system_cycles) <= 1:
-              template[i][0] = template[i][0] % float((long(stats['L1-D.loads'][core])+long(stats['L1-D.stores'][core]))/max_system_cycles)
-            else:
-              template[i][0] = template[i][0] % 1
-          elif template[i][1][0]=="MemManU.I.duty_cycle":
-            if float((long(stats['L1-I.loads'][core])+long(stats['L1-I.stores'][core]))/max_system_cycles) <= 1:
-              template[i][0] = template[i][0] % float((long(stats['L1-I.loads'][core])+long(stats['L1-I.stores'][core]))/max_system_cycles)
-            else:
-              template[i][0] = template[i][0] % 1
-          elif template[i][1][0]=="MemManU.D.duty_cycle":
-            if float((long(stats['L1-D.loads'][core])+long(stats['L1-D.stores'][core]))/max_system_cycles) <= 1:
-              template[i][0] = template[i][0] % float((long(stats['L1-D.loads'][core])+long(stats['L1-D.stores'][core]))/max_system_cycles)
-            else:
-              template[i][0] = template[i][0] % 1
-          elif template[i][1][0]=="FPU.duty_cycle":
-            template[i][0] = template[i][0] % min(1,float((int(data[core]['FP_instructions']))/max_system_cycles))
-          elif template[i][1][0]=="MUL.duty_cycle":
-            template[i][0] = template[i][0] % min(1,float((stats.get('interval_timer.uop_fp_muldiv', stats.get('rob_timer.uop_fp_muldiv', []))[core])/max_system_cycles))
-          elif template[i][1][0]=="ALU.duty_cycle":             #check whether it is per FP  basis or total
-            template[i][0] = template[i][0] % min(1,((instrs[core] - data[core]['FP_instructions'])/(max_system_cycles *  ALU_per_core)))
-          elif template[i][1][0]=="memory.reads":
-            template[i][0] = template[i][0] % DRAM_reads
-          elif template[i][1][0]=="memory.writes":
-            template[i][0] = template[i][0] % DRAM_writes
-          elif template[i][1][0]=="memory.accesses":
-            template[i][0] = template[i][0] % (int(DRAM_reads) + int(DRAM_writes))
-          elif template[i][1][0]=="NoC.type":
-            if 'network.shmem-1.mesh.link-in.num-requests' in stats or 'network.shmem-1.mesh.packets-in' in stats:
-              # 1 = NoC
-              template[i][0] = template[i][0] % 1
-            else:
-              # 0 = bus
-              template[i][0] = template[i][0] % 0
-          elif template[i][1][0]=="NoC.total_accesses":
-            if 'network.shmem-1.mesh.link-in.num-requests' in stats:
-              template[i][0] = template[i][0] % sum(stats['network.shmem-1.mesh.link-in.num-requests'])
-            elif 'network.shmem-1.mesh.packets-in' in stats:
-              template[i][0] = template[i][0] % sum(stats['network.shmem-1.mesh.packets-in'])
-            elif 'network.shmem-1.bus.num-requests' in stats:
-              template[i][0] = template[i][0] % int(stats['network.shmem-1.bus.num-requests'][0])  #assumption
-            elif 'network.shmem-1.bus.num-packets' in stats:
-              template[i][0] = template[i][0] % int(stats['network.shmem-1.bus.num-packets'][0])  #assumption
-            else:
-              template[i][0] = template[i][0] % int(stats['bus.num-requests'][0])  #assumption
-          elif template[i][1][0]=="NoC.duty_cycle":
-            if 'network.shmem-1.mesh.link-left.total-time-used' in stats:
-              DIRECTIONS = ('up', 'down', 'left', 'right')
-              total_time_used = sum([ sum(stats['network.shmem-1.mesh.link-%s.total-time-used' % direction]) for direction in DIRECTIONS ])
-              num_links_used = sum([ sum([ v > 0 and 1 or 0 for v in stats['network.shmem-1.mesh.link-%s.num-requests' % direction] ]) for direction in DIRECTIONS ])
-              # Not all links (e.g. boundary of mesh) are actually present in hardware
-              # Here we assume that all real links are used at least ones
-              avg_time_used = total_time_used / float(num_links_used or 1.)
-              duty_cycle = avg_time_used / (stats['global.time'] or 1.)
-              template[i][0] = template[i][0] % duty_cycle
-            elif 'network.shmem-1.mesh.packets-in' in stats:
-              # Mesh network model without proper accounting. Take a wild guess...
-              template[i][0] = template[i][0] % .5
-            elif 'network.shmem-1.bus.time-used' in stats:
-              template[i][0] = template[i][0] % min(1, cycles_scale[core]*float(stats['network.shmem-1.bus.time-used'][0])/max_system_cycles)
-            else:
-              template[i][0] = template[i][0] % min(1, cycles_scale[core]*float(stats['bus.time-used'][0])/max_system_cycles)
-          elif template[i][1][0]=="loads":
-            template[i][0] = template[i][0] % long(stats['L1-D.loads'][core])
-          elif template[i][1][0]=="stores":
-            template[i][0] = template[i][0] % long(stats['L1-D.stores'][core])
-          elif template[i][1][0]=="total_instructions":
-            template[i][0] = template[i][0] % instrs[core]
-          elif template[i][1][0]=="integer_ins":
-            template[i][0] = template[i][0] % int(int(instrs[core]) - int(data[core]['FP_instructions']) - int(data[core]['Branch_instructions']))
-          elif template[i][1][0]=="fp_ins":
-            template[i][0] = template[i][0] % int(data[core]['FP_instructions'])
-          elif template[i][1][0]=="itlb_total_accesses":
-            template[i][0] = template[i][0] % int(instrs[core]*0.5)
-          elif template[i][1][0]=="itlb_misses":
-            template[i][0] = template[i][0] % int(instrs[core]*(0.5*0.5/10000))
-          elif template[i][1][0]=="BTB.read_accesses":
-            template[i][0] = template[i][0] % int(data[core]['Branch_instructions'])  #instrs[core]
-          elif template[i][1][0]=="RAT_rename.reads":
-            template[i][0] = template[i][0] % int(2 * instrs[core])
-          elif template[i][1][0]=="RAT_rename.writes":
-            template[i][0] = template[i][0] % int(instrs[core])
-          elif template[i][1][0]=="RAT_fp_rename.reads":
-            template[i][0] = template[i][0] % int(2 * int(data[core]['FP_instructions']))
-          elif template[i][1][0]=="RAT_fp_rename.writes":
-            template[i][0] = template[i][0] % int(data[core]['FP_instructions'])
-          elif template[i][1][0]=="instr.reads":                #inst window stats
-            template[i][0] = template[i][0] % instrs[core]
-          elif template[i][1][0]=="instr.writes":
-            template[i][0] = template[i][0] % instrs[core]
-          elif template[i][1][0]=="instr.wakeup":
-            template[i][0] = template[i][0] % int(instrs[core]*2)
-          elif template[i][1][0]=="instr.fp.reads":
-            template[i][0] = template[i][0] % int(instrs[core]*0.5)
-          elif template[i][1][0]=="instr.fp.writes":
-            template[i][0] = template[i][0] % int(instrs[core]*0.5)
-          elif template[i][1][0]=="instr.fp.wakeup":
-            template[i][0] = template[i][0] % instrs[core]
-          elif template[i][1][0]=="window_switches.ialu_accesses":
-            template[i][0] = template[i][0] % int(data[core]['ialu_accesses'])
-          elif template[i][1][0]=="window_switches.fpu_accesses":
-            template[i][0] = template[i][0] % int(data[core]['FP_instructions'])
-          elif template[i][1][0]=="window_switches.mul_accesses":
-            template[i][0] = template[i][0] % int(stats.get('interval_timer.uop_fp_muldiv', stats.get('rob_timer.uop_fp_muldiv', []))[core])
-          elif template[i][1][0]=="window_switches.cdb_alu_accesses":
-            template[i][0] = template[i][0] % int(data[core]['ialu_accesses'])
-          elif template[i][1][0]=="window_switches.cdb_fpu_accesses":
-            template[i][0] = template[i][0] % int(data[core]['FP_instructions'])
-          elif template[i][1][0]=="window_switches.cdb_mul_accesses":
-            template[i][0] = template[i][0] % int(stats.get('interval_timer.uop_fp_muldiv', stats.get('rob_timer.uop_fp_muldiv', []))[core])
-          elif template[i][1][0]=="RF_accesses.int_regfile_reads":
-            template[i][0] = template[i][0] % int(instrs[core]*1.5)
-          elif template[i][1][0]=="RF_accesses.fp_regfile_reads":
-            template[i][0] = template[i][0] % int(instrs[core]*0.25)
-          elif template[i][1][0]=="RF_accesses.int_regfile_writes":
-            template[i][0] = template[i][0] % int(instrs[core]*0.75)
-          elif template[i][1][0]=="RF_accesses.fp_regfile_writes":
-            template[i][0] = template[i][0] % int(instrs[core]*0.125)
-          elif template[i][1][0]=="ROB_reads":
-            template[i][0] = template[i][0] % int(stats.get('interval_timer.uops_total', stats.get('rob_timer.uops_total', []))[core]*1)
-          elif template[i][1][0]=="ROB_writes":
-            template[i][0] = template[i][0] % int(stats.get('interval_timer.uops_total', stats.get('rob_timer.uops_total', []))[core]*1)
-          elif template[i][1][0]=="branch_ins":
-            template[i][0] = template[i][0] % int(data[core]['Branch_instructions'])
-          elif template[i][1][0]=="branch_mis":
-            template[i][0] = template[i][0] % int('branch_predictor.num-incorrect' in stats and stats['branch_predictor.num-incorrect'][core] or 0)
-          elif template[i][1][0]=="committed_ins":
-            template[i][0] = template[i][0] % int(instrs[core])
-          elif template[i][1][0]=="committed_int":
-            template[i][0] = template[i][0] % int((instrs[core])*0.5)
-          elif template[i][1][0]=="committed_fp":
-            template[i][0] = template[i][0] % int((instrs[core])*0.5)
-          elif template[i][1][0]=="itlb.total_accesses":        #itlb equals icache reads and writes
-            template[i][0] = template[i][0] % int(stats['L1-I.loads'][core] + stats['L1-I.stores'][core])
-          elif template[i][1][0]=="itlb.total_misses":
-            template[i][0] = template[i][0] % int(stats['L1-I.load-misses'][core] + stats['L1-I.store-misses'][core])
-          elif template[i][1][0]=="icache.read_accesses":
-            template[i][0] = template[i][0] % int(stats['L1-I.loads'][core])
-          elif template[i][1][0]=="dtlb.total_accesses":        #dtlb equals dcache reads and writes
-            template[i][0] = template[i][0] % int(stats['L1-D.loads'][core] + stats['L1-D.stores'][core])
-          elif template[i][1][0]=="dtlb.total_misses":
-            template[i][0] = template[i][0] % int(stats['L1-D.load-misses'][core] + stats['L1-D.store-misses'][core])
-          elif template[i][1][0]=="dcache.read_accesses":
-            template[i][0] = template[i][0] % int(stats['L1-D.loads'][core])
-          elif template[i][1][0]=="dcache.read_misses":
-            template[i][0] = template[i][0] % int(stats['L1-D.load-misses'][core])
-          elif template[i][1][0]=="dcache.write_accesses":
-            template[i][0] = template[i][0] % int(stats['L1-D.stores'][core])
-          elif template[i][1][0]=="dcache.write_misses":
-            template[i][0] = template[i][0] % int(stats['L1-D.store-misses'][core])
-          elif template[i][1][0]=="function_calls":
-            template[i][0] = template[i][0] % int(instrs[core] * 0.35000)
-          # L1 directory (not modeled)
-          elif template[i][1][0]=="L1_directory.read_accesses":
-            template[i][0] = template[i][0] % int(instrs[core] * 2)
-          elif template[i][1][0]=="L1_directory.write_accesses":
-            template[i][0] = template[i][0] % int(instrs[core] * 0.06667)
-          elif template[i][1][0]=="L1_directory.read_misses":
-            template[i][0] = template[i][0] % int(instrs[core] * 0.00408)
-          elif template[i][1][0]=="L1_directory.write_misses":
-            template[i][0] = template[i][0] % int(instrs[core] * 0.00005)
-          elif template[i][1][0]=="L1_directory.conflicts":
-            template[i][0] = template[i][0] % int(instrs[core]*0.00005)
-          # L2 directory (not modeled)
-          elif template[i][1][0]=="L2_directory.read_accesses":         #check for L2 or L2dir
-            template[i][0] = template[i][0] % int((instrs[core])*(0.125))
-          elif template[i][1][0]=="L2_directory.write_accesses":
-            template[i][0] = template[i][0] % int((instrs[core])*(0.0625))
-          elif template[i][1][0]=="L2_directory.read_misses":
-            template[i][0] = template[i][0] % int((instrs[core])*(0.004))
-          elif template[i][1][0]=="L2_directory.write_misses":
-            template[i][0] = template[i][0] % int((instrs[core])*(0.0004))
-          elif template[i][1][0]=="L2_directory.conflicts":
-            template[i][0] = template[i][0] % int((instrs[core])*(0.00025))
-          # L2 caches
-          elif template[i][1][0]=="L2.read_accesses":
-            template[i][0] = template[i][0] % sum([ stats['L2.loads'][c] for c in cores_l2s ])
-          elif template[i][1][0]=="L2.write_accesses":
-            template[i][0] = template[i][0] % sum([ stats['L2.stores'][c] for c in cores_l2s ])
-          elif template[i][1][0]=="L2.read_misses":
-            template[i][0] = template[i][0] % sum([ stats['L2.load-misses'][c] for c in cores_l2s ])
-          elif template[i][1][0]=="L2.write_misses":
-            template[i][0] = template[i][0] % sum([ stats['L2.store-misses'][c] for c in cores_l2s ])
-          elif template[i][1][0]=="L2_duty_cycle":
-            template[i][0] = template[i][0] % min(1,(sum([ stats['L2.loads'][c] + stats['L2.stores'][c] for c in cores_l2s ]) / float(max_system_cycles)))
-          # L3 caches
-          elif template[i][1][0]=="L3.read_accesses":
-            template[i][0] = template[i][0] % ('L3.loads' in stats and sum([ stats['L3.loads'][c] for c in cores_l3s ]) or 0)
-          elif template[i][1][0]=="L3.write_accesses":
-            template[i][0] = template[i][0] % ('L3.stores' in stats and sum([ stats['L3.stores'][c] for c in cores_l3s ]) or 0)
-          elif template[i][1][0]=="L3.read_misses":
-            template[i][0] = template[i][0] % ('L3.load-misses' in stats and sum([ stats['L3.load-misses'][c] for c in cores_l3s ]) or 0)
-          elif template[i][1][0]=="L3.write_misses":
-            template[i][0] = template[i][0] % ('L3.store-misses' in stats and sum([ stats['L3.store-misses'][c] for c in cores_l3s ]) or 0)
-          elif template[i][1][0]=="L3_duty_cycle":
-            template[i][0] = template[i][0] % min(1,('L3.loads' in stats and sum([ stats['L3.loads'][c] + stats['L3.stores'][c] for c in cores_l3s ]) / float(max_system_cycles) or 0))
-          else:
-            raise ValueError('Unknown stat template %s' % template[i][1][0])
-        elif template[i][1][1]=="comb":
-          if template[i][1][0]=="icache_cfg":
-            iconf=[]
-            iconf.append(int(l1_icacheSize)*1024)
-            iconf.append(l1_icacheBlockSize)
-            iconf.append(l1_icacheAssociativity)
-            iconf.append(1)
-            iconf.append(1)              #thoughput="Cycle time of the component"
-            iconf.append(latency_l1_i) #latency="access time"
-            iconf.append(0) # unused?
-            iconf.append(1) # 1 for writeback
-            template[i][0] = template[i][0] % tuple(iconf)
-          elif template[i][1][0]=="L2_config":
-            l2conf=[]
-            l2conf.append(int(l2_cacheSize)*1024)
-            l2conf.append(l2_cacheBlockSize)
-            l2conf.append(l2_cacheAssociativity)
-            l2conf.append(8)
-            l2conf.append(1)
-            l2conf.append(latency_l2)
-            l2conf.append(0) # unused?
-            l2conf.append(1) # 1 for writeback
-            template[i][0] = template[i][0] % tuple(l2conf)
-          elif template[i][1][0]=="dcache_cfg":
-            dconf=[]
-            dconf.append(int(l1_dcacheSize)*1024)
-            dconf.append(l1_dcacheBlockSize)
-            dconf.append(l1_dcacheAssociativity)
-            dconf.append(2)            #banks
-            # Increase throughput and latency constraints, otherwise McPAT calls CACTI some more
-            #   with tighter constraints, resulting in a ridiculously large dcache
-            dconf.append(10)            #thoughput="Cycle time of the component"
-            dconf.append(10*latency_l1_d)
-            dconf.append(0) # unused?
-            dconf.append(1) # 1 for writeback
-            template[i][0] = template[i][0] % tuple(dconf)
-          elif template[i][1][0]=="L3_config":
-            l3conf=[]
-            l3conf.append(int(l3_cacheSize)*1024)
-            l3conf.append(64)
-            l3conf.append(l3_cacheAssociativity)
-            l3conf.append(16)
-            l3conf.append(16)
-            l3conf.append(latency_l3)
-            l3conf.append(1)
-            template[i][0] = template[i][0] % tuple(l3conf)
-  return template, nuca_at_level
+        raise ValueError('Unknown stat template %s' % name)
+      lines[i] = lines[i] % value
+    return '\n'.join(lines)
+
+mcpat_inputs = {}
+
+def config_fingerprint(cfg):
+  # Hashable snapshot of a configuration, including per-core values of heterogeneous keys
+  def value(v):
+    if type(v) is collections.defaultdict:
+      return (v.default_factory(), tuple(sorted(v.items())))
+    else:
+      return v
+  return tuple(sorted([ (key, value(v)) for key, v in cfg.items() ]))
+
+def get_input(statsobj, cfg):
+  # McPATInput for this configuration, built once and reused for all intervals
+  key = config_fingerprint(cfg)
+  if key not in mcpat_inputs:
+    if len(mcpat_inputs) >= 16:
+      # Many configurations (e.g. changing DVFS settings through the power service), don't keep them all
+      mcpat_inputs.clear()
+    mcpat_inputs[key] = McPATInput(statsobj, cfg)
+  return mcpat_inputs[key]
+
+def edit_XML(statsobj, stats, cfg):
+  # Returns the McPAT input for these statistics and configuration, and the cache level NUCA was mapped onto (or False)
+  mcpat_input = get_input(statsobj, cfg)
+  return mcpat_input.make(stats), mcpat_input.nuca_at_level
+
 #----------
 def readTemplate(ncores, num_l2s, private_l2s, num_l3s, technology_node):
   Count = 0
@@ -1251,7 +1668,7 @@ def readTemplate(ncores, num_l2s, private_l2s, num_l3s, technology_node):
 
 if __name__ == '__main__':
   def usage():
-    print 'Usage:', sys.argv[0], '[-h (help)] [-j <jobid> | -d <resultsdir (default: .)>] [-t <type: %s>] [-c <override-config>] [-o <output-file (power{.png,.txt,.py})>]' % '|'.join(powertypes)
+    print 'Usage:', sys.argv[0], '[-h (help)] [-j <jobid> | -d <resultsdir (default: .)>] [-t <type: %s>] [-c <override-config>] [-o <output-file (power{.png,.txt,.py})>] [--partial=<from>:<to>] [--no-graph] [--no-text] [--serve (run as power service, see serve())] [--power-model=<file> (use surrogate power model when accurate)] [--calibrate (fit surrogate power model, written to <resultsdir>/%s)] [--calibrate-samples=<num (default: 32)>] [--calibrate-dvfs=<GHz>:<Vdd>[,...] (also check the power model at these DVFS operating points)] [--jobs=<num> (McPAT processes when calibrating, default: one per CPU)]' % ('|'.join(powertypes), SURROGATE_FILENAME)
     sys.exit(-1)
 
   jobid = 0
@@ -1263,9 +1680,15 @@ if __name__ == '__main__':
   no_graph = False
   no_text = False
   partial = None
+  do_serve = False
+  do_calibrate = False
+  calibrate_samples = 32
+  calibrate_points = []
+  power_model = None
+  workers = None
 
   try:
-    opts, args = getopt.getopt(sys.argv[1:], "hj:t:c:d:o:", [ 'no-graph', 'no-text', 'partial=' ])
+    opts, args = getopt.getopt(sys.argv[1:], "hj:t:c:d:o:", [ 'no-graph', 'no-text', 'partial=', 'serve', 'power-model=', 'calibrate', 'calibrate-samples=', 'calibrate-dvfs=', 'jobs=' ])
   except getopt.GetoptError, e:
     print e
     usage()
@@ -1294,6 +1717,25 @@ if __name__ == '__main__':
         sys.stderr.write('--partial=<from>:<to>\n')
         usage()
       partial = a.split(':')
+    if o == '--serve':
+      do_serve = True
+    if o == '--power-model':
+      power_model = a
+    if o == '--calibrate':
+      do_calibrate = True
+    if o == '--calibrate-samples':
+      calibrate_samples = int(a)
+    if o == '--calibrate-dvfs':
+      calibrate_points = [ tuple(map(float, point.split(':'))) for point in a.split(',') ]
+    if o == '--jobs':
+      workers = int(a)
+
+  if do_serve:
+    serve(resultsdir = resultsdir, outputfile = outputfile, configfile = config, power_model = power_model)
+    sys.exit(0)
+  if do_calibrate:
+    calibrate(jobid = jobid, resultsdir = resultsdir, config = config, num_samples = calibrate_samples, filename = power_model, workers = workers, operating_points = calibrate_points)
+    sys.exit(0)
 
 
-  main(jobid = jobid, resultsdir = resultsdir, powertype = powertype, config = config, outputfile = outputfile, no_graph = no_graph, print_stack = not no_text, partial = partial)
+  main(jobid = jobid, resultsdir = resultsdir, powertype = powertype, config = config, outputfile = outputfile, no_graph = no_graph, print_stack = not no_text, partial = partial, power_model = power_model)
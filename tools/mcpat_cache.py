@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+
+# Content-addressed cache of McPAT results, used by mcpat.py to skip running McPAT on an input it has seen before
+#   Keyed on a hash of the generated McPAT XML input and of the McPAT binary, entries hold the parsed power dictionary
+#   (before adding DRAM power) and the compressed McPAT output.
+#   Enabled by default, set SNIPER_MCPAT_CACHE=0 to disable. The cache lives in $SNIPER_MCPAT_CACHE_DIR, which can be
+#   shared between concurrent jobs, or by default $XDG_CACHE_HOME/sniper/mcpat (~/.cache/sniper/mcpat),
+#   and is limited to SNIPER_MCPAT_CACHE_SIZE megabytes (default 256), least recently used entries are evicted first
+
+import os, sys, getopt, hashlib, zlib, sniper_lib, sniper_results_cache
+
+DEFAULT_SIZE = 256 # MB
+
+
+def enabled():
+  return os.getenv('SNIPER_MCPAT_CACHE', '1').lower() not in ('0', 'false', 'no')
+
+def cache_dir():
+  return os.getenv('SNIPER_MCPAT_CACHE_DIR') or os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'sniper', 'mcpat')
+
+def max_size():
+  return long(float(os.getenv('SNIPER_MCPAT_CACHE_SIZE', DEFAULT_SIZE)) * 1024 * 1024)
+
+
+binary_hashes = {}
+
+def binary_hash(filename):
+  # Hash of the McPAT binary, computed once per process
+  if filename not in binary_hashes:
+    try:
+      binary_hashes[filename] = hashlib.sha1(open(filename, 'rb').read()).hexdigest()
+    except (IOError, TypeError):
+      binary_hashes[filename] = None
+  return binary_hashes[filename]
+
+def make_key(xml, binary, nuca_at_level):
+  # None if we can't identify the McPAT binary (results are then never cached)
+  binary = binary_hash(binary)
+  if binary is None:
+    return None
+  return {
+    'xml': hashlib.sha1(xml).hexdigest(),
+    'binary': binary,
+    'nuca_at_level': nuca_at_level,
+  }
+
+
+def get(key):
+  # Returns (power_dat, McPAT output text), or None
+  if not key:
+    return None
+  value = sniper_results_cache.get(key, cache_dir())
+  if value is None:
+    return None
+  power_dat, power_txt = value
+  return power_dat, zlib.decompress(power_txt)
+
+def put(key, power_dat, power_txt):
+  if key:
+    sniper_results_cache.put(key, (power_dat, zlib.compress(power_txt)), cache_dir(), max_size())
+
+
+if __name__ == '__main__':
+  def usage():
+    print 'Usage:', sys.argv[0], '[-h (help)] [-c|--clear] [--max-size=<MB> (evict down to this size)]'
+    print 'Cache directory: %s (%s)' % (cache_dir(), 'enabled' if enabled() else 'disabled, unset SNIPER_MCPAT_CACHE to enable')
+
+  do_clear = False
+  do_evict = None
+
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hc", [ 'clear', 'max-size=' ])
+  except getopt.GetoptError, e:
+    print e
+    usage()
+    sys.exit(-1)
+  for o, a in opts:
+    if o == '-h':
+      usage()
+      sys.exit()
+    if o in ('-c', '--clear'):
+      do_clear = True
+    if o == '--max-size':
+      do_evict = long(float(a) * 1024 * 1024)
+
+  if args:
+    usage()
+    sys.exit(-1)
+
+  if do_clear:
+    sniper_results_cache.evict(0, cache_dir())
+  elif do_evict is not None:
+    sniper_results_cache.evict(do_evict, cache_dir())
+
+  entries = sniper_results_cache.get_entries(cache_dir())
+  print '%d entries, %s in %s' % (len(entries), sniper_lib.format_size(sum([ size for filename, size, mtime in entries ])), cache_dir())
@@ -1,4 +1,6 @@
-import collections
+import collections, hashlib, re
+
+CONFIG_CACHE_SIZE = 8 # Parsed configurations to keep around, keyed by hash of the sim.cfg contents
 
 class DefaultValue:
   def __init__(self, value):
@@ -6,15 +8,80 @@ class DefaultValue:
   def __call__(self):
     return self.val
 
+class SniperConfig(dict):
+  # Dictionary of 'section/key' -> value, as returned by parse_config()
+  # Heterogeneous keys hold a defaultdict of per-core values, get_array() materializes them as a list once
+  def __init__(self, *args):
+    dict.__init__(self, *args)
+    self.arrays = {}
+
+  def copy(self):
+    return SniperConfig(self)
+
+  def get_array(self, key, n):
+    # Cached entries are only valid as long as key still holds the same value object
+    value, values = self.arrays.get(key, (None, None))
+    if value is not self[key] or len(values) < n:
+      value, values = self.arrays[key] = (self[key], [ get_config(self, key, index) for index in range(n) ])
+    return values[:n]
+
+
+# Read sim.cfg contents into a list of (section, [ (key, value) ]), with the same key and value
+# normalization as ConfigParser: keys are lowercased, later duplicates win and ' ;' starts a comment
+def read_sections(simcfg):
+  sections = collections.OrderedDict()
+  items = None
+  key = None
+  for line in simcfg.splitlines():
+    if not line.strip() or line[0] in '#;':
+      continue
+    if line[0] in ' \t' and key is not None:
+      # Continuation line
+      items[key] += '\n' + line.strip()
+      continue
+    line = line.strip()
+    if line.startswith('['):
+      section = line[1:line.index(']')]
+      items = sections.setdefault(section, collections.OrderedDict())
+      key = None
+      continue
+    if items is None:
+      raise ValueError('Option outside of section in config: %s' % line)
+    match = re.match(r'([^:=\s][^:=]*?)\s*[:=]\s*(.*)$', line)
+    if not match:
+      raise ValueError('Cannot parse config line: %s' % line)
+    key, value = match.group(1).lower(), match.group(2)
+    pos = value.find(';')
+    if pos != -1 and value[pos-1].isspace():
+      value = value[:pos].rstrip()
+    if value == '""':
+      value = ''
+    items[key] = value
+  return [ (section, items.items()) for section, items in sections.items() ]
+
+
+_cache = collections.OrderedDict()
+
 # Parse sim.cfg, read from file or from ic.job_output(jobid, 'sim.cfg'), into a dictionary
+# When cfg is given, simcfg is parsed as an override on top of it
 def parse_config(simcfg, cfg = None):
-  import ConfigParser, cStringIO
-  cp = ConfigParser.ConfigParser()
-  cp.readfp(cStringIO.StringIO(str(simcfg)))
-  if not cfg:
-    cfg = {}
-  for section in cp.sections():
-    for key, value in sorted(cp.items(section)):
+  simcfg = str(simcfg)
+  if cfg is None:
+    key = hashlib.sha1(simcfg).hexdigest()
+    if key in _cache:
+      return _cache[key].copy()
+    cfg = SniperConfig()
+    _parse_config(simcfg, cfg)
+    _cache[key] = cfg
+    while len(_cache) > CONFIG_CACHE_SIZE:
+      _cache.popitem(last = False)
+    return cfg.copy()
+  else:
+    return _parse_config(simcfg, cfg)
+
+def _parse_config(simcfg, cfg):
+  for section, items in read_sections(simcfg):
+    for key, value in sorted(items):
       # Remove comments at the end of a line
       value = value.split('#')[0]
       # Run through items sorted by key, so the default comes before the array one
@@ -27,6 +94,9 @@ def parse_config(simcfg, cfg = None):
           # Make value heterogeneous (unless it already was, and we're parsing a second, override config file)
           defval = cfg[key]
           cfg[key] = collections.defaultdict(DefaultValue(defval))
+        else:
+          # Don't modify a value that may be shared with a cached copy of the original config
+          cfg[key] = collections.defaultdict(cfg[key].default_factory, cfg[key])
         if ',' in value:
           for i, v in enumerate(value.split(',')):
             v = v.strip('"')
@@ -47,16 +117,24 @@ def parse_config(simcfg, cfg = None):
 
 
 def get_config(config, key, index = None):
-  is_hetero = (type(config[key]) == collections.defaultdict)
-  if index is None:
-    if is_hetero:
-      return config[key].default_factory()
+  value = config[key]
+  if type(value) is collections.defaultdict:
+    if index is None:
+      return value.default_factory()
     else:
-      return config[key]
-  elif is_hetero:
-    return config[key][index]
+      return value[index]
+  else:
+    return value
+
+
+def get_config_array(config, key, ncores = None):
+  # Values of key for cores 0 .. ncores-1 (default: all cores)
+  if ncores is None:
+    ncores = int(get_config(config, 'general/total_cores'))
+  if isinstance(config, SniperConfig):
+    return config.get_array(key, ncores)
   else:
-    return config[key]
+    return [ get_config(config, key, index) for index in range(ncores) ]
 
 
 def get_config_bool(config, key, index = None):
@@ -1,10 +1,14 @@
 # A copy of this file is distributed with the binaries of Sniper and Benchmarks
 
-import sys, os, re, subprocess, cStringIO, sniper_stats, sniper_config
+import sys, os, re, subprocess, cStringIO, multiprocessing, sniper_stats, sniper_config
 try:
   import json
 except ImportError:
   import localjson as json
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 
 try:
@@ -37,25 +41,212 @@ def get_config(jobid = None, resultsdir = None, force_deleted = True):
   return config
 
 
-def get_results(jobid = None, resultsdir = None, config = None, stats = None, partial = None, force = False, metrics = None):
+# metrics restricts the results to matching metric names, exact or as glob patterns (L1-D.*, dram.*) or compiled regular expressions
+# With use_arrays = True, per-core results are returned as numpy arrays rather than lists
+# With phases = True, results are extrapolated from the detailed intervals recorded by the phase-sampling script
+def get_results(jobid = None, resultsdir = None, config = None, stats = None, partial = None, force = False, metrics = None, use_arrays = False, phases = False):
+  if use_arrays and numpy is None:
+    raise RuntimeError('use_arrays requires numpy')
+  if phases and (jobid or not resultsdir):
+    raise ValueError('Phase extrapolation requires a resultsdir')
+  cachekey = None
+  if resultsdir and not jobid:
+    import sniper_results_cache
+    if sniper_results_cache.enabled():
+      cachekey = sniper_results_cache.make_key(resultsdir, partial = partial, metrics = metrics, use_arrays = use_arrays, phases = phases)
+      cached = sniper_results_cache.get(cachekey)
+      if cached is not None:
+        return cached
   if jobid:
     if ic_invalid:
       raise RuntimeError('Cannot fetch results from server, make sure BENCHMARKS_ROOT points to a valid copy of benchmarks+iqlib')
     results = ic.graphite_results(jobid, partial, metrics)
     config = get_config(jobid = jobid, force_deleted = force)
+    if numpy is None:
+      results = stats_process(config, results)
+    else:
+      results = stats_process_arrays(config, sniper_stats.results_to_arrays(results, int(config['general/total_cores'])))
   elif resultsdir:
-    results = parse_results_from_dir(resultsdir, partial = partial, metrics = metrics)
     config = get_config(resultsdir = resultsdir)
+    if numpy is None:
+      results = stats_process(config, parse_results_from_dir(resultsdir, partial = partial, metrics = metrics, phases = phases))
+    else:
+      results = stats_process_arrays(config, parse_results_from_dir(resultsdir, partial = partial, metrics = metrics, use_arrays = True, phases = phases))
   elif stats:
     config = config or stats.config
-    results = stats.parse_stats(partial or ('roi-begin', 'roi-end'), int(config['general/total_cores']), metrics = metrics)
+    ncores = int(config['general/total_cores'])
+    if numpy is None:
+      results = stats_process(config, stats.parse_stats(partial or ('roi-begin', 'roi-end'), ncores, metrics = metrics))
+    else:
+      results = stats_process_arrays(config, stats.parse_stats_arrays(partial or ('roi-begin', 'roi-end'), ncores, metrics = metrics))
   else:
     raise ValueError('Need either jobid or resultsdir')
 
-  return {
+  if numpy is not None and not use_arrays:
+    results = sniper_stats.arrays_to_lists(results)
+
+  results = {
     'config': config,
-    'results': stats_process(config, results),
+    'results': results,
   }
+  if cachekey:
+    sniper_results_cache.put(cachekey, results)
+  return results
+
+
+def read_phases(resultsdir):
+  phasesfile = os.path.join(resultsdir, 'sim.phases.json')
+  if not os.path.exists(phasesfile):
+    raise SniperResultsException("No phase information found, run with -s phase-sampling")
+  return json.load(open(phasesfile))
+
+
+# Extrapolate statistics for the complete ROI from the detailed samples of each phase, as written by scripts/phase-sampling.py
+#   Each phase's samples are scaled up to the number of instructions executed in that phase,
+#   phases without samples are represented by the sampled phase with the nearest centroid.
+#   Time stamps (*_begin, *_end pairs) become the extrapolated duration, starting at zero,
+#   a *_begin or *_end metric without its counterpart (e.g. when metrics matches only one of them) is a normal counter.
+def extrapolate_phases(stats, phases, ncores, metrics = None):
+  samples = phases['samples']
+  if not samples:
+    raise SniperResultsException("No detailed phase samples found")
+  sampled = sorted(set([ sample['phase'] for sample in samples ]))
+  def nearest(phase):
+    centroid = phases['phases'][phase]['centroid']
+    distance = lambda p: sum([ abs(v - c) for v, c in zip(centroid, phases['phases'][p]['centroid']) ])
+    return min(sampled, key = distance)
+  instrs = dict([ (phase, 0) for phase in sampled ])
+  for phase, info in enumerate(phases['phases']):
+    instrs[phase if phase in instrs else nearest(phase)] += info['instrs']
+  weights = dict([ (phase, instrs[phase] / float(sum([ s['instrs'] for s in samples if s['phase'] == phase ]) or 1)) for phase in sampled ])
+
+  prefixes = sum([ [ sample['begin'], sample['end'] ] for sample in samples ], [])
+  snapshots = stats.read_snapshots(prefixes, metrics = metrics)
+  def add(total, value):
+    if total is None or numpy.isscalar(value):
+      return value if total is None else total + value
+    if len(total) < len(value):
+      total, value = value, total
+    total = total.copy()
+    total[:len(value)] += value
+    return total
+  results = {}
+  dtypes = {}
+  timestamps = set()
+  for idx, sample in enumerate(samples):
+    arrays = stats.arrays_from_snapshots(snapshots, 2*idx, 2*idx+1, ncores)
+    for name, value in arrays.items():
+      if name.endswith('_begin') and name[:-len('_begin')] + '_end' in arrays:
+        continue
+      if name.endswith('_end') and name[:-len('_end')] + '_begin' in arrays:
+        value = value - arrays[name[:-len('_end')] + '_begin']
+        timestamps.add(name)
+      dtypes.setdefault(name, getattr(value, 'dtype', None))
+      results[name] = add(results.get(name), value * weights[sample['phase']])
+  for name, value in results.items():
+    if dtypes[name] is not None and dtypes[name].kind in 'iu':
+      results[name] = numpy.rint(value).astype(dtypes[name])
+    if name in timestamps:
+      results[name[:-len('_end')] + '_begin'] = numpy.zeros_like(results[name])
+  return results
+
+
+def get_results_many_worker((resultsdir, partial, metrics)):
+  try:
+    return (resultsdir, get_results(resultsdir = resultsdir, partial = partial, metrics = metrics), None)
+  except Exception, e:
+    return (resultsdir, None, '%s: %s' % (e.__class__.__name__, e))
+
+
+# Load results for many directories in parallel (default: one worker per CPU)
+#   Yields (resultsdir, results, error) tuples in order of completion,
+#   when parsing a directory fails results is None and error describes the exception
+def get_results_many(resultsdirs, partial = None, metrics = None, workers = None):
+  args = [ (resultsdir, partial, metrics) for resultsdir in resultsdirs ]
+  workers = min(workers or multiprocessing.cpu_count(), len(args))
+  if workers <= 1:
+    for arg in args:
+      yield get_results_many_worker(arg)
+    return
+  pool = multiprocessing.Pool(workers)
+  try:
+    for result in pool.imap_unordered(get_results_many_worker, args):
+      yield result
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+INTERVAL_SERIES_CHUNK = 64 # Snapshots to read at once, bounds memory use for long runs with many metrics
+
+def get_interval_prefixes(stats, interval = None, start = None, num_intervals = None):
+  # Snapshot names for a series of intervals: all periodic snapshots,
+  # or with interval (in fs) periodic-<start + i*interval> for i = 0 .. num_intervals (default: up to the last periodic snapshot)
+  times = sorted([ long(name.split('-')[1]) for name in stats.get_snapshots() if re.match(r'periodic-[0-9]+$', name) ])
+  if interval:
+    if start is None:
+      start = times[0] if times else 0
+    if num_intervals is None:
+      num_intervals = (times[-1] - start) / interval if times else 0
+    times = [ start + i*interval for i in range(num_intervals+1) ]
+  return [ 'periodic-%d' % time for time in times ]
+
+def iter_interval_series(stats, config, prefixes, metrics = None, use_arrays = False, skip_missing = False):
+  if skip_missing:
+    # Read runs of consecutive existing snapshots, intervals that start or end at a missing one become None
+    available = set(stats.get_snapshots())
+    valid = [ prefix in available for prefix in prefixes ]
+    i = 0
+    while i < len(prefixes)-1:
+      if not (valid[i] and valid[i+1]):
+        yield None
+        i += 1
+        continue
+      end = i+1
+      while end+1 < len(prefixes) and valid[end+1]:
+        end += 1
+      for results in iter_interval_series(stats, config, prefixes[i:end+1], metrics, use_arrays):
+        yield results
+      i = end
+    return
+  ncores = int(config['general/total_cores'])
+  if numpy is None or not hasattr(stats, 'read_snapshot'):
+    # Backends that can't read snapshots by themselves (sim.stats text files) go through parse_stats()
+    for k1, k2 in zip(prefixes[:-1], prefixes[1:]):
+      yield get_results(config = config, stats = stats, partial = (k1, k2), metrics = metrics, use_arrays = use_arrays)
+    return
+  for first in range(0, max(0, len(prefixes)-1), INTERVAL_SERIES_CHUNK):
+    # Consecutive chunks overlap by one snapshot
+    snapshots = stats.read_snapshots(prefixes[first:first+INTERVAL_SERIES_CHUNK+1], metrics = metrics)
+    for i in range(len(snapshots.prefixes)-1):
+      results = stats_process_arrays(config, stats.arrays_from_snapshots(snapshots, i, i+1, ncores))
+      if not use_arrays:
+        results = sniper_stats.arrays_to_lists(results)
+      yield {
+        'config': config,
+        'results': results,
+      }
+
+# Results for each interval between consecutive snapshots, reading every snapshot only once
+#   prefixes: snapshot names, or see get_interval_prefixes() for interval, start and num_intervals
+#   Returns an iterator over get_results()-style dictionaries (with partial = (prefixes[i], prefixes[i+1])),
+#   with skip_missing, None for intervals with a snapshot that is not in the database instead of raising ValueError,
+#   or when as_array is set, a sniper_stats.SniperStatsSnapshots object holding a (snapshots x metrics x cores) array of values
+#   for the requested metrics (use its deltas() method for per-interval values)
+def get_interval_series(resultsdir = None, prefixes = None, interval = None, metrics = None, jobid = None, config = None, stats = None,
+                        start = None, num_intervals = None, use_arrays = False, as_array = False, skip_missing = False):
+  if use_arrays and numpy is None:
+    raise RuntimeError('use_arrays requires numpy')
+  if stats is None:
+    if not jobid and not resultsdir:
+      raise ValueError('Need either jobid or resultsdir')
+    stats = sniper_stats.SniperStats(resultsdir = resultsdir, jobid = jobid)
+  config = config or stats.config
+  if prefixes is None:
+    prefixes = get_interval_prefixes(stats, interval, start, num_intervals)
+  if as_array:
+    return stats.read_snapshots(prefixes, metrics = metrics)
+  return iter_interval_series(stats, config, prefixes, metrics, use_arrays, skip_missing)
 
 
 def get_name(jobid = None, resultsdir = None):
@@ -76,6 +267,62 @@ def get_name(jobid = None, resultsdir = None):
 
 
 def stats_process(config, results):
+  # List-based interface, kept for compatibility: results is a list of (name, core, value) tuples
+  if numpy is None:
+    return stats_process_lists(config, results)
+  ncores = int(config['general/total_cores'])
+  return sniper_stats.arrays_to_lists(stats_process_arrays(config, sniper_stats.results_to_arrays(results, ncores)))
+
+
+def stats_process_arrays(config, stats):
+  # Vectorized version of stats_process(), stats is a {name: ndarray or scalar} dictionary
+  ncores = int(config['general/total_cores'])
+  stats = dict(stats)
+  # Figure out when the interval of time, represented by partial, actually begins/ends
+  if 'barrier.global_time_begin' in stats:
+    # Most accurate: ask the barrier
+    time0_begin = stats['barrier.global_time_begin'][0]
+    time0_end = stats['barrier.global_time_end'][0]
+    stats.update({'global.time_begin': time0_begin, 'global.time_end': time0_end, 'global.time': time0_end - time0_begin})
+  elif 'performance_model.elapsed_time_begin' in stats:
+    # Guess based on core that has the latest time (future wakeup is less common than sleep on futex)
+    time0_begin = stats['performance_model.elapsed_time_begin'].max()
+    time0_end = stats['performance_model.elapsed_time_end'].max()
+    stats.update({'global.time_begin': time0_begin, 'global.time_end': time0_end, 'global.time': time0_end - time0_begin})
+  # add computed stats
+  try:
+    l1access = stats['L1-D.load-misses'].sum() + stats['L1-D.store-misses'].sum()
+    l1time = stats['L1-D.total-latency'].sum()
+    stats['l1misslat'] = l1time / float(l1access or 1)
+  except KeyError:
+    pass
+  stats['pthread_locks_contended'] = float(numpy.sum(stats.get('pthread.pthread_mutex_lock_contended', 0))) / (numpy.sum(stats.get('pthread.pthread_mutex_lock_count', 0)) or 1)
+  # femtosecond to cycles conversion
+  freq = 1e9 * numpy.array(map(float, sniper_config.get_config_array(config, 'perf_model/core/frequency', ncores)))
+  stats['fs_to_cycles_cores'] = freq / 1e15
+  # Backwards compatible version returning fs_to_cycles for core 0, for heterogeneous configurations fs_to_cycles_cores needs to be used
+  stats['fs_to_cycles'] = stats['fs_to_cycles_cores'][0]
+  # Fixed versions of [idle|nonidle] elapsed time
+  if 'performance_model.elapsed_time' in stats and 'performance_model.idle_elapsed_time' in stats:
+    stats['performance_model.nonidle_elapsed_time'] = stats['performance_model.elapsed_time'][:ncores] - stats['performance_model.idle_elapsed_time'][:ncores]
+    stats['performance_model.idle_elapsed_time'] = time0_end - time0_begin - stats['performance_model.nonidle_elapsed_time']
+    stats['performance_model.elapsed_time'] = numpy.repeat(time0_end - time0_begin, ncores)
+  # DVFS-enabled runs: emulate cycle_count asuming constant (initial) frequency
+  if 'performance_model.elapsed_time' in stats and 'performance_model.cycle_count' not in stats:
+    stats['performance_model.cycle_count'] = stats['fs_to_cycles_cores'] * stats['performance_model.elapsed_time'][:ncores]
+  if 'thread.nonidle_elapsed_time' in stats and 'thread.nonidle_cycle_count' not in stats:
+    stats['thread.nonidle_cycle_count'] = (stats['fs_to_cycles'] * stats['thread.nonidle_elapsed_time']).astype(numpy.int64)
+  # IPC
+  if 'performance_model.cycle_count' in stats:
+    n = min(len(stats['performance_model.instruction_count']), len(stats['performance_model.cycle_count']))
+    cycles = stats['performance_model.cycle_count'][:n]
+    stats['ipc'] = stats['performance_model.instruction_count'][:n] / numpy.where(cycles != 0, cycles, 1)
+
+  return stats
+
+
+def stats_process_lists(config, results):
+  # Pure-Python implementation of stats_process(), used when numpy is not available
   ncores = int(config['general/total_cores'])
   stats = {}
   for key, core, value in results:
@@ -112,7 +359,7 @@ def stats_process(config, results):
     pass
   stats['pthread_locks_contended'] = float(sum(stats.get('pthread.pthread_mutex_lock_contended', [0]))) / (sum(stats.get('pthread.pthread_mutex_lock_count', [0])) or 1)
   # femtosecond to cycles conversion
-  freq = [ 1e9 * float(sniper_config.get_config(config, 'perf_model/core/frequency', idx)) for idx in range(ncores) ]
+  freq = [ 1e9 * float(value) for value in sniper_config.get_config_array(config, 'perf_model/core/frequency', ncores) ]
   stats['fs_to_cycles_cores'] = map(lambda f: f / 1e15, freq)
   # Backwards compatible version returning fs_to_cycles for core 0, for heterogeneous configurations fs_to_cycles_cores needs to be used
   stats['fs_to_cycles'] = stats['fs_to_cycles_cores'][0]
@@ -142,7 +389,11 @@ def stats_process(config, results):
   return stats
 
 
-def parse_results_from_dir(resultsdir, partial = None, metrics = None):
+# With use_arrays = True, returns a {name: ndarray or scalar} dictionary instead of a list of (name, core, value) tuples
+# With phases = True, sim.stats results are extrapolated from the phase samples in sim.phases.json (requires use_arrays)
+def parse_results_from_dir(resultsdir, partial = None, metrics = None, use_arrays = False, phases = False):
+  if phases and not use_arrays:
+    raise RuntimeError('Phase extrapolation requires numpy')
   results = []
 
   ## sim.cfg
@@ -153,7 +404,7 @@ def parse_results_from_dir(resultsdir, partial = None, metrics = None):
   ncores = int(simcfg['general/total_cores'])
 
   results += [ ('ncores', -1, ncores) ]
-  results += [ ('corefreq', idx, 1e9 * float(sniper_config.get_config(simcfg, 'perf_model/core/frequency', idx))) for idx in range(ncores) ]
+  results += [ ('corefreq', idx, 1e9 * float(value)) for idx, value in enumerate(sniper_config.get_config_array(simcfg, 'perf_model/core/frequency', ncores)) ]
 
   ## sim.info or graphite.out
   siminfo = os.path.join(resultsdir, 'sim.info')
@@ -176,18 +427,30 @@ def parse_results_from_dir(resultsdir, partial = None, metrics = None):
     k1, k2 = 'roi-begin', 'roi-end'
 
   stats = sniper_stats.SniperStats(resultsdir)
-  results += stats.parse_stats((k1, k2), ncores, metrics = metrics)
+  if phases:
+    results = sniper_stats.results_to_arrays(results, ncores)
+    results.update(extrapolate_phases(stats, read_phases(resultsdir), ncores, metrics = metrics))
+  elif use_arrays:
+    results = sniper_stats.results_to_arrays(results, ncores)
+    results.update(stats.parse_stats_arrays((k1, k2), ncores, metrics = metrics))
+  else:
+    results += stats.parse_stats((k1, k2), ncores, metrics = metrics)
 
   if not partial:
-    walltime = [ v for k, _, v in results if k == 'time.walltime' ]
-    instrs = [ v for k, _, v in results if k == 'core.instructions' ]
-    if walltime and instrs:
+    if use_arrays:
+      walltime = [ results['time.walltime'][0] ] if 'time.walltime' in results else []
+      instrs = results.get('core.instructions', [])
+    else:
+      walltime = [ v for k, _, v in results if k == 'time.walltime' ]
+      instrs = [ v for k, _, v in results if k == 'core.instructions' ]
+    if len(walltime) and len(instrs):
       walltime = walltime[0] / 1e6 # microseconds -> seconds
       instrs = sum(instrs)
-      results.append(('roi.walltime', -1, walltime))
-      results.append(('roi.instrs', -1, instrs))
-      results.append(('roi.ipstotal', -1, instrs / walltime))
-      results.append(('roi.ipscore', -1, instrs / (walltime * ncores)))
+      extra = [ ('roi.walltime', walltime), ('roi.instrs', instrs), ('roi.ipstotal', instrs / walltime), ('roi.ipscore', instrs / (walltime * ncores)) ]
+      if use_arrays:
+        results.update(extra)
+      else:
+        results += [ (key, -1, value) for key, value in extra ]
 
   ## power.py
   power = {}
@@ -195,7 +458,10 @@ def parse_results_from_dir(resultsdir, partial = None, metrics = None):
   if os.path.exists(powerfile):
     exec(open(powerfile).read())
     for key, value in power.items():
-      results.append(('power.%s' % key, -1, value))
+      if use_arrays:
+        results['power.%s' % key] = value
+      else:
+        results.append(('power.%s' % key, -1, value))
 
   return results
 
@@ -0,0 +1,179 @@
+#!/usr/bin/env python2
+
+# Persistent cache of sniper_lib.get_results() output, keyed by results directory fingerprint
+#   Enable by setting SNIPER_RESULTS_CACHE=1, the cache lives in $XDG_CACHE_HOME/sniper/results (default ~/.cache/sniper/results)
+#   and is limited to SNIPER_RESULTS_CACHE_SIZE megabytes (default 1024), least recently used entries are evicted first
+
+import os, sys, getopt, time, hashlib, tempfile, cPickle, sniper_lib
+
+# Files that get_results() reads from a results directory (with stats/async_write, new snapshots are in sim.stats.sqlite3-wal until checkpointed)
+FINGERPRINT_FILES = [ 'sim.cfg', 'sim.info', 'graphite.out', 'power.py',
+                      'sim.stats', 'sim.stats.base', 'sim.stats.delta', 'sim.stats.db', 'sim.stats.sqlite3',
+                      'sim.stats.sqlite3-wal', 'sim.phases.json' ]
+# Modules that turn statistics into get_results() output, entries made by a different version of them are not used
+CODE_FILES = [ 'sniper_lib.py', 'sniper_stats.py', 'sniper_stats_sqlite.py', 'sniper_stats_db.py', 'sniper_stats_compat.py',
+               'sniper_stats_jobid.py', 'sniper_stats_npy.py', 'sniper_config.py' ]
+# Bump when the layout of cache entries changes
+CACHE_VERSION = 2
+DEFAULT_SIZE = 1024 # MB
+
+
+def enabled():
+  return os.getenv('SNIPER_RESULTS_CACHE', '0').lower() in ('1', 'true', 'yes')
+
+def cache_dir():
+  return os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'sniper', 'results')
+
+def max_size():
+  return long(float(os.getenv('SNIPER_RESULTS_CACHE_SIZE', DEFAULT_SIZE)) * 1024 * 1024)
+
+
+code_hash = None
+
+def get_code_hash():
+  # Hash of the result processing code, computed once per process
+  global code_hash
+  if code_hash is None:
+    sha = hashlib.sha1()
+    for filename in CODE_FILES:
+      try:
+        sha.update(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), 'rb').read())
+      except IOError:
+        pass
+    code_hash = sha.hexdigest()
+  return code_hash
+
+def make_key(resultsdir, partial = None, metrics = None, **kwds):
+  resultsdir = os.path.realpath(resultsdir)
+  files = []
+  for filename in FINGERPRINT_FILES:
+    try:
+      st = os.stat(os.path.join(resultsdir, filename))
+      files.append((filename, st.st_mtime, st.st_size))
+    except OSError:
+      pass
+  return {
+    'version': CACHE_VERSION,
+    'code': get_code_hash(),
+    'resultsdir': resultsdir,
+    'files': files,
+    'partial': partial and list(partial),
+    # Compiled regular expressions are keyed on their pattern
+    'metrics': metrics and sorted([ getattr(metric, 'pattern', metric) for metric in metrics ]),
+    'options': sorted(kwds.items()),
+  }
+
+def key_filename(key, directory = None):
+  return os.path.join(directory or cache_dir(), hashlib.sha1(repr(sorted(key.items()))).hexdigest() + '.pickle')
+
+
+# get(), put(), get_entries() and evict() take an optional cache directory, for other caches using the same layout (see mcpat_cache.py)
+def get(key, directory = None):
+  filename = key_filename(key, directory)
+  try:
+    _key, value = cPickle.load(open(filename, 'rb'))
+  except Exception:
+    # Missing, truncated, or written by an incompatible version (unpickling can raise just about anything): a cache miss
+    return None
+  if _key != key:
+    return None
+  # Mark as recently used
+  try:
+    os.utime(filename, None)
+  except OSError:
+    pass
+  return value
+
+def put(key, value, directory = None, size = None):
+  directory = directory or cache_dir()
+  try:
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    # Write to a temporary file first so concurrent readers never see a partial entry
+    fd, tmpname = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+    fp = os.fdopen(fd, 'wb')
+    cPickle.dump((key, value), fp, cPickle.HIGHEST_PROTOCOL)
+    fp.close()
+    os.rename(tmpname, key_filename(key, directory))
+    evict(size or max_size(), directory)
+  except (IOError, OSError):
+    # Caching is best-effort
+    pass
+
+
+def get_entries(directory = None):
+  # List of (filename, size, last-used time), least recently used first
+  directory = directory or cache_dir()
+  entries = []
+  if os.path.exists(directory):
+    for filename in os.listdir(directory):
+      if filename.endswith('.pickle'):
+        filename = os.path.join(directory, filename)
+        try:
+          st = os.stat(filename)
+        except OSError:
+          continue
+        entries.append((filename, st.st_size, st.st_mtime))
+  return sorted(entries, key = lambda (filename, size, mtime): mtime)
+
+def evict(size, directory = None):
+  # Remove least recently used entries until the cache is no larger than size bytes
+  entries = get_entries(directory)
+  total = sum([ _size for filename, _size, mtime in entries ])
+  for filename, _size, mtime in entries:
+    if total <= size:
+      break
+    try:
+      os.unlink(filename)
+    except OSError:
+      pass
+    total -= _size
+
+def clear():
+  evict(0)
+
+
+if __name__ == '__main__':
+  def usage():
+    print 'Usage:', sys.argv[0], '[-h (help)] [-l|--list] [-c|--clear] [--max-size=<MB> (evict down to this size)]'
+    print 'Cache directory: %s (%s)' % (cache_dir(), 'enabled' if enabled() else 'disabled, set SNIPER_RESULTS_CACHE=1 to enable')
+
+  do_list = False
+  do_clear = False
+  do_evict = None
+
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hlc", [ 'list', 'clear', 'max-size=' ])
+  except getopt.GetoptError, e:
+    print e
+    usage()
+    sys.exit(-1)
+  for o, a in opts:
+    if o == '-h':
+      usage()
+      sys.exit()
+    if o in ('-l', '--list'):
+      do_list = True
+    if o in ('-c', '--clear'):
+      do_clear = True
+    if o == '--max-size':
+      do_evict = long(float(a) * 1024 * 1024)
+
+  if args:
+    usage()
+    sys.exit(-1)
+
+  if do_clear:
+    clear()
+  elif do_evict is not None:
+    evict(do_evict)
+
+  entries = get_entries()
+  if do_list:
+    for filename, size, mtime in reversed(entries):
+      try:
+        key, value = cPickle.load(open(filename, 'rb'))
+      except (IOError, EOFError, cPickle.UnpicklingError):
+        continue
+      print '%s  %8s  %s  %s' % (time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime)), sniper_lib.format_size(size), key['resultsdir'], ':'.join(key['partial'] or []))
+  print '%d entries, %s in %s' % (len(entries), sniper_lib.format_size(sum([ size for filename, size, mtime in entries ])), cache_dir())
@@ -1,15 +1,148 @@
-import sys, os, sniper_lib
+import sys, os, re, contextlib, sniper_lib
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 _, EVENT_MARKER, EVENT_THREAD_NAME, EVENT_APP_START, EVENT_APP_EXIT, EVENT_THREAD_CREATE, EVENT_THREAD_EXIT = range(7)
+# Written by sim.util.EventLog (syscalls.py, synctrace.py)
+EVENT_THREAD_START, EVENT_THREAD_STALL, EVENT_THREAD_RESUME, EVENT_THREAD_MIGRATE, EVENT_SYSCALL_ENTER, EVENT_SYSCALL_EXIT = range(7, 13)
+
+class SniperStatsSnapshots:
+  """Dense view of a series of snapshots, as returned by SniperStatsBase.read_snapshots().
+
+  values[s, m, c - coremin] is the value of metric nameids[m] for core c in snapshot prefixes[s].
+  lo[s, m] and hi[s, m] hold the range of core indices actually present in the snapshot
+  (lo is -1 for metrics with a global value, hi is one past the highest core index seen)."""
+  def __init__(self, prefixes, nameids, names, values, lo, hi, coremin):
+    self.prefixes = prefixes
+    self.nameids = nameids
+    self.names = names
+    self.values = values
+    self.lo = lo
+    self.hi = hi
+    self.coremin = coremin
+
+  def index(self, name):
+    return self.names.index(name)
+
+  def get(self, prefix, name):
+    return self.values[self.prefixes.index(prefix), self.index(name), -self.coremin:]
+
+  def deltas(self):
+    # Differences between all consecutive snapshots, shape (nsnapshots-1, nmetrics, ncores)
+    return self.values[1:] - self.values[:-1]
+
+
+def glob_to_regex(pattern):
+  # Only * and ? are wildcards, brackets are taken literally as they occur in metric names
+  return re.compile(''.join([ {'*': '.*', '?': '.'}.get(c, re.escape(c)) for c in pattern ]) + '$')
+
+def metrics_matcher(metrics):
+  # Returns a function that tells whether a metric name (object.metric) is selected by metrics, which can hold
+  # exact names, glob patterns using * and ? (L1-D.*, interval_timer.cpi*, dram.*) and compiled regular expressions (matched using re.match)
+  exact = set()
+  patterns = []
+  for metric in metrics:
+    if hasattr(metric, 'match'):
+      patterns.append(metric)
+    elif '*' in metric or '?' in metric:
+      patterns.append(glob_to_regex(metric))
+    else:
+      exact.add(metric)
+  def match(name):
+    if name in exact:
+      return True
+    for pattern in patterns:
+      if pattern.match(name):
+        return True
+    return False
+  return match
+
+def select_nameids(names, metrics):
+  # Resolve metrics against the names table, returns the set of matching nameids (or None when no selection was made)
+  if not metrics:
+    return None
+  match = metrics_matcher(metrics)
+  return set([ nameid for nameid, (objectname, metricname) in names.items() if match('%s.%s' % (objectname, metricname)) ])
+
+
+def build_snapshots(prefixes, names, rows, metrics = None, positions = None):
+  # Convert (snapshot index, nameid, core, value) rows into a SniperStatsSnapshots object
+  # When positions is given, the first column holds a backend-specific key instead, which maps to a list of snapshot indices
+  if numpy is None:
+    raise RuntimeError('Reading multiple snapshots at once requires numpy')
+  selected = select_nameids(names, metrics)
+  nameids = sorted([ nameid for nameid in names.keys() if selected is None or nameid in selected ])
+  rows = numpy.array(rows, dtype = numpy.int64).reshape(-1, 4)
+  if positions:
+    keys = rows[:,0].copy()
+    lookup = numpy.zeros(max(positions.keys()) + 1, dtype = numpy.int64)
+    duplicates = []
+    for key, idxs in positions.items():
+      lookup[key] = idxs[0]
+      for idx in idxs[1:]:
+        duplicate = rows[keys == key]
+        duplicate[:,0] = idx
+        duplicates.append(duplicate)
+    rows[:,0] = lookup[keys]
+    rows = numpy.concatenate([ rows ] + duplicates)
+  # Rows for metrics we don't know about (registered after the names table was read), or that were not requested, are dropped
+  lookup = numpy.zeros(max(nameids + [ int(rows[:,1].max()) if len(rows) else 0 ]) + 1, dtype = numpy.int64) - 1
+  lookup[nameids] = numpy.arange(len(nameids))
+  rows = rows[lookup[rows[:,1]] >= 0]
+  snapidx, metricidx, cores = rows[:,0], lookup[rows[:,1]], rows[:,2]
+  coremin = min(0, int(cores.min())) if len(cores) else 0
+  coremax = max(0, int(cores.max())) if len(cores) else 0
+  values = numpy.zeros((len(prefixes), len(nameids), coremax + 1 - coremin), dtype = numpy.int64)
+  values[snapidx, metricidx, cores - coremin] = rows[:,3]
+  lo = numpy.zeros((len(prefixes), len(nameids)), dtype = numpy.int64)
+  hi = numpy.zeros((len(prefixes), len(nameids)), dtype = numpy.int64)
+  numpy.minimum.at(lo, (snapidx, metricidx), cores)
+  numpy.maximum.at(hi, (snapidx, metricidx), cores + 1)
+  return SniperStatsSnapshots(list(prefixes), nameids, [ '%s.%s' % names[nameid] for nameid in nameids ], values, lo, hi, coremin)
+
+
+def filter_events(rows, time_begin = None, time_end = None, events = None, threads = None):
+  # Generic version of the get_events() filters, for backends that cannot query for them
+  return [ row for row in rows
+           if (time_begin is None or row[1] >= time_begin) and (time_end is None or row[1] < time_end)
+              and (events is None or row[0] in events) and (threads is None or row[3] in threads) ]
+
+def results_to_arrays(results, ncores):
+  # Convert a parse_stats()-style list of (name, core, value) tuples into {name: ndarray}
+  # Entries with core == -1 become scalars, per-core lists are at least ncores long
+  items = {}
+  for key, core, value in results:
+    items.setdefault(key, []).append((core, value))
+  arrays = {}
+  for key, values in items.items():
+    if values[-1][0] == -1:
+      arrays[key] = values[-1][1]
+      continue
+    cores, values = zip(*[ (core, value) for core, value in values if core >= 0 ])
+    values = numpy.array(values)
+    arrays[key] = numpy.zeros(max(ncores, max(cores)+1), dtype = values.dtype)
+    arrays[key][list(cores)] = values
+  return arrays
+
+
+def arrays_to_lists(arrays):
+  # Convert {name: ndarray} back into {name: list} (and numpy scalars into Python numbers)
+  return dict([ (key, value.tolist() if hasattr(value, 'tolist') else value) for key, value in arrays.items() ])
+
 
 class SniperStatsBase:
   def parse_stats(self, (k1, k2), ncores, metrics = None):
+    if numpy is not None:
+      return self.results_from_snapshots(self.read_snapshots((k1, k2), metrics = metrics), 0, 1, ncores)
     v1 = self.read_snapshot(k1, metrics = metrics)
     v2 = self.read_snapshot(k2, metrics = metrics)
+    selected = self.select_nameids(metrics)
     results = []
     for metricid in self.names.keys():
       name = '%s.%s' % self.names[metricid]
-      if metrics and name not in metrics:
+      if selected is not None and metricid not in selected:
         continue
       id_min = min(min(v2.get(metricid, {}).keys() or [0]), 0)
       id_max = max(max(v2.get(metricid, {}).keys() or [0])+1, ncores)
@@ -24,10 +157,125 @@ class SniperStatsBase:
         results += [ ('barrier.global_time_end', idx, vals2.get(idx, 0)) for idx in range(ncores) ]
     return results
 
+  def select_nameids(self, metrics):
+    # Resolve the (possibly pattern-based) metric selection once per names table,
+    # backends that re-read their names replace self.names which invalidates earlier selections
+    if not metrics:
+      return None
+    key = tuple(metrics)
+    if not hasattr(self, 'selections'):
+      self.selections = {}
+    if key not in self.selections or self.selections[key][0] is not self.names:
+      self.selections[key] = (self.names, select_nameids(self.names, metrics))
+    return self.selections[key][1]
+
+  def parse_stats_series(self, prefixes, ncores, metrics = None):
+    # Read all snapshots in one go, return parse_stats() results for each pair of consecutive prefixes
+    snapshots = self.read_snapshots(prefixes, metrics = metrics)
+    return [ self.results_from_snapshots(snapshots, i, i+1, ncores) for i in range(len(prefixes)-1) ]
+
+  def read_snapshots(self, prefixes, metrics = None):
+    # Generic version, backends that can fetch multiple snapshots at once should override this
+    rows = []
+    for idx, prefix in enumerate(prefixes):
+      for nameid, items in self.read_snapshot(prefix, metrics = metrics).items():
+        # Some backends return unsigned 64-bit values, wrap them into int64 like sqlite does
+        rows += [ (idx, nameid, core, value if value < 2**63 else value - 2**64) for core, value in items.items() ]
+    return build_snapshots(prefixes, self.names, rows, metrics = metrics)
+
+  def results_from_snapshots(self, snapshots, i1, i2, ncores):
+    # Same output as parse_stats(), for the interval between snapshots.prefixes[i1] and snapshots.prefixes[i2]
+    results = []
+    coremin = snapshots.coremin
+    width = snapshots.values.shape[2] + coremin
+    def values(vals, id_min, id_max):
+      # Cores beyond what was seen in any snapshot are zero
+      return vals[id_min-coremin:min(id_max, width)-coremin].tolist() + [0] * max(0, id_max - max(id_min, width))
+    for m, name in enumerate(snapshots.names):
+      vals1 = snapshots.values[i1, m]
+      vals2 = snapshots.values[i2, m]
+      id_min = int(snapshots.lo[i2, m])
+      id_max = max(int(snapshots.hi[i2, m]) or 1, ncores)
+      results += zip([ name ] * (id_max - id_min), range(id_min, id_max), values(vals2 - vals1, id_min, id_max))
+      if name == 'performance_model.elapsed_time' and id_max <= ncores:
+        results += zip([ 'performance_model.elapsed_time_begin' ] * ncores, range(ncores), values(vals1, 0, ncores))
+        results += zip([ 'performance_model.elapsed_time_end' ] * ncores, range(ncores), values(vals2, 0, ncores))
+      elif name == 'barrier.global_time':
+        results += zip([ 'barrier.global_time_begin' ] * ncores, range(ncores), values(vals1, 0, ncores))
+        results += zip([ 'barrier.global_time_end' ] * ncores, range(ncores), values(vals2, 0, ncores))
+    return results
+
+  def parse_stats_arrays(self, (k1, k2), ncores, metrics = None):
+    # Array-backed version of parse_stats(): returns {metric: ndarray} with one entry per core
+    return self.arrays_from_snapshots(self.read_snapshots((k1, k2), metrics = metrics), 0, 1, ncores)
+
+  def arrays_from_snapshots(self, snapshots, i1, i2, ncores):
+    # Same contents as results_from_snapshots(), but as {metric: ndarray}
+    # Metrics that only have a global (core -1) value are returned as a scalar
+    coremin = snapshots.coremin
+    deltas = snapshots.values[i2] - snapshots.values[i1]
+    def padded(vals, n):
+      vals = vals[-coremin:]
+      if len(vals) >= n:
+        return vals[:n]
+      else:
+        return numpy.concatenate((vals, numpy.zeros(n - len(vals), dtype = vals.dtype)))
+    results = {}
+    for m, name in enumerate(snapshots.names):
+      id_max = max(int(snapshots.hi[i2, m]) or 1, ncores)
+      if snapshots.lo[i2, m] < 0 and snapshots.hi[i2, m] <= 0:
+        results[name] = deltas[m, -1-coremin].item()
+        continue
+      results[name] = padded(deltas[m], id_max)
+      if name == 'performance_model.elapsed_time' and id_max <= ncores:
+        results['performance_model.elapsed_time_begin'] = padded(snapshots.values[i1, m], ncores)
+        results['performance_model.elapsed_time_end'] = padded(snapshots.values[i2, m], ncores)
+      elif name == 'barrier.global_time':
+        results['barrier.global_time_begin'] = padded(snapshots.values[i1, m], ncores)
+        results['barrier.global_time_end'] = padded(snapshots.values[i2, m], ncores)
+    return results
+
+  @contextlib.contextmanager
+  def read_transaction(self):
+    # Reads inside the with block see the same database contents, for backends that can be read while the simulator writes to them
+    yield
+
+  def get_timeseries_levels(self):
+    # Levels of the multi-resolution time series store written by periodic-stats, as a list of (level, interval, capacity)
+    return []
+
+  def get_timeseries_times(self, level):
+    # Times (in femtoseconds since the start of the ROI) of all snapshots retained at level
+    raise ValueError("Time series information not available from statistics of this type")
+
+  def select_timeseries_level(self, resolution = None, time_begin = None):
+    # Finest level with an interval of at least resolution, that still holds time_begin
+    # (by default the oldest snapshot retained at any level, so the selection covers as much of the run as possible)
+    levels = sorted(self.get_timeseries_levels(), key = lambda (level, interval, capacity): interval)
+    if not levels:
+      raise ValueError("No time series information available")
+    if time_begin is None:
+      time_begin = min([ times[0] for times in map(self.get_timeseries_times, [ level for level, interval, capacity in levels ]) if times ] or [ None ])
+    candidates = [ level for level, interval, capacity in levels if not resolution or interval >= resolution ] or [ levels[-1][0] ]
+    for level in candidates:
+      times = self.get_timeseries_times(level)
+      if times and (time_begin is None or times[0] <= time_begin):
+        return level
+    return candidates[-1]
+
+  def read_timeseries(self, resolution = None, time_begin = None, time_end = None, metrics = None):
+    # Read snapshots from the time series store, for [time_begin, time_end] at the level chosen by select_timeseries_level()
+    # Returns a SniperStatsSnapshots object, its prefixes are the periodic-<time> names the snapshots are available under
+    level = self.select_timeseries_level(resolution, time_begin)
+    times = [ time for time in self.get_timeseries_times(level) if (time_begin is None or time >= time_begin) and (time_end is None or time <= time_end) ]
+    return self.read_snapshots([ 'periodic-%d' % time for time in times ], metrics = metrics)
+
   def get_topology(self):
     raise ValueError("Topology information not available from statistics of this type")
 
-  def get_events(self):
+  def get_events(self, time_begin = None, time_end = None, events = None, threads = None):
+    # List of (event, time, core, thread, value0, value1, description), optionally only those with time_begin <= time < time_end (in fs),
+    # of the given event types, and/or of the given threads
     raise ValueError("Event information not available from statistics of this type")
 
   def get_markers(self):
@@ -48,13 +296,23 @@ class SniperStatsBase:
     return sniper_lib.get_results(stats = self, **kwds)
 
 
-def SniperStats(resultsdir = '.', jobid = None):
+def SniperStats(resultsdir = '.', jobid = None, use_cache = None, live = False):
+  # use_cache: keep a memory-mappable columnar copy of sim.stats.sqlite3 next to it (sim.stats.sqlite3.npy)
+  #   Defaults to the value of the SNIPER_STATS_CACHE environment variable
+  # live: read sim.stats.sqlite3 while the simulation is still running (never uses the cache)
+  if live:
+    use_cache = False
+  elif use_cache is None:
+    use_cache = os.getenv('SNIPER_STATS_CACHE', '0').lower() in ('1', 'true', 'yes')
   if jobid:
     import sniper_stats_jobid
     stats = sniper_stats_jobid.SniperStatsJobid(jobid)
   elif os.path.exists(os.path.join(resultsdir, 'sim.stats.sqlite3')):
     import sniper_stats_sqlite
-    stats = sniper_stats_sqlite.SniperStatsSqlite(os.path.join(resultsdir, 'sim.stats.sqlite3'))
+    stats = sniper_stats_sqlite.SniperStatsSqlite(os.path.join(resultsdir, 'sim.stats.sqlite3'), live = live)
+    if use_cache and numpy is not None:
+      import sniper_stats_npy
+      stats = sniper_stats_npy.SniperStatsNpy(stats, os.path.join(resultsdir, 'sim.stats.sqlite3'))
   elif os.path.exists(os.path.join(resultsdir, 'sim.stats.db')):
     import sniper_stats_db
     stats = sniper_stats_db.SniperStatsDb(os.path.join(resultsdir, 'sim.stats.db'))
@@ -1,26 +1,72 @@
 import os, re, sniper_stats
+try:
+  import json
+except ImportError:
+  import localjson as json
 
 class SniperStatsCompat(sniper_stats.SniperStatsBase):
   def __init__(self, resultsdir):
     self.resultsdir = resultsdir
+    self.sections = None
 
-  def parse_stats(self, (k1, k2), ncores, metrics = None):
-    simstats = os.path.join(self.resultsdir, 'sim.stats')
-    simstats = os.path.exists(simstats) and open(simstats) or None
+  def get_statsfile(self):
+    simstatsdelta = os.path.join(self.resultsdir, 'sim.stats.delta')
+    if os.path.exists(simstatsdelta):
+      return simstatsdelta
+    else:
+      return os.path.join(self.resultsdir, 'sim.stats')
+
+  def get_sections(self):
+    # List of (prefix, start, end) byte ranges, one for each run of lines with the same prefix
+    # Built once and kept in <statsfile>.index, which is valid as long as the stats file's mtime and size don't change
+    if self.sections is not None:
+      return self.sections
+    filename = self.get_statsfile()
+    st = os.stat(filename)
+    source = { 'mtime': st.st_mtime, 'size': st.st_size }
+    try:
+      index = json.load(open(filename + '.index'))
+      if index.get('source') == source:
+        self.sections = [ (str(prefix), start, end) for prefix, start, end in index['sections'] ]
+        return self.sections
+    except (IOError, ValueError):
+      pass
+    self.sections = []
+    fp = open(filename)
+    offset = 0
+    for line in iter(fp.readline, ''):
+      if '.' in line:
+        prefix = line.split('.', 1)[0]
+        if self.sections and self.sections[-1][0] == prefix and self.sections[-1][2] == offset:
+          self.sections[-1] = (prefix, self.sections[-1][1], offset + len(line))
+        else:
+          self.sections.append((prefix, offset, offset + len(line)))
+      offset += len(line)
+    try:
+      json.dump({ 'source': source, 'sections': self.sections }, open(filename + '.index.tmp', 'w'))
+      os.rename(filename + '.index.tmp', filename + '.index')
+    except (IOError, OSError):
+      pass
+    return self.sections
+
+  def read_section(self, prefix):
+    # Yield (key, value) for all lines of prefix, in file order
+    fp = open(self.get_statsfile())
+    for _prefix, start, end in self.get_sections():
+      # Sections are indexed on the part before the first dot, which is all of prefix unless it contains dots itself
+      if prefix == _prefix or prefix.startswith(_prefix + '.'):
+        fp.seek(start)
+        for line in fp.read(end - start).splitlines():
+          fields = line.split()
+          if len(fields) >= 2 and fields[0].startswith(prefix+'.'):
+            yield fields[0][len(prefix+'.'):], long(fields[1])
 
+  def parse_stats(self, (k1, k2), ncores, metrics = None):
     simstatsbase = os.path.join(self.resultsdir, 'sim.stats.base')
     simstatsbase = os.path.exists(simstatsbase) and open(simstatsbase) or None
 
-    simstatsdelta = os.path.join(self.resultsdir, 'sim.stats.delta')
-    simstatsdelta = os.path.exists(simstatsdelta) and open(simstatsdelta) or None
-
-    stats_begin = {}
-    stats = {}
-    for line in (simstatsdelta or simstats):
-      if line.startswith(k1+'.'):
-        stats_begin[line.split()[0][len(k1+'.'):]] = long(line.split()[1])
-      if line.startswith(k2+'.'):
-        stats[line.split()[0][len(k2+'.'):]] = long(line.split()[1])
+    stats_begin = dict(self.read_section(k1))
+    stats = dict(self.read_section(k2))
 
     if simstatsbase:
       # End stats may not be empty, check before adding the defaults
@@ -37,9 +83,14 @@ class SniperStatsCompat(sniper_stats.SniperStatsBase):
       if not stats or not stats_begin:
         raise ValueError("Could not find stats in sim.stats (%s:%s)" % (k1, k2))
 
+    # Stats files have no names table, match each metric name (without core index) instead
+    match = metrics and sniper_stats.metrics_matcher(metrics)
+
     results = []
 
     for core in range(ncores):
+      if match and not match('performance_model.elapsed_time'):
+        break
       key = 'performance_model[%d].elapsed_time' % core
       if key in stats_begin:
         results.append(('performance_model.elapsed_time_begin', core, stats_begin[key]))
@@ -55,10 +106,18 @@ class SniperStatsCompat(sniper_stats.SniperStatsBase):
         key, core = key[0] + key[2], int(key[1])
       else:
         core = -1
+      if match and not match(key):
+        continue
       results.append((key, core, value))
 
     return results
 
+  def parse_stats_arrays(self, (k1, k2), ncores, metrics = None):
+    return sniper_stats.results_to_arrays(self.parse_stats((k1, k2), ncores, metrics = metrics), ncores)
+
   def get_snapshots(self):
-    # Should be easily parseable from sim.stats.delta, but who cares
-    raise NotImplementedError
+    snapshots = []
+    for prefix, start, end in self.get_sections():
+      if prefix not in snapshots:
+        snapshots.append(prefix)
+    return snapshots
@@ -1,4 +1,11 @@
 import os, bsddb, struct, zlib, sniper_stats
+try:
+  import json
+except ImportError:
+  import localjson as json
+
+SNAPSHOT_END_MARKER = -12345
+SNAPSHOT_CACHE_SIZE = 4 # Decoded snapshots to keep around (parse_stats reads each periodic snapshot twice)
 
 class SniperStatsDbObject:
   def __init__(self, data):
@@ -21,13 +28,79 @@ class SniperStatsDbObject:
     return value
 
 
+def decode_snapshot(data, metricids = None):
+  # Bulk decoder for a decompressed snapshot, returns (metricid, index, value) as three numpy arrays
+  # When metricids is given, blocks of other metrics are skipped without being decoded
+  # Layout: int32 num, then for each metric: int32 metricid, (int32 index, uint64 value)*, int32 SNAPSHOT_END_MARKER
+  # All fields are a multiple of 4 bytes long, so the snapshot can be viewed as an int32 array
+  numpy = sniper_stats.numpy
+  words = numpy.frombuffer(data, dtype = numpy.int32, count = len(data) // 4)
+  # Candidate end markers; a value can contain the marker too, real ones are at a multiple of 3 words from the metricid
+  markers = numpy.flatnonzero(words == SNAPSHOT_END_MARKER)
+  pair = numpy.dtype([ ('index', '=i4'), ('value', '=u8') ])
+  blocks = []
+  pos = 1
+  while pos < len(words):
+    metricid = int(words[pos])
+    first = pos + 1
+    m = numpy.searchsorted(markers, first)
+    while (markers[m] - first) % 3:
+      m += 1
+    count = (markers[m] - first) // 3
+    if metricids is None or metricid in metricids:
+      blocks.append((metricid, numpy.frombuffer(data, dtype = pair, count = int(count), offset = int(first) * 4)))
+    pos = int(markers[m]) + 1
+  if not blocks:
+    empty = numpy.zeros(0, dtype = numpy.int64)
+    return empty, empty, empty
+  ids = numpy.repeat([ metricid for metricid, items in blocks ], [ len(items) for metricid, items in blocks ])
+  items = numpy.concatenate([ items for metricid, items in blocks ])
+  # Store values as int64 (wrapping like the sqlite backend does) so deltas can go negative
+  return ids.astype(numpy.int64), items['index'].astype(numpy.int64), items['value'].view(numpy.int64)
+
+
 class SniperStatsDb(sniper_stats.SniperStatsBase):
   def __init__(self, filename = 'sim.stats.db'):
+    self.filename = filename
     self.db = bsddb.hashopen(filename, 'r')
-    self.names = self.read_metricnames()
+    self.snapshots = None
+    self.decoded = []
+    self.load_index()
+    if self.names is None:
+      self.names = self.read_metricnames()
+
+  # Snapshot list and names table are kept in <filename>.json, valid as long as the database's mtime and size don't change
+  def get_fingerprint(self):
+    st = os.stat(self.filename)
+    return { 'mtime': st.st_mtime, 'size': st.st_size }
+
+  def load_index(self):
+    self.names = None
+    try:
+      index = json.load(open(self.filename + '.json'))
+    except (IOError, ValueError):
+      return
+    if index.get('source') != self.get_fingerprint():
+      return
+    self.snapshots = [ str(prefix) for prefix in index['snapshots'] ]
+    self.names = dict([ (int(keyid), (str(object), str(metric))) for keyid, object, metric in index['names'] ])
+
+  def save_index(self):
+    try:
+      json.dump({
+        'source': self.get_fingerprint(),
+        'snapshots': self.snapshots,
+        'names': [ (keyid, object, metric) for keyid, (object, metric) in self.names.items() ],
+      }, open(self.filename + '.json.tmp', 'w'))
+      os.rename(self.filename + '.json.tmp', self.filename + '.json')
+    except (IOError, OSError):
+      pass
 
   def get_snapshots(self):
-    return [ key[1:] for key in self.db.keys() if key.startswith('d') ]
+    if self.snapshots is None:
+      self.snapshots = [ key[1:] for key in self.db.keys() if key.startswith('d') ]
+      self.save_index()
+    return list(self.snapshots)
 
   def read_metricnames(self):
     names = {}
@@ -39,7 +112,30 @@ class SniperStatsDb(sniper_stats.SniperStatsBase):
       names[keyid] = (object, metric)
     return names
 
+  def read_snapshot_arrays(self, prefix, metrics = None):
+    metricids = self.select_nameids(metrics)
+    key = (prefix, metricids is not None and frozenset(metricids))
+    for _key, arrays in self.decoded:
+      if _key == key:
+        return arrays
+    arrays = decode_snapshot(zlib.decompress(self.db['d%s' % prefix]), metricids)
+    self.decoded = [ (key, arrays) ] + self.decoded[:SNAPSHOT_CACHE_SIZE-1]
+    return arrays
+
   def read_snapshot(self, prefix, metrics = None):
+    numpy = sniper_stats.numpy
+    if numpy is None:
+      return self.read_snapshot_python(prefix, metrics = metrics)
+    values = {}
+    metricids, indices, items = self.read_snapshot_arrays(prefix, metrics = metrics)
+    # Keep the values unsigned here, like the pure-Python decoder
+    for metricid, index, value in zip(metricids.tolist(), indices.tolist(), items.view(numpy.uint64).tolist()):
+      if metricid not in values: values[metricid] = {}
+      values[metricid][index] = value
+    return values
+
+  def read_snapshot_python(self, prefix, metrics = None):
+    selected = self.select_nameids(metrics)
     values = {}
     data = SniperStatsDbObject(self.db['d%s' % prefix])
     num = data.read_int32()
@@ -48,12 +144,23 @@ class SniperStatsDb(sniper_stats.SniperStatsBase):
       items = {}
       while True:
         index = data.read_int32()
-        if index == -12345: break
+        if index == SNAPSHOT_END_MARKER: break
         value = data.read_uint64()
         items[index] = value
-      values[metricid] = items
+      if selected is None or metricid in selected:
+        values[metricid] = items
     return values
 
+  def read_snapshots(self, prefixes, metrics = None):
+    numpy = sniper_stats.numpy
+    if numpy is None:
+      return sniper_stats.SniperStatsBase.read_snapshots(self, prefixes, metrics = metrics)
+    rows = []
+    for idx, prefix in enumerate(prefixes):
+      metricids, indices, items = self.read_snapshot_arrays(prefix, metrics = metrics)
+      rows.append(numpy.column_stack((numpy.repeat(idx, len(items)), metricids, indices, items)))
+    return sniper_stats.build_snapshots(prefixes, self.names, numpy.concatenate(rows or [ numpy.zeros((0, 4), dtype = numpy.int64) ]), metrics = metrics)
+
 
 if __name__ == '__main__':
   stats = SniperStatsDb()
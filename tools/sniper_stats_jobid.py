@@ -22,5 +22,5 @@ class SniperStatsJobid(sniper_stats.SniperStatsBase):
   def get_markers(self):
     return self.ic.graphite_dbresults(self.jobid, 'get_markers')
 
-  def get_events(self):
-    return self.ic.graphite_dbresults(self.jobid, 'get_events')
+  def get_events(self, **kwds):
+    return sniper_stats.filter_events(self.ic.graphite_dbresults(self.jobid, 'get_events'), **kwds)
@@ -0,0 +1,145 @@
+import os, sniper_stats
+try:
+  import json
+except ImportError:
+  import localjson as json
+
+# Columnar cache of a sim.stats.sqlite3 database
+#   <filename>.npy holds all (prefixid, nameid, core, value) rows, sorted by prefix
+#   <filename>.npy.json holds the names and prefix tables, the row range of each prefix,
+#   and the mtime and size of the database the cache was built from, and of its write-ahead log
+#   (with stats/async_write, new snapshots go to <filename>-wal before they reach the database file itself)
+# Later loads memory-map the rows instead of iterating over SQL results
+
+CACHE_VERSION = 1
+
+def cache_filenames(filename):
+  return filename + '.npy', filename + '.npy.json'
+
+def source_fingerprint(filename):
+  st = os.stat(filename)
+  try:
+    wal = os.stat(filename + '-wal')
+    wal = { 'mtime': wal.st_mtime, 'size': wal.st_size }
+  except OSError:
+    wal = None
+  return { 'mtime': st.st_mtime, 'size': st.st_size, 'wal': wal }
+
+
+class SniperStatsNpy(sniper_stats.SniperStatsBase):
+  def __init__(self, stats, filename):
+    # stats is the SniperStatsSqlite object for filename, used to (re)build the cache and for non-snapshot data
+    self.stats = stats
+    self.filename = filename
+    self.names = stats.names
+    if not self.load_cache():
+      self.build_cache()
+
+  def load_cache(self):
+    numpy = sniper_stats.numpy
+    valuesfile, indexfile = cache_filenames(self.filename)
+    try:
+      index = json.load(open(indexfile))
+    except (IOError, ValueError):
+      return False
+    if index.get('version') != CACHE_VERSION or index.get('source') != source_fingerprint(self.filename):
+      return False
+    try:
+      self.rows = numpy.load(valuesfile, mmap_mode = 'r')
+    except (IOError, ValueError):
+      return False
+    # JSON gives us unicode strings, convert back to str to match the other backends
+    self.names = dict([ (int(nameid), (str(objectname), str(metricname))) for nameid, objectname, metricname in index['names'] ])
+    self.set_prefixes([ (str(prefixname), start, end) for prefixname, start, end in index['prefixes'] ])
+    return True
+
+  def build_cache(self):
+    numpy = sniper_stats.numpy
+    source = source_fingerprint(self.filename)
+    c = self.stats.db.cursor()
+    c.execute('select prefixid, prefixname from `prefixes` order by prefixid asc')
+    prefixes = c.fetchall()
+    c.execute('select prefixid, nameid, core, value from `values` order by prefixid asc')
+    rows = numpy.array(c.fetchall(), dtype = numpy.int64).reshape(-1, 4)
+    self.names = self.stats.read_metricnames()
+    # Row range [start, end) for each prefix
+    starts = numpy.searchsorted(rows[:,0], [ prefixid for prefixid, prefixname in prefixes ], side = 'left')
+    ends = numpy.searchsorted(rows[:,0], [ prefixid for prefixid, prefixname in prefixes ], side = 'right')
+    prefixes = [ (prefixname, int(start), int(end)) for (prefixid, prefixname), start, end in zip(prefixes, starts, ends) ]
+    self.rows = rows
+    self.set_prefixes(prefixes)
+    # Write to temporary files first so concurrent readers never see a partial cache
+    valuesfile, indexfile = cache_filenames(self.filename)
+    try:
+      numpy.save(open(valuesfile + '.tmp', 'wb'), rows)
+      json.dump({
+        'version': CACHE_VERSION,
+        'source': source,
+        'names': [ (nameid, objectname, metricname) for nameid, (objectname, metricname) in self.names.items() ],
+        'prefixes': prefixes,
+      }, open(indexfile + '.tmp', 'w'))
+      os.rename(valuesfile + '.tmp', valuesfile)
+      os.rename(indexfile + '.tmp', indexfile)
+    except (IOError, OSError):
+      # Results directory is not writable: keep using the in-memory copy
+      pass
+
+  def set_prefixes(self, prefixes):
+    self.prefixes = [ prefixname for prefixname, start, end in prefixes ]
+    # For duplicate prefix names, the first one wins (as with SniperStatsSqlite)
+    self.ranges = {}
+    for prefixname, start, end in prefixes:
+      self.ranges.setdefault(prefixname, (start, end))
+
+  def get_snapshots(self):
+    # The cache only holds the values table, time series snapshots are read from the database directly
+    return self.prefixes + [ prefix for prefix in self.stats.get_timeseries_snapshots() if prefix not in self.ranges ]
+
+  def read_metricnames(self):
+    return dict(self.names)
+
+  def get_rows(self, prefix, metrics = None):
+    numpy = sniper_stats.numpy
+    if prefix not in self.ranges:
+      raise ValueError('Invalid prefix %s' % prefix)
+    start, end = self.ranges[prefix]
+    rows = self.rows[start:end]
+    nameids = self.select_nameids(metrics)
+    if nameids is not None:
+      rows = rows[numpy.in1d(rows[:,1], sorted(nameids))]
+    return rows
+
+  def read_snapshot(self, prefix, metrics = None):
+    if prefix not in self.ranges:
+      return self.stats.read_snapshot(prefix, metrics = metrics)
+    values = {}
+    for prefixid, nameid, core, value in self.get_rows(prefix, metrics = metrics).tolist():
+      if nameid not in values: values[nameid] = {}
+      values[nameid][core] = value
+    return values
+
+  def read_snapshots(self, prefixes, metrics = None):
+    numpy = sniper_stats.numpy
+    if [ prefix for prefix in prefixes if prefix not in self.ranges ]:
+      return self.stats.read_snapshots(prefixes, metrics = metrics)
+    rows = []
+    for idx, prefix in enumerate(prefixes):
+      _rows = numpy.array(self.get_rows(prefix, metrics = metrics))
+      _rows[:,0] = idx
+      rows.append(_rows)
+    return sniper_stats.build_snapshots(prefixes, self.names, numpy.concatenate(rows or [ numpy.zeros((0, 4), dtype = numpy.int64) ]), metrics = metrics)
+
+  def get_timeseries_levels(self):
+    return self.stats.get_timeseries_levels()
+
+  def get_timeseries_times(self, level):
+    return self.stats.get_timeseries_times(level)
+
+  def get_topology(self):
+    return self.stats.get_topology()
+
+  def get_markers(self):
+    return self.stats.get_markers()
+
+  def get_events(self, **kwds):
+    return self.stats.get_events(**kwds)
@@ -1,18 +1,91 @@
-import collections, sqlite3, sniper_stats
+import collections, re, sqlite3, functools, contextlib, sniper_stats
+
+LIVE_TIMEOUT = 600 # Seconds to wait for the simulator to finish writing, when reading a database that is still being written to
+
+def consistent_read(method):
+  # With live = True, run all queries of one call inside a single read transaction so they see the same committed snapshots
+  #   (the simulator writes each snapshot in one transaction, but overwrites time series slots in place),
+  #   and pick up time series snapshots written since the last call
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwds):
+    with self.read_transaction():
+      return method(self, *args, **kwds)
+  return wrapper
 
 class SniperStatsSqlite(sniper_stats.SniperStatsBase):
-  def __init__(self, filename = 'sim.stats.sqlite3'):
-    self.db = sqlite3.connect(filename)
+  # live: the simulator may still be writing to the database (see tools/viz/viz.py --follow), which must then use WAL mode (stats/async_write)
+  def __init__(self, filename = 'sim.stats.sqlite3', live = False):
+    self.live = live
+    self.in_read = False
+    if live:
+      # Wait for the writer instead of failing with 'database is locked', and manage read transactions ourselves
+      self.db = sqlite3.connect(filename, timeout = LIVE_TIMEOUT, isolation_level = None)
+    else:
+      self.db = sqlite3.connect(filename)
     self.db.text_factory = str # Don't try to convert database contents to UTF-8
     self.names = self.read_metricnames()
+    self.timeseries = None
+    if live and self.db.execute('PRAGMA journal_mode').fetchone()[0].lower() != 'wal':
+      # Without a write-ahead log, the simulator can't commit while we hold a read transaction
+      raise RuntimeError('%s is not in WAL mode, reading it while the simulation runs would stall the simulator (run with -g --stats/async_write=true)' % filename)
+
+  @contextlib.contextmanager
+  def read_transaction(self):
+    # With live = True, all calls inside the with block share one read transaction (see consistent_read)
+    if not self.live or self.in_read:
+      yield
+      return
+    self.db.execute('BEGIN')
+    self.in_read = True
+    self.timeseries = None
+    try:
+      yield
+    finally:
+      self.in_read = False
+      self.db.execute('ROLLBACK')
 
+  @consistent_read
   def get_snapshots(self):
     snapshots = []
     c = self.db.cursor()
     c.execute('select prefixid, prefixname from `prefixes` order by prefixid asc')
     for prefixid, prefixname in c:
       snapshots.append(prefixname)
-    return snapshots
+    return snapshots + [ prefix for prefix in self.get_timeseries_snapshots() if prefix not in snapshots ]
+
+  def has_table(self, table):
+    c = self.db.cursor()
+    return bool(c.execute('SELECT name FROM sqlite_master WHERE type="table" AND name=?', (table,)).fetchall())
+
+  def get_timeseries(self):
+    # {time: (level, slot)} for all snapshots in the time series store, using the finest level that holds each time
+    if self.timeseries is None:
+      self.timeseries = {}
+      if self.has_table('timeseries'):
+        c = self.db.cursor()
+        for level, slot, time in c.execute('select level, slot, time from `timeseries` order by level desc'):
+          self.timeseries[time] = (level, slot)
+    return self.timeseries
+
+  def get_timeseries_snapshots(self):
+    # Time series snapshots are available as periodic-<time>, like the snapshots periodic-stats writes without levels
+    return [ 'periodic-%d' % time for time in sorted(self.get_timeseries().keys()) ]
+
+  def get_timeseries_slot(self, prefix):
+    match = re.match(r'periodic-([0-9]+)$', prefix)
+    return match and self.get_timeseries().get(long(match.group(1)))
+
+  @consistent_read
+  def get_timeseries_levels(self):
+    if not self.has_table('timeseries_levels'):
+      return []
+    c = self.db.cursor()
+    return c.execute('select level, interval, capacity from `timeseries_levels` order by level asc').fetchall()
+
+  @consistent_read
+  def get_timeseries_times(self, level):
+    c = self.db.cursor()
+    return [ time for (time,) in c.execute('select time from `timeseries` where level = ? order by time asc', (level,)) ]
 
   def read_metricnames(self):
     names = {}
@@ -22,17 +95,25 @@ class SniperStatsSqlite(sniper_stats.SniperStatsBase):
       names[nameid] = (objectname, metricname)
     return names
 
+  def get_namefilter(self, metrics):
+    # Patterns are resolved against the names table here, so sqlite only returns the rows we need
+    nameids = self.select_nameids(metrics)
+    if nameids is None:
+      return ''
+    elif nameids:
+      return ' and nameid in (%s)' % ','.join(map(str, sorted(nameids)))
+    else:
+      return ' and 0'
+
+  @consistent_read
   def read_snapshot(self, prefix, metrics = None):
     c = self.db.cursor()
-    c.execute('select prefixid from `prefixes` where prefixname = ?', (prefix,))
+    # For duplicate prefix names (e.g. roi-begin written more than once), the first one wins
+    c.execute('select prefixid from `prefixes` where prefixname = ? order by prefixid asc', (prefix,))
     prefixids = list(c)
     if prefixids:
       prefixid = prefixids[0][0]
-      if metrics:
-        nameids = [ str(nameid) for nameid, (objectname, metricname) in self.names.items() if '%s.%s' % (objectname, metricname) in metrics ]
-        namefilter = ' and nameid in (%s)' % ','.join(nameids)
-      else:
-        namefilter = ''
+      namefilter = self.get_namefilter(metrics)
       values = {}
       c = self.db.cursor()
       c.execute('select nameid, core, value from `values` where prefixid = ? %s' % namefilter, (prefixid,))
@@ -40,13 +121,57 @@ class SniperStatsSqlite(sniper_stats.SniperStatsBase):
         if nameid not in values: values[nameid] = {}
         values[nameid][core] = value
       return values
+    elif self.get_timeseries_slot(prefix):
+      level, slot = self.get_timeseries_slot(prefix)
+      values = {}
+      c = self.db.cursor()
+      c.execute('select nameid, core, value from `timeseries_values` where level = ? and slot = ? %s' % self.get_namefilter(metrics), (level, slot))
+      for nameid, core, value in c:
+        if nameid not in values: values[nameid] = {}
+        values[nameid][core] = value
+      return values
     else:
       raise ValueError('Invalid prefix %s' % prefix)
 
+  @consistent_read
+  def read_snapshots(self, prefixes, metrics = None):
+    c = self.db.cursor()
+    # For duplicate prefix names, the first one wins (as in read_snapshot)
+    prefixids = {}
+    c.execute('select prefixname, prefixid from `prefixes` order by prefixid asc')
+    for prefixname, prefixid in c:
+      prefixids.setdefault(prefixname, prefixid)
+    # Time series snapshots get keys beyond the highest prefixid
+    slots = {}
+    firstkey = max(prefixids.values() + [ 0 ]) + 1
+    for prefix in prefixes:
+      if prefix not in prefixids:
+        if not self.get_timeseries_slot(prefix):
+          raise ValueError('Invalid prefix %s' % prefix)
+        slots.setdefault(self.get_timeseries_slot(prefix), firstkey + len(slots))
+    # A prefix may be requested more than once, map each prefixid to all of its positions
+    positions = collections.defaultdict(list)
+    for idx, prefix in enumerate(prefixes):
+      if prefix in prefixids:
+        positions[prefixids[prefix]].append(idx)
+      else:
+        positions[slots[self.get_timeseries_slot(prefix)]].append(idx)
+    namefilter = self.get_namefilter(metrics)
+    rows = []
+    if len(slots) < len(positions):
+      c.execute('select prefixid, nameid, core, value from `values` where prefixid in (%s) %s order by prefixid' % (','.join([ str(prefixids[prefix]) for prefix in prefixes if prefix in prefixids ]), namefilter))
+      rows += c.fetchall()
+    for (level, slot), key in slots.items():
+      c.execute('select ?, nameid, core, value from `timeseries_values` where level = ? and slot = ? %s' % namefilter, (key, level, slot))
+      rows += c.fetchall()
+    return sniper_stats.build_snapshots(prefixes, self.names, rows, metrics = metrics, positions = positions)
+
+  @consistent_read
   def get_topology(self):
     c = self.db.cursor()
     return c.execute('SELECT componentname, coreid, masterid FROM topology').fetchall()
 
+  @consistent_read
   def get_markers(self):
     c = self.db.cursor()
     if c.execute('SELECT name FROM sqlite_master WHERE type="table" AND name="marker"').fetchall():
@@ -54,9 +179,22 @@ class SniperStatsSqlite(sniper_stats.SniperStatsBase):
     else:
       return [ (timestamp, core, thread, value0, value1, description) for event, timestamp, core, thread, value0, value1, description in self.get_events() if event == sniper_stats.EVENT_MARKER ]
 
-  def get_events(self):
+  @consistent_read
+  def get_events(self, time_begin = None, time_end = None, events = None, threads = None):
+    where = []
+    params = []
+    if time_begin is not None:
+      where.append('time >= ?')
+      params.append(time_begin)
+    if time_end is not None:
+      where.append('time < ?')
+      params.append(time_end)
+    if events is not None:
+      where.append('event IN (%s)' % ','.join([ '%d' % event for event in events ]))
+    if threads is not None:
+      where.append('thread IN (%s)' % ','.join([ '%d' % thread for thread in threads ]))
     c = self.db.cursor()
-    return c.execute('SELECT event, time, core, thread, value0, value1, description FROM event').fetchall()
+    return c.execute('SELECT event, time, core, thread, value0, value1, description FROM event %s ORDER BY time, rowid' % ('WHERE ' + ' AND '.join(where) if where else ''), params).fetchall()
 
 if __name__ == '__main__':
   stats = SniperStatsSqlite()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python2
+
+# Reader for the output of ipctrace.py, stattrace.py, lctrace.py and bbvtrace.py
+#   Binary traces (*.bin, *.bin.gz, *.bin.zst, see TraceWriter in scripts/sim/util.py) are memory-mapped when uncompressed,
+#   .bin.gz files are decompressed as a whole, text traces are parsed, all are returned as a (header, records) tuple where records is a numpy record array
+#   with fields 'time' (ns) and 'values' (one column per core, or cores x width for multi-valued traces such as raw BBVs)
+
+import sys, os, getopt, struct, zlib, StringIO
+try:
+  import json
+except ImportError:
+  import localjson as json
+try:
+  import numpy
+except ImportError:
+  numpy = None
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+TRACE_MAGIC = 'SNIPRTRC'
+TRACE_VERSION = 1
+GZIP_MAGIC = '\x1f\x8b'
+
+
+def get_dtype(header):
+  # Traces with more than one value per core (width) get a values field of cores x width
+  width = header.get('width', 1)
+  return numpy.dtype([ ('time', '<u8'), ('values', { 'float32': '<f4', 'uint64': '<u8' }[header['dtype']], (header['cores'], width) if width > 1 else (header['cores'],)) ])
+
+def read_header(fp):
+  # Returns (header, offset of the first row), or (None, 0) for text traces
+  if fp.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+    return None, 0
+  length, = struct.unpack('<I', fp.read(4))
+  header = json.loads(fp.read(length))
+  if header.get('version') != TRACE_VERSION:
+    raise ValueError('Unsupported trace version %s' % header.get('version'))
+  return header, len(TRACE_MAGIC) + 4 + length
+
+def gunzip(data):
+  # Unlike gzip.GzipFile, returns what can be decompressed from a truncated file (simulation did not finish)
+  return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+
+def read_rows(fp, dtype):
+  # Rows following the header, as in an uncompressed trace, ignoring a partially written last row
+  data = fp.read()
+  return numpy.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype = dtype)
+
+def read_blocks(fp, header, dtype):
+  if header['compression'] == 'zstd':
+    if not zstandard:
+      raise RuntimeError('Reading zstd-compressed traces requires the zstandard module')
+    decompress = zstandard.ZstdDecompressor().decompress
+  elif header['compression'] == 'zlib':
+    decompress = zlib.decompress
+  else:
+    raise ValueError('Unknown trace compression %s' % header['compression'])
+  blocks = []
+  while True:
+    data = fp.read(8)
+    if len(data) < 8:
+      break
+    nrows, size = struct.unpack('<II', data)
+    data = fp.read(size)
+    if len(data) < size:
+      # Truncated (simulation did not finish), drop the partial block
+      break
+    blocks.append(numpy.frombuffer(decompress(data), dtype = dtype))
+  return numpy.concatenate(blocks) if blocks else numpy.zeros(0, dtype = dtype)
+
+def read_text(filename):
+  # Text traces have no header, derive what we can from the data
+  times = []; values = []
+  for line in open(filename):
+    fields = line.split()
+    if fields and fields[0].startswith('['):
+      tag = fields.pop(0)[1:-1]
+    else:
+      tag = None
+    if fields:
+      times.append(long(fields[0]))
+      values.append(map(float, fields[1:]))
+  cores = len(values[0]) if values else 0
+  header = { 'version': TRACE_VERSION, 'metric': None, 'tag': tag if times else None, 'cores': cores,
+             'interval': long(times[1] - times[0]) * 1000000 if len(times) > 1 else None, 'dtype': 'float32', 'compression': None }
+  records = numpy.zeros(len(times), dtype = get_dtype(header))
+  records['time'] = times
+  if cores:
+    records['values'] = values
+  return header, records
+
+def read_trace(filename):
+  if numpy is None:
+    raise RuntimeError('Reading traces requires numpy')
+  fp = open(filename, 'rb')
+  compressed = fp.read(2) == GZIP_MAGIC
+  fp.seek(0)
+  if compressed:
+    fp = StringIO.StringIO(gunzip(fp.read()))
+  header, offset = read_header(fp)
+  if header is None:
+    return read_text(filename)
+  dtype = get_dtype(header)
+  if compressed:
+    return header, read_rows(fp, dtype)
+  elif header['compression'] == 'none':
+    # Ignore a partially written last row
+    nrows = (os.path.getsize(filename) - offset) / dtype.itemsize
+    if nrows == 0:
+      return header, numpy.zeros(0, dtype = dtype)
+    return header, numpy.memmap(filename, dtype = dtype, mode = 'r', offset = offset, shape = (nrows,))
+  else:
+    return header, read_blocks(fp, header, dtype)
+
+
+if __name__ == '__main__':
+  def usage():
+    print 'Usage:', sys.argv[0], '[-h (help)] [-t|--text (write out in text format)] [--header (print header only)] <tracefile>'
+
+  do_text = False
+  do_header = False
+
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "ht", [ 'text', 'header' ])
+  except getopt.GetoptError, e:
+    print e
+    usage()
+    sys.exit(-1)
+  for o, a in opts:
+    if o == '-h':
+      usage()
+      sys.exit()
+    if o in ('-t', '--text'):
+      do_text = True
+    if o == '--header':
+      do_header = True
+
+  if len(args) != 1:
+    usage()
+    sys.exit(-1)
+
+  header, records = read_trace(args[0])
+  if do_text:
+    format = '%d' if header['dtype'] == 'uint64' else '%.3f'
+    for time, values in zip(records['time'], records['values'].reshape(len(records), -1)):
+      print '%u' % time + ''.join([ ' ' + format % value for value in values ])
+  else:
+    for key in sorted(header.keys()):
+      print '%-12s %s' % (key + ':', header[key])
+    if not do_header:
+      print '%-12s %d' % ('records:', len(records))
+      if len(records):
+        print '%-12s %u - %u ns' % ('time:', records['time'][0], records['time'][-1])
+        print '%-12s %s' % ('mean:', ' '.join([ '%.3f' % value for value in records['values'].mean(axis = 0).flatten() ]))
@@ -78,17 +78,19 @@ def format_diff(d):
 
 def print_diff(parmsort = None, restype = 'results', resultdirs = [], partial = None, print_alldiffs = True, print_average = False, average_nz = True):
 
-  jobs = []
   stats = {}
   maxkeylen = -1
   resultstoprint = []
   max_cores = 0
   keys = []
 
-  for resultdir in resultdirs:
-    res = sniper_lib.get_results(resultsdir = resultdir, partial = partial)
+  for resultdir, res, error in sniper_lib.get_results_many(resultdirs, partial = partial):
+    if error:
+      print >> sys.stderr, 'Cannot read results from %s: %s' % (resultdir, error)
+      sys.exit(1)
     stats[resultdir] = res[restype]
-    jobs.append(resultdir)
+  # Keep the order in which results were specified, not the one in which they completed
+  jobs = list(resultdirs)
 
   # Find all key names and maximum lenghts
   def key_map((k, v)):
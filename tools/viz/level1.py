@@ -18,9 +18,13 @@ def format_number(n, suffixes = ' kMBT', decimals = '321', separator = ''):
   else:
     return ('%%.%df%%s' % int(decimals[0])) % (n, suffix)
 
-def createJSONData(resultsdir, outputdir, verbose = False):
+# partial: snapshots to use instead of roi-begin/roi-end, for a simulation that is still running (viz.py --follow)
+def createJSONData(resultsdir, outputdir, verbose = False, partial = None, stats = None):
   try:
-    res = sniper_lib.get_results(resultsdir = resultsdir)
+    if stats:
+      res = sniper_lib.get_results(stats = stats, partial = partial)
+    else:
+      res = sniper_lib.get_results(resultsdir = resultsdir, partial = partial)
   except:
     return
 
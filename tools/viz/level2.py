@@ -1,7 +1,7 @@
 #!/usr/bin/env python2
 # coding: utf-8
 
-import os, sys, getopt, re, math, subprocess
+import os, sys, getopt, re, math, subprocess, tempfile, shutil
 HOME = os.path.abspath(os.path.dirname(__file__))
 sys.path.extend( [os.path.abspath(os.path.join(HOME, '..'))] )
 import sniper_lib, sniper_config, sniper_stats, cpistack, cpistack_items, mcpat, json
@@ -86,35 +86,62 @@ def initialize():
   for component in listofmcpatcomponents:
     mcpatcomponents[component] = [[0 for x in xrange(4)] for x in xrange(num_intervals)]
 
+  #restore the intervals processed by an earlier call (viz.py --incremental)
+  first = state.get('num_intervals', 0)
+  for components, name, width in ((cpicomponents, 'cpicomponents', 3), (simplifiedcpicomponents, 'simplifiedcpicomponents', 3), (mcpatcomponents, 'mcpatcomponents', 4)):
+    for component, rows in state.get(name, {}).items():
+      components[component] = resume(rows, first, num_intervals, lambda: [0 for x in xrange(width)])
+  ipcvalues[0]["data"] = resume(state.get('ipc', []), first, num_intervals, lambda: 0)
+  instructioncountlist.extend(state.get('instructioncountlist', [])[:first])
+  instructioncountsumlist.extend(state.get('instructioncountsumlist', [])[:first])
+  usedsimplifiedcpicomponents.extend(state.get('usedsimplifiedcpicomponents', []))
+  usedmcpatcomponents.extend(state.get('usedmcpatcomponents', []))
+
+
+#the first done rows of rows (kept in the state from an earlier call), followed by zero() up to a total of n rows
+def resume(rows, done, n, zero):
+  rows = list(rows[:done])
+  return rows + [zero() for x in xrange(n - len(rows))]
+
 
 #collect CPI stack data with fixed instruction counts
 def collectCPIStackDataFIC(verbose=False, requested_cores_list = []):
   totalinstructioncount = 0
-  groupedintervals = groupIntervalsOnInstructionCount(getTotalInstructionCount()/num_intervals, verbose)
+  fic = state.setdefault('fic', {})
+  if 'fixedinstructioncount' not in fic:
+    if incremental:
+      # The run may not have ended yet, and keeping the instruction count fixed allows appending new intervals later on
+      fic['fixedinstructioncount'] = getTotalInstructionCount(("periodic-"+str(start), "periodic-"+str(start+num_intervals*interval)))/num_intervals
+    else:
+      fic['fixedinstructioncount'] = getTotalInstructionCount()/num_intervals
+  groupedintervals = groupIntervalsOnInstructionCount(fic['fixedinstructioncount'], verbose)
+  #intervals up to done were already processed by an earlier call
+  done = fic.get('num_groups', 1)
   usedcomponents = dict.fromkeys(cpiitems.names,0)
-  usedsimplecomponents = []
-  ipcvaluesfic[0]["data"]=[dict(x=0,y=0) for x in xrange(len(groupedintervals))]
+  for component in fic.get('usedcomponents', []):
+    usedcomponents[component]=1
+  usedsimplecomponents = list(fic.get('usedsimplecomponents', []))
+  ipcvaluesfic[0]["data"]=resume(fic.get('ipc', []), done, len(groupedintervals), lambda: dict(x=0,y=0))
   for key in cpificcomponents.keys():
-    cpificcomponents[key] = [[0 for x in xrange(2)] for x in xrange(len(groupedintervals))]
+    cpificcomponents[key] = resume(fic.get('cpificcomponents', {}).get(key, []), done, len(groupedintervals), lambda: [0 for x in xrange(2)])
   for key in simplifiedcpificcomponents.keys():
-    simplifiedcpificcomponents[key] = [[0 for x in xrange(2)] for x in xrange(len(groupedintervals))]
-  for i in range (1, len(groupedintervals)):
+    simplifiedcpificcomponents[key] = resume(fic.get('simplifiedcpificcomponents', {}).get(key, []), done, len(groupedintervals), lambda: [0 for x in xrange(2)])
+  # Read each snapshot only once, intervals with a missing snapshot are None
+  series = sniper_lib.get_interval_series(config = config, stats = stats, prefixes = [ group["intervalname"] for group in groupedintervals[done-1:] ], skip_missing = True)
+  for i, intervaldata in enumerate(series, done):
     if verbose:
       print 'Collect CPI stack info for intervals with a fixed instruction count (interval '+str(i+1)+' / '+str(len(groupedintervals))+')'+"\r",
     cyclecountstart = groupedintervals[i-1]["cyclecount"]
     instructioncount = groupedintervals[i]["instructioncount"]
-    nameintervalstart = groupedintervals[i-1]["intervalname"]
-    nameintervalstop = groupedintervals[i]["intervalname"]
-    currentinterval = (nameintervalstart, nameintervalstop)
 
     num_exceptions = 0
     simple=False
 
     try:
+      if intervaldata is None:
+        raise ValueError('Missing snapshot')
       results = cpistack.cpistack_compute(
-        config = config,
-        stats = stats,
-        partial = currentinterval,
+        data = intervaldata,
         use_simple = simple,
         use_simple_mem = True,
         no_collapse = True,
@@ -155,6 +182,11 @@ def collectCPIStackDataFIC(verbose=False, requested_cores_list = []):
     if usedcomponents[component]==1:
       usedcpificcomponents.append(component)
 
+  fic.update(num_groups = len(groupedintervals), usedcomponents = usedcpificcomponents, usedsimplecomponents = usedsimplecomponents,
+             ipc = ipcvaluesfic[0]["data"], cpificcomponents = cpificcomponents, simplifiedcpificcomponents = simplifiedcpificcomponents)
+  # The next call continues from the last group boundary, which can be before the last interval (see viz.py can_resume)
+  state['first_snapshot'] = groupedintervals[-1]["intervalname"]
+
 
   def writeJSON(components, usedcomponents, name):
     jsonoutput = [0 for x in xrange(len(usedcomponents))]
@@ -184,25 +216,29 @@ def collectCPIStackDataFIC(verbose=False, requested_cores_list = []):
 #Collect data with fixed cycle counts for the intervals
 def collectCPIStackDataFCC(verbose = False, requested_cores_list = []):
   from StringIO import StringIO
-  instructioncount=0
+  #intervals up to first were already processed by an earlier call
+  first = state.get('num_intervals', 0)
+  instructioncount=instructioncountsumlist[-1] if instructioncountsumlist else 0
   num_exceptions=0
   usedcomponents = dict.fromkeys(cpiitems.names,0)
+  for component in state.get('usedcpicomponents', []):
+    usedcomponents[component]=1
 
-  for i in range(0,num_intervals):
+  series = sniper_lib.get_interval_series(config = config, stats = stats, interval = interval, start = start+first*interval, num_intervals = num_intervals-first, skip_missing = True)
+  for i, intervaldata in enumerate(series, first):
     if verbose:
       print 'Collect CPI stack info for intervals with a fixed time span (interval '+str(i+1)+' / '+str(num_intervals)+')'+"\r",
-    currentinterval = ("periodic-"+str(i*interval)+":periodic-"+str((i+1)*interval)).split(":")
 
-    newinstructioncount=getInstructionCount(currentinterval)
+    newinstructioncount=sum(intervaldata["results"]["performance_model.instruction_count"]) if intervaldata else 0
     instructioncountlist.append(newinstructioncount)
     instructioncount+=newinstructioncount
     instructioncountsumlist.append(instructioncount)
 
     try:
+      if intervaldata is None:
+        raise ValueError('Missing snapshot')
       results = cpistack.cpistack_compute(
-        config = config,
-        stats = stats,
-        partial = currentinterval,
+        data = intervaldata,
         use_simple = False,
         use_simple_mem = True,
         no_collapse = True,
@@ -254,25 +290,32 @@ def collectCPIStackDataFCC(verbose = False, requested_cores_list = []):
       print "You might want to increase the interval size."
 
 
-def collectMcPATData(verbose = False):
+def collectMcPATData(verbose = False, jobs = None):
   #Collecting data for McPat Visualization
   #print('Collecting data for mcpat visualization')
-  from StringIO import StringIO
-  for i in range(0,num_intervals):
-    if verbose:
-      print 'Collect McPAT info (interval '+str(i+1)+' / '+str(num_intervals)+')'
-
-    data_to_return = mcpat.main(
+  power_model = os.path.join(resultsdir, mcpat.SURROGATE_FILENAME)
+  if not os.path.exists(power_model):
+    power_model = None
+  # Generate the McPAT inputs for all intervals, then run McPAT on them in parallel
+  first = state.get('num_intervals', 0)
+  tempdir = tempfile.mkdtemp()
+  try:
+    all_data = mcpat.main_many(
       jobid = 0,
       resultsdir = resultsdir,
-      partial = ["periodic-"+str(i*interval),"periodic-"+str((i+1)*interval)],
+      partials = [ ["periodic-"+str(start+i*interval),"periodic-"+str(start+(i+1)*interval)] for i in range(first,num_intervals) ],
       powertype = 'dynamic',
-      outputfile = 'power',
-      no_graph = True,
-      print_stack = False,
-      return_data = True
+      outputfile = os.path.join(tempdir, 'power'),
+      # Use the surrogate power model when mcpat.py --calibrate was run on these results
+      power_model = power_model,
+      workers = jobs,
+      verbose = verbose,
+      stats = stats
     )
+  finally:
+    shutil.rmtree(tempdir, ignore_errors = True)
 
+  for i, data_to_return in enumerate(all_data, first):
     components = data_to_return["labels"]
     powerdata = data_to_return["power_data"][0]
     time_s = data_to_return["time_s"]
@@ -428,22 +471,18 @@ def writeIPCvaluestoJSON(outputdir, verbose = False):
   ipcjsonfile.close()
 
 
-#return the total number of instructions processed in an interval
-def getInstructionCount(intervalstr):
-  results = sniper_lib.get_results(config = config, stats = stats, partial = intervalstr, metrics = ("performance_model.instruction_count",))
-  instructioncount = sum(results["results"]["performance_model.instruction_count"])
-  return instructioncount
-
-def getTotalInstructionCount():
-  results = sniper_lib.get_results(config = config, stats = stats, metrics = ("performance_model.instruction_count",))
+def getTotalInstructionCount(partial = None):
+  results = sniper_lib.get_results(config = config, stats = stats, partial = partial, metrics = ("performance_model.instruction_count",))
   instructioncount = sum(results["results"]["performance_model.instruction_count"])
   return instructioncount
 
 
 #groups intervals on a fixed instructioncount
+#the grouping so far is kept in the state, so later calls only look at new intervals
 def groupIntervalsOnInstructionCount(fixedinstructioncount, verbose=False):
-  instructioncount = 0
-  currentintervalnr=0
+  fic = state.setdefault('fic', {})
+  instructioncount = fic.get('instructioncount', 0)
+  currentintervalnr = fic.get('currentintervalnr', 0)
   if interval > 10 * native_interval:
     # When there are way more intervals than we'll use, don't look at all of them
     ratio = max(1, interval / native_interval / 10)
@@ -452,14 +491,18 @@ def groupIntervalsOnInstructionCount(fixedinstructioncount, verbose=False):
   else:
     interval_to_use = native_interval
     num_intervals_to_use = nativenum_intervals
-  currentintervalstr = ("periodic-"+str(currentintervalnr*interval_to_use), "periodic-"+str((currentintervalnr+1)*interval_to_use))
-  intervalsequences = []
-  intervalsequences.append(dict(cyclecount=0, instructioncount=0, intervalname=currentintervalstr[0]))
+  currentintervalstr = ("periodic-"+str(start+currentintervalnr*interval_to_use), "periodic-"+str(start+(currentintervalnr+1)*interval_to_use))
+  intervalsequences = list(fic.get('groups', []))
+  if not intervalsequences:
+    intervalsequences.append(dict(cyclecount=0, instructioncount=0, intervalname=currentintervalstr[0]))
   nrofintervals = 0
-  while currentintervalnr < num_intervals_to_use:
+  series = sniper_lib.get_interval_series(config = config, stats = stats, interval = interval_to_use, start = start+currentintervalnr*interval_to_use, num_intervals = num_intervals_to_use-currentintervalnr,
+                                          metrics = ("performance_model.instruction_count",), skip_missing = True)
+  for intervaldata in series:
     if verbose:
       print "Put fixed time interval", currentintervalnr+1, "/", num_intervals_to_use, "in a fixed instruction count interval\r",
-    instructioncount+=getInstructionCount(currentintervalstr)
+    if intervaldata:
+      instructioncount+=sum(intervaldata["results"]["performance_model.instruction_count"])
     nrofintervals+=1
     if instructioncount > fixedinstructioncount:
       intervalsequences.append(dict(cyclecount=currentintervalnr*interval_to_use, instructioncount=instructioncount, intervalname=currentintervalstr[1]))
@@ -468,29 +511,36 @@ def groupIntervalsOnInstructionCount(fixedinstructioncount, verbose=False):
       instructioncount=0
       nrofintervals=0
     currentintervalnr+=1
-    currentintervalstr = ("periodic-"+str(currentintervalnr*interval_to_use), "periodic-"+str((currentintervalnr+1)*interval_to_use))
+    currentintervalstr = ("periodic-"+str(start+currentintervalnr*interval_to_use), "periodic-"+str(start+(currentintervalnr+1)*interval_to_use))
+
+  fic.update(groups = intervalsequences, instructioncount = instructioncount, currentintervalnr = currentintervalnr)
 
   if verbose:
     print
   return intervalsequences
 
 
-def createJSONData(native_interval_, nativenum_intervals_, interval_, num_intervals_, resultsdir_, outputdir_, title_, mcpat, verbose = False, requested_cores_list = []):
+# state_: dictionary kept between calls by viz.py --incremental, only intervals not yet in it are read
+def createJSONData(native_interval_, nativenum_intervals_, interval_, num_intervals_, resultsdir_, outputdir_, title_, mcpat, verbose = False, requested_cores_list = [], start_ = 0, jobs = None, stats_ = None, state_ = None):
 
   if verbose:
     print 'Generate JSON data for Level 2'
 
-  global native_interval, nativenum_intervals, interval, num_intervals, resultsdir, outputdir, title, use_mcpat, stats, config
+  global native_interval, nativenum_intervals, interval, num_intervals, resultsdir, outputdir, title, use_mcpat, stats, config, start, state, incremental
   native_interval = native_interval_
   nativenum_intervals = nativenum_intervals_
   interval = interval_
   num_intervals = num_intervals_
+  # Time of the first snapshot, intervals are relative to it
+  start = start_
   resultsdir = resultsdir_
   outputdir = outputdir_
   title = title_
   use_mcpat = mcpat
-  stats = sniper_stats.SniperStats(resultsdir_)
+  stats = stats_ or sniper_stats.SniperStats(resultsdir_)
   config = sniper_lib.get_config(resultsdir = resultsdir_)
+  incremental = state_ is not None
+  state = state_ if incremental else {}
 
   initialize()
 
@@ -511,7 +561,7 @@ def createJSONData(native_interval_, nativenum_intervals_, interval_, num_interv
   writeIPCvaluestoJSON(outputdir)
 
   if(use_mcpat):
-    collectMcPATData(verbose)
+    collectMcPATData(verbose, jobs = jobs)
     writetojson(outputdir,"power","mcpat",1,verbose)
     writetojson(outputdir,"energy","mcpat",2,verbose)
     writetojson(outputdir,"energypercentage","mcpat",3,verbose)
@@ -519,9 +569,15 @@ def createJSONData(native_interval_, nativenum_intervals_, interval_, num_interv
     writelabels(outputdir,"energy","mcpat")
     writelabels(outputdir,"energypercentage","mcpat")
 
+  state.update(num_intervals = num_intervals, cpicomponents = cpicomponents, simplifiedcpicomponents = simplifiedcpicomponents,
+               ipc = ipcvalues[0]["data"], instructioncountlist = instructioncountlist, instructioncountsumlist = instructioncountsumlist,
+               usedcpicomponents = usedcpicomponents, usedsimplifiedcpicomponents = usedsimplifiedcpicomponents)
+  if(use_mcpat):
+    state.update(mcpatcomponents = mcpatcomponents, usedmcpatcomponents = usedmcpatcomponents)
+
 if __name__ == '__main__':
   def usage():
-    print('Usage: '+sys.argv[0]+' [-h|--help (help)] [-d <resultsdir (default: .)>] [-o <outputdir (default: .)>] [-t <title>] [-n <num-intervals (default: 1000, all: 0)] [-i <interval (default: smallest_interval)> ] [--mcpat] [-v|--verbose] [-N <colon-separated-core-list>]')
+    print('Usage: '+sys.argv[0]+' [-h|--help (help)] [-d <resultsdir (default: .)>] [-o <outputdir (default: .)>] [-t <title>] [-n <num-intervals (default: 1000, all: 0)] [-i <interval (default: smallest_interval)> ] [--mcpat] [--jobs=<num> (McPAT processes, default: one per CPU)] [-v|--verbose] [-N <colon-separated-core-list>]')
     sys.exit()
 
   resultsdir = '.'
@@ -532,10 +588,11 @@ if __name__ == '__main__':
   interval = 0
   verbose = False
   requested_cores_list = []
+  jobs = None
 
 
   try:
-    opts, args = getopt.getopt(sys.argv[1:], "hd:o:t:n:i:vN:", [ "help", "mcpat", "verbose" ])
+    opts, args = getopt.getopt(sys.argv[1:], "hd:o:t:n:i:vN:", [ "help", "mcpat", "jobs=", "verbose" ])
   except getopt.GetoptError, e:
     print(e)
     usage()
@@ -551,6 +608,8 @@ if __name__ == '__main__':
       title = a
     if o == '--mcpat':
       use_mcpat = True
+    if o == '--jobs':
+      jobs = int(a)
     if o == '-n':
       num_intervals = long(a)
     if o == '-i':
@@ -599,7 +658,7 @@ if __name__ == '__main__':
     num_intervals = defaultnum_intervals
 
 
-  createJSONData(defaultinterval, defaultnum_intervals, interval, num_intervals, resultsdir, outputdir, title, use_mcpat, verbose = verbose, requested_cores_list = requested_cores_list)
+  createJSONData(defaultinterval, defaultnum_intervals, interval, num_intervals, resultsdir, outputdir, title, use_mcpat, verbose = verbose, requested_cores_list = requested_cores_list, jobs = jobs)
 
   # Now copy all static files as well
   if outputdir != HOME:
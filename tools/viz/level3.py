@@ -15,28 +15,34 @@ def mkdir_p(path):
       pass
     else: raise
 
-def createJSONData(interval, num_intervals, resultsdir, outputdir, title, verbose = False):
+# state: dictionary kept between calls by viz.py --incremental, only intervals not yet in it are read
+def createJSONData(interval, num_intervals, resultsdir, outputdir, title, verbose = False, start = 0, stats = None, state = None):
   if verbose:
     print 'Generate JSON data for Level 3'
 
-  stats = sniper_stats.SniperStats(resultsdir)
+  stats = stats or sniper_stats.SniperStats(resultsdir)
   config = sniper_config.parse_config(file(os.path.join(resultsdir, 'sim.cfg')).read())
 
   ncores = int(config['general/total_cores'])
   if verbose:
     print ncores, "cores detected"
 
-  intervaldata = [0 for x in xrange(num_intervals)]
+  if state is None:
+    state = {}
+  first = state.get('num_intervals', 0)
+  intervaldata = state.get('intervaldata', [])[:first] + [0 for x in xrange(num_intervals - first)]
   num_exceptions=0
-  for i in range(0,num_intervals):
+  # Read each snapshot only once, intervals with a missing snapshot are None
+  series = sniper_lib.get_interval_series(config = config, stats = stats, interval = interval, start = start + first*interval, num_intervals = num_intervals - first, skip_missing = True)
+  for i, results in enumerate(series, first):
     if verbose:
       print "Parsing interval "+str(i+1)+"/"+str(num_intervals)+"\r",
 
     try:
+      if results is None:
+        raise ValueError('Missing snapshot')
       results = cpistack.cpistack_compute(
-        config = config,
-        stats = stats,
-        partial = ["periodic-"+str(i*interval),"periodic-"+str((i+1)*interval)],
+        data = results,
         use_simple = False,
         use_simple_mem = True,
         no_collapse = False,
@@ -59,6 +65,8 @@ def createJSONData(interval, num_intervals, resultsdir, outputdir, title, verbos
       num_exceptions += 1
       continue
 
+  state.update(num_intervals = num_intervals, intervaldata = intervaldata)
+
   # Write JSON to file
   mkdir_p(os.path.join(outputdir,'levels','level3','data'))
   f = open(os.path.join(outputdir,'levels','level3','data','ipcvalues.txt'), "w")
@@ -15,7 +15,8 @@ def mkdir_p(path):
     else: raise
 
 
-def createJSONData(interval, num_intervals, resultsdir, outputdir, verbose = False):
+# state: dictionary kept between calls by viz.py --incremental, only intervals not yet in it are read
+def createJSONData(interval, num_intervals, resultsdir, outputdir, verbose = False, start = 0, stats = None, state = None):
   topodir = os.path.join(outputdir,'levels','topology')
   mkdir_p(topodir)
 
@@ -23,7 +24,7 @@ def createJSONData(interval, num_intervals, resultsdir, outputdir, verbose = Fal
 
   config = sniper_config.parse_config(file(os.path.join(resultsdir, 'sim.cfg')).read())
   ncores = int(config['general/total_cores'])
-  stats = sniper_stats.SniperStats(resultsdir)
+  stats = stats or sniper_stats.SniperStats(resultsdir)
 
   ids = collections.defaultdict(lambda: {})
   for name, lid, mid in stats.get_topology():
@@ -31,12 +32,22 @@ def createJSONData(interval, num_intervals, resultsdir, outputdir, verbose = Fal
 
   caches = [ 'L1-I', 'L1-D', 'L2', 'L3', 'L4', 'dram-cache' ]
   items = sum([ [ '%s-%d' % (name, core) for name in ['core','dram-cntlr']+caches ] for core in range(ncores) ], [])
-  data = dict([ (item, {'info':'', 'sparkdata':[]}) for item in items ])
+  if state is None:
+    state = {}
+  first = state.get('num_intervals', 0)
+  data = state.get('data') or dict([ (item, {'info':'', 'sparkdata':[]}) for item in items ])
   dramcntlrs = [ lid for (name, lid, mid) in stats.get_topology() if name == 'dram-cntlr' ]
 
 
-  for i in range(num_intervals):
-    results = sniper_lib.get_results(config = config, stats = stats, partial = ('periodic-'+str(i*interval), 'periodic-'+str((i+1)*interval)))['results']
+  # Read each snapshot only once
+  for results in sniper_lib.get_interval_series(config = config, stats = stats, interval = interval, start = start + first*interval, num_intervals = num_intervals - first, skip_missing = True):
+    if results is None:
+      # Missing snapshot: no data for this interval
+      for item in data.values():
+        if item['info']:
+          item['sparkdata'].append(0.)
+      continue
+    results = results['results']
     if 'barrier.global_time_begin' in results:
       # Most accurate: ask the barrier
       results['time_begin'] = results['barrier.global_time_begin'][0]
@@ -82,6 +93,8 @@ def createJSONData(interval, num_intervals, resultsdir, outputdir, verbose = Fal
         data['dram-cntlr-%d' % dramcntlr]['sparkdata'].append('%.3f' % (1000. * (results['dram.reads'][dramcntlr] + results['dram.writes'][dramcntlr]) / (ninstrs or 1.)))
       data['dram-cntlr-%d' % dramcntlr]['info'] = 'APKI (dram-cntlr-%d)' % dramcntlr
 
+  state.update(num_intervals = num_intervals, data = data)
+
   jsonfile = open(os.path.join(topodir, 'topology.txt'), "w")
   jsonfile.write('topology = %s' % json.dumps(data))
   jsonfile.close()
@@ -1,5 +1,5 @@
 #!/usr/bin/env python2
-import os, sys, getopt, re, math, subprocess, json, shutil
+import os, sys, getopt, re, math, subprocess, json, shutil, time
 HOME = os.path.abspath(os.path.dirname(__file__))
 sys.path.extend([ os.path.abspath(os.path.join(HOME, '..')) ])
 import sniper_lib, sniper_stats, cpistack, level1, level2, level3, topology, profile, functionbased
@@ -18,11 +18,149 @@ def mkdir_p(path):
 
 levels_all = [ '1', '2', '3', 'topo', 'profile', 'aso' ]
 levels_default = [ '1', '2', '3', 'topo' ]
+# Levels that are built per interval, and can be updated incrementally
+levels_intervals = [ '2', '3', 'topo' ]
+
+# Incremental mode: which intervals were processed already, and their per-level data
+STATE_FILENAME = 'viz-state.json'
+STATE_VERSION = 2
+
+
+# level: time series level to use, by default the finest level that still covers the requested range
+def get_snapshot_times(stats, resolution = None, time_begin = None, time_end = None, level = None):
+  if stats.get_timeseries_levels():
+    # Multi-resolution time series store written by periodic-stats
+    if level is None:
+      level = stats.select_timeseries_level(resolution, time_begin)
+    snapshots = stats.get_timeseries_times(level)
+  else:
+    snapshots = sorted([ long(name.split('-')[1]) for name in stats.get_snapshots() if re.match(r'periodic-[0-9]+', name) ])
+  return [ t for t in snapshots if (time_begin is None or t >= time_begin) and (time_end is None or t <= time_end) ]
+
+
+def load_state(outputdir):
+  try:
+    state = json.load(open(os.path.join(outputdir, STATE_FILENAME)))
+  except (IOError, ValueError):
+    return None
+  if state.get('version') != STATE_VERSION:
+    return None
+  return state
+
+def can_resume(state, params, snapshots):
+  # The state must have been made with the same parameters, and the snapshots the next intervals start from must still exist
+  # (time series levels are ring buffers that drop their oldest snapshots)
+  if state is None or state['params'] != params:
+    return False
+  needed = [ state['start'] + state['num_intervals'] * params['interval'] ]
+  needed += [ long(levelstate['first_snapshot'].split('-')[1]) for levelstate in state['levels'].values() if 'first_snapshot' in levelstate ]
+  return set(needed) <= set(snapshots)
+
+def save_state(outputdir, state):
+  # Write to a temporary file first, so an interrupted update leaves the previous state intact
+  filename = os.path.join(outputdir, STATE_FILENAME)
+  json.dump(state, open(filename + '.tmp', 'w'))
+  os.rename(filename + '.tmp', filename)
+
+
+def write_info(outputdir, title, num_intervals, interval, levels, use_mcpat):
+  info = open(os.path.join(outputdir,'info.txt'), "w")
+  info.write("title = '"+title+"';\n")
+  info.write("num_intervals = '"+str(num_intervals)+"';\n")
+  info.write("interval = '"+str(interval)+"';\n")
+  info.write("use_level2 = "+str(1 if '2' in levels else 0)+";\n")
+  info.write("use_mcpat = "+str(1 if use_mcpat else 0)+";\n")
+  info.write("use_level3 = "+str(1 if '3' in levels else 0)+";\n")
+  info.write("use_topo = "+str(1 if 'topo' in levels else 0)+";\n")
+  info.write("use_profile = "+str(1 if 'profile' in levels else 0)+";\n")
+  info.write("use_aso = "+str(1 if 'aso' in levels else 0)+";\n")
+  info.close()
+
+  asoinfo = open(os.path.join(outputdir,'asoinfo.txt'), "w")
+  asoinfo.write("asoinfo = '"+json.dumps(dict(use_aso=('aso' in levels)))+"';\n")
+  asoinfo.close()
+
+
+def copy_static_files(outputdir, levels, verbose = False):
+  if outputdir != HOME:
+    if verbose:
+      print "Copy files to output directory "+outputdir
+    os.system('cd "%s"; tar c index.html rickshaw/ levels/level2/*html levels/level3/*html levels/topology/*html levels/profile/*html css/ images/ scripts/ levels/level2/css levels/level2/javascript/ levels/level3/javascript | tar x -C %s' % (HOME, outputdir))
+    if 'aso' in levels:
+      os.system('cd "%s"; tar c flot/ levels/functionbased/functionbased.html levels/functionbased/*js css/ levels/functionbased/doxygen | tar x -C %s' % (HOME, outputdir))
+
+
+# One pass of incremental mode: append the intervals that were written to the statistics database since the last call
+#   The interval size is kept fixed (-i, or the interval between periodic snapshots) so earlier data remains valid,
+#   as is the time series level, whose oldest snapshots may already be gone by the next call
+#   Returns True once the simulation has completed
+def update(resultsdir, outputdir, title, levels, use_mcpat, interval = None, resolution = None, time_begin = None, time_end = None, jobs = None, verbose = False):
+  # sim.info is written by run-sniper when the simulation is done
+  finished = os.path.exists(os.path.join(resultsdir, 'sim.info'))
+  stats = sniper_stats.SniperStats(resultsdir, live = not finished)
+  # The simulator may keep writing while we read (this needs stats/async_write), make all reads of this update see the same snapshots
+  with stats.read_transaction():
+    names = stats.get_snapshots()
+    state = load_state(outputdir)
+    # Continue on the time series level of the previous call, or choose one when starting from scratch
+    candidates = [ None ]
+    if stats.get_timeseries_levels():
+      candidates = [ stats.select_timeseries_level(resolution, time_begin) ]
+      if state and state['params'].get('level') in [ level for level, _interval, capacity in stats.get_timeseries_levels() ]:
+        candidates.insert(0, state['params']['level'])
+    for level in candidates:
+      snapshots = get_snapshot_times(stats, resolution, time_begin, time_end, level)
+      if len(snapshots) < 2:
+        continue
+      native_interval = snapshots[1] - snapshots[0]
+      interval_ = max(interval or native_interval, native_interval)
+      params = dict(resultsdir = resultsdir, title = title, levels = sorted(set(levels) & set(levels_intervals)), use_mcpat = use_mcpat,
+                    interval = interval_, native_interval = native_interval, level = level, resolution = resolution, time_range = [ time_begin, time_end ])
+      if can_resume(state, params, snapshots):
+        break
+    else:
+      state = None
+    if len(snapshots) < 2:
+      if verbose:
+        print 'Waiting for periodic snapshots in '+resultsdir
+      return finished
+    interval = interval_
+
+    if state is None:
+      mkdir_p(outputdir)
+      copy_static_files(outputdir, levels, verbose = verbose)
+      # Intervals are relative to the first snapshot
+      state = dict(version = STATE_VERSION, params = params, start = snapshots[0], num_intervals = 0, levels = {})
+    start = state['start']
+    num_intervals = (snapshots[-1] - start) / interval
+    native_num_intervals = (snapshots[-1] - start) / native_interval
+    if state['num_intervals'] == num_intervals and not finished:
+      return finished
+
+    if verbose:
+      print 'Intervals %d to %d of %d fs' % (state['num_intervals']+1, num_intervals, interval)
+    levelstate = lambda level: state['levels'].setdefault(level, {})
+
+    # Until the run has completed there is no roi-end snapshot, summarize the intervals we have instead
+    partial = None if 'roi-end' in names else ('periodic-%d' % snapshots[0], 'periodic-%d' % (start + num_intervals*interval))
+    if '1' in levels: level1.createJSONData(resultsdir, outputdir, verbose = verbose, partial = partial, stats = stats)
+    if '2' in levels: level2.createJSONData(native_interval, native_num_intervals, interval, num_intervals, resultsdir, outputdir, title, use_mcpat, verbose = verbose, start_ = start, jobs = jobs, stats_ = stats, state_ = levelstate('2'))
+    if '3' in levels: level3.createJSONData(interval, num_intervals, resultsdir, outputdir, title, verbose = verbose, start = start, stats = stats, state = levelstate('3'))
+    if 'topo' in levels: topology.createJSONData(interval, num_intervals, resultsdir, outputdir, verbose = verbose, start = start, stats = stats, state = levelstate('topo'))
+    if finished:
+      # These need the complete run
+      if 'profile' in levels: profile.createJSONData(resultsdir, outputdir, verbose = verbose)
+      if 'aso' in levels: functionbased.createJSONData(resultsdir, outputdir, title)
+    write_info(outputdir, title, num_intervals, interval, levels, use_mcpat)
+
+  state['num_intervals'] = num_intervals
+  save_state(outputdir, state)
+  return finished
 
 
 if __name__ == '__main__':
   def usage():
-    print 'Usage: '+sys.argv[0]+ ' [-h|--help (help)] [-d <resultsdir (default: .)>] [-j <jobid>] [-t <title>] [-n <num-intervals (default: 1000, all: 0)>] [-i <interval (default: smallest_interval)>] [-o <outputdir (default: viz)>] [--mcpat] [--level <levels (default: %s)>] [--add-level <level>] [-v|--verbose]' % ','.join(levels_default)
+    print 'Usage: '+sys.argv[0]+ ' [-h|--help (help)] [-d <resultsdir (default: .)>] [-j <jobid>] [-t <title>] [-n <num-intervals (default: 1000, all: 0)>] [-i <interval (default: smallest_interval)>] [-o <outputdir (default: viz)>] [--mcpat] [--jobs=<num> (McPAT processes, default: one per CPU)] [--level <levels (default: %s)>] [--add-level <level>] [--resolution=<fs> (time series store: coarsest interval to use)] [--time-range=<begin>:<end> (in fs)] [--incremental (only add new intervals, see %s)] [--follow (keep updating while the simulation runs, which needs -g --stats/async_write=true)] [--poll=<seconds> (default: 60)] [-v|--verbose]' % (','.join(levels_default), STATE_FILENAME)
     sys.exit()
 
   resultsdir = '.'
@@ -34,9 +172,16 @@ if __name__ == '__main__':
   verbose = False
   levels = levels_default
   dircleanup = None
+  resolution = None
+  time_begin = None
+  time_end = None
+  jobs = None
+  incremental = False
+  follow = False
+  poll = 60
 
   try:
-    opts, args = getopt.getopt(sys.argv[1:], "hd:o:t:n:i:vj:", [ "help", "mcpat", "level=", "add-level=", "verbose" ])
+    opts, args = getopt.getopt(sys.argv[1:], "hd:o:t:n:i:vj:", [ "help", "mcpat", "jobs=", "level=", "add-level=", "verbose", "resolution=", "time-range=", "incremental", "follow", "poll=" ])
   except getopt.GetoptError, e:
     print e
     usage()
@@ -50,6 +195,8 @@ if __name__ == '__main__':
       outputdir = a
     if o == '--mcpat':
       use_mcpat = True
+    if o == '--jobs':
+      jobs = int(a)
     if o == '-t':
       title = a
     if o == '-n':
@@ -67,6 +214,17 @@ if __name__ == '__main__':
 	print 'Invalid level', a
 	sys.exit(1)
       levels.append(a)
+    if o == '--resolution':
+      resolution = long(a)
+    if o == '--time-range':
+      time_begin, time_end = [ long(t) if t else None for t in a.split(':') ]
+    if o == '--incremental':
+      incremental = True
+    if o == '--follow':
+      incremental = True
+      follow = True
+    if o == '--poll':
+      poll = float(a)
     if o == '-v' or o == '--verbose':
       verbose = True
     if o == '-j':
@@ -93,14 +251,39 @@ if __name__ == '__main__':
     title = os.path.basename(resultsdir)
   title = title.replace(' ', '_')
 
+  if incremental:
+    while True:
+      try:
+        finished = update(resultsdir, outputdir, title, levels, use_mcpat, interval = interval, resolution = resolution, time_begin = time_begin, time_end = time_end, jobs = jobs, verbose = verbose)
+      except RuntimeError, e:
+        # The statistics can't be read while the simulation runs
+        print e
+        sys.exit(1)
+      except Exception, e:
+        # The simulation may not have written its configuration or statistics yet
+        if not follow:
+          raise
+        print 'Cannot update visualization yet (%s), retrying in %g seconds' % (e, poll)
+        finished = False
+      if not follow or finished:
+        break
+      time.sleep(poll)
+    if verbose:
+      print "Visualizations can be viewed in "+os.path.join(outputdir,'index.html')
+    if dircleanup:
+      shutil.rmtree(dircleanup)
+    sys.exit(0)
+
   try:
     stats = sniper_stats.SniperStats(resultsdir)
-    snapshots = stats.get_snapshots()
+    snapshots = get_snapshot_times(stats, resolution, time_begin, time_end)
   except:
     print "No valid results found in "+resultsdir
     sys.exit(1)
 
-  snapshots = sorted([ long(name.split('-')[1]) for name in snapshots if re.match(r'periodic-[0-9]+', name) ])
+  if len(snapshots) < 2:
+    print "Not enough periodic snapshots found in "+resultsdir
+    sys.exit(1)
   defaultinterval = snapshots[1] - snapshots[0]
   defaultnum_intervals = len(snapshots)-1
 
@@ -139,37 +322,18 @@ if __name__ == '__main__':
   mkdir_p(outputdir)
 
   if '1' in levels: level1.createJSONData(resultsdir, outputdir, verbose = verbose)
-  if '2' in levels: level2.createJSONData(defaultinterval, defaultnum_intervals, interval, num_intervals, resultsdir, outputdir, title, use_mcpat, verbose = verbose)
-  if '3' in levels: level3.createJSONData(interval, num_intervals, resultsdir, outputdir, title, verbose = verbose)
-  if 'topo' in levels: topology.createJSONData(interval, num_intervals, resultsdir, outputdir, verbose = verbose)
+  if '2' in levels: level2.createJSONData(defaultinterval, defaultnum_intervals, interval, num_intervals, resultsdir, outputdir, title, use_mcpat, verbose = verbose, start_ = snapshots[0], jobs = jobs)
+  if '3' in levels: level3.createJSONData(interval, num_intervals, resultsdir, outputdir, title, verbose = verbose, start = snapshots[0])
+  if 'topo' in levels: topology.createJSONData(interval, num_intervals, resultsdir, outputdir, verbose = verbose, start = snapshots[0])
   if 'profile' in levels: profile.createJSONData(resultsdir, outputdir, verbose = verbose)
   if 'aso' in levels: functionbased.createJSONData(resultsdir, outputdir, title)
 
   if verbose:
     print "Write general info about the visualizations in info.txt"
-  info = open(os.path.join(outputdir,'info.txt'), "w")
-  info.write("title = '"+title+"';\n")
-  info.write("num_intervals = '"+str(num_intervals)+"';\n")
-  info.write("interval = '"+str(interval)+"';\n")
-  info.write("use_level2 = "+str(1 if '2' in levels else 0)+";\n")
-  info.write("use_mcpat = "+str(1 if use_mcpat else 0)+";\n")
-  info.write("use_level3 = "+str(1 if '3' in levels else 0)+";\n")
-  info.write("use_topo = "+str(1 if 'topo' in levels else 0)+";\n")
-  info.write("use_profile = "+str(1 if 'profile' in levels else 0)+";\n")
-  info.write("use_aso = "+str(1 if 'aso' in levels else 0)+";\n")
-  info.close()
-
-  asoinfo = open(os.path.join(outputdir,'asoinfo.txt'), "w")
-  asoinfo.write("asoinfo = '"+json.dumps(dict(use_aso=('aso' in levels)))+"';\n")
-  asoinfo.close()
+  write_info(outputdir, title, num_intervals, interval, levels, use_mcpat)
 
   # Now copy all static files as well
-  if outputdir != HOME:
-    if verbose:
-      print "Copy files to output directory "+outputdir
-    os.system('cd "%s"; tar c index.html rickshaw/ levels/level2/*html levels/level3/*html levels/topology/*html levels/profile/*html css/ images/ scripts/ levels/level2/css levels/level2/javascript/ levels/level3/javascript | tar x -C %s' % (HOME, outputdir))
-    if 'aso' in levels:
-      os.system('cd "%s"; tar c flot/ levels/functionbased/functionbased.html levels/functionbased/*js css/ levels/functionbased/doxygen | tar x -C %s' % (HOME, outputdir))
+  copy_static_files(outputdir, levels, verbose = verbose)
   if verbose:
     print "Visualizations can be viewed in "+os.path.join(outputdir,'index.html')
 